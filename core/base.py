@@ -68,15 +68,26 @@ class AwsBase(object):
                                    filters,
                                    not_found_token='NotFound'):
 
-        resources = self.get_and_filter_resources_by_matcher(
-            filter_function, filters, not_found_token)
+        (argument, resource_id), = filters.items()
 
-        if resources:
-            for resource in resources:
-                if resource.id == filters.values()[0]:
-                    return resource
+        resources = self.get_resources_by_ids(
+            filter_function, argument, [resource_id], not_found_token)
 
-        return None
+        return resources.get(resource_id)
+
+    def get_resources_by_ids(self, filter_function, argument,
+                             resource_ids, not_found_token='NotFound'):
+        """Resolves many resource IDs with a single describe call.
+
+        :param filter_function: The boto describe function.
+        :param argument: The filter_function argument that takes IDs.
+        :param resource_ids: A list of resource IDs.
+        :returns a dict of resource ID to resource, for the IDs that exist.
+        """
+
+        return ec2_utils.describe_by_ids(
+            filter_function, argument, resource_ids,
+            not_found_token=not_found_token)
 
     def get_related_targets_and_types(self, relationships):
         """
@@ -154,6 +165,9 @@ class AwsBaseRelationship(AwsBase):
 
         if self.use_source_external_resource_naively() \
                 or self.associate():
+            ec2_utils.invalidate_described(
+                self.client,
+                [self.source_resource_id, self.target_resource_id])
             return self.post_associate()
 
         raise NonRecoverableError(
@@ -191,6 +205,9 @@ class AwsBaseRelationship(AwsBase):
 
         if self.disassociate_external_resource_naively() \
                 or self.disassociate():
+            ec2_utils.invalidate_described(
+                self.client,
+                [self.source_resource_id, self.target_resource_id])
             return self.post_disassociate()
 
         raise NonRecoverableError(
@@ -253,6 +270,10 @@ class AwsBaseNode(AwsBase):
         self.required_properties = required_properties
         self.get_all_handler = {'function': dummy, 'argument': ''}
         self.not_found_error = ''
+        # the boto object returned by create, or found for an external
+        # resource, and the attributes of it to keep as runtime properties
+        self.resource = None
+        self.resource_runtime_properties = []
 
     def creation_validation(self):
         """ This validates all VPC Nodes before bootstrap.
@@ -298,7 +319,9 @@ class AwsBaseNode(AwsBase):
         if not self.is_external_resource:
             return False
 
-        if not self.get_resource():
+        self.resource = self.get_resource()
+
+        if not self.resource:
             self.raise_forbidden_external_resource(self.resource_id)
 
         ctx.logger.info(
@@ -330,6 +353,7 @@ class AwsBaseNode(AwsBase):
             self.raise_forbidden_external_resource(self.resource_id)
 
         if self.delete_external_resource_naively() or self.delete():
+            ec2_utils.invalidate_described(self.client, [self.resource_id])
             return self.post_delete()
 
         raise NonRecoverableError(
@@ -359,6 +383,20 @@ class AwsBaseNode(AwsBase):
 
         return matches
 
+    def get_resources(self, list_of_ids):
+        """Resolves many resources of this node's type at once.
+
+        :param list_of_ids: A list of resource IDs.
+        :returns a dict of resource ID to resource, for the IDs that exist.
+        """
+
+        return self.get_resources_by_ids(
+            self.get_all_handler['function'],
+            self.get_all_handler['argument'],
+            list_of_ids,
+            not_found_token=self.not_found_error
+        )
+
     def get_resource(self):
 
         resource = self.filter_for_single_resource(
@@ -394,6 +432,7 @@ class AwsBaseNode(AwsBase):
     def post_create(self):
 
         ec2_utils.set_external_resource_id(self.resource_id, ctx.instance)
+        self.set_runtime_properties_from_resource()
 
         ctx.logger.info(
             'Added {0} {1} to Cloudify.'
@@ -401,6 +440,18 @@ class AwsBaseNode(AwsBase):
 
         return True
 
+    def set_runtime_properties_from_resource(self):
+        """Keeps resource_runtime_properties from the object returned by
+        create, so they do not have to be described again.
+        """
+
+        if self.resource is None:
+            return
+
+        for property_name in self.resource_runtime_properties:
+            ctx.instance.runtime_properties[property_name] = \
+                getattr(self.resource, property_name)
+
     def post_start(self):
 
         resource = self.get_resource()
@@ -412,6 +463,8 @@ class AwsBaseNode(AwsBase):
 
         ec2_utils.unassign_runtime_property_from_resource(
             constants.EXTERNAL_RESOURCE_ID, ctx.instance)
+        ec2_utils.unassign_runtime_properties_from_resource(
+            self.resource_runtime_properties, ctx.instance)
 
         ctx.logger.info(
             'Removed {0} {1} from Cloudify.'
@@ -15,20 +15,152 @@
 
 # Builtin Imports
 import os
+import stat
+import time
+import hashlib
+import weakref
+import calendar
+import collections
 import ConfigParser
 
 # Third-party Imports
+from boto import config
+from boto import exception
+from boto.auth import HmacAuthV4Handler
 from boto.ec2 import get_region
 from boto.ec2 import EC2Connection
 from boto.ec2.elb import ELBConnection
+from boto.provider import Provider
 from boto.regioninfo import RegionInfo
 from boto.ec2.elb import connect_to_region as connect_to_elb_region
+from boto.sts import STSConnection
+from boto.utils import parse_ts
 
 # Cloudify Imports
 from ec2 import utils
 from ec2 import constants
+from cloudify.state import current_ctx
 from cloudify.exceptions import NonRecoverableError
 
+# Parsed config files by path, along with the (mtime, size) of the file
+# they were parsed from.
+_config_file_cache = {}
+
+# RegionInfo objects by (region name, endpoint override).
+_region_cache = {}
+
+# Connections opened by each operation, by the operation's context.
+_operation_clients = weakref.WeakKeyDictionary()
+
+# The provider that resolved the credentials of connections
+# without an aws_config, once it found any.
+_default_providers = {}
+
+# Assumed role credentials by (role ARN, external ID, access key ID),
+# along with the time they expire at.
+_assumed_role_credentials = {}
+
+# Derived SigV4 signing keys by a hash of the credentials, date, region
+# and service, least recently used first.
+_signing_keys = collections.OrderedDict()
+
+
+class CachedSigningKeyHandler(HmacAuthV4Handler):
+    """Signs requests like boto's SigV4 handler, but derives the
+    signing key once per day, region and service, instead of with four
+    HMACs for every request.
+    """
+
+    def signature(self, http_request, string_to_sign):
+        secret_key = self._provider.secret_key
+        scope = (http_request.timestamp, http_request.region_name,
+                 http_request.service_name)
+        key = hashlib.sha256('\0'.join(
+            (self._provider.access_key, secret_key) + scope
+        ).encode('utf-8')).hexdigest()
+        signing_key = _signing_keys.pop(key, None)
+        if signing_key is None:
+            signing_key = self._sign(('AWS4' + secret_key).encode('utf-8'),
+                                     http_request.timestamp)
+            for part in scope[1:] + ('aws4_request',):
+                signing_key = self._sign(signing_key, part)
+        _signing_keys[key] = signing_key
+        while len(_signing_keys) > constants.SIGNING_KEY_CACHE_SIZE:
+            _signing_keys.popitem(last=False)
+        return self._sign(signing_key, string_to_sign, hex=True)
+
+
+def _get_region(region_name, endpoint=None):
+    """Returns the RegionInfo for a region name, optionally with its
+    endpoint overridden. Resolving a region reloads boto's endpoint
+    list, so every region is only resolved once.
+    """
+
+    key = (region_name, endpoint)
+    if key not in _region_cache:
+        region_object = get_region(region_name)
+        if region_object and endpoint:
+            region_object.endpoint = endpoint
+        _region_cache[key] = region_object
+    return _region_cache[key]
+
+
+def _get_default_credentials():
+    """Returns the credentials that boto finds on its own, e.g. in the
+    environment or the instance metadata of the manager. They are only
+    looked up once per process, and boto refreshes instance role
+    credentials shortly before they expire.
+    """
+
+    provider = _default_providers.get('aws')
+    if provider is None:
+        provider = Provider('aws')
+        if not provider.access_key:
+            return {}
+        _default_providers['aws'] = provider
+
+    return {
+        'aws_access_key_id': provider.access_key,
+        'aws_secret_access_key': provider.secret_key,
+        'security_token': provider.security_token
+    }
+
+
+def _get_assumed_role_credentials(role_arn, external_id, credentials):
+    """Returns temporary credentials of a role, e.g. in the account
+    of a peer VPC. The session is reused until shortly before it expires.
+
+    :param role_arn: The ARN of the role to assume.
+    :param external_id: The external ID the role requires, if any.
+    :param credentials: The credentials to assume the role with.
+    :raises NonRecoverableError: If the role cannot be assumed.
+    """
+
+    key = (role_arn, external_id, credentials.get('aws_access_key_id'))
+    cached = _assumed_role_credentials.get(key)
+    if cached and cached[0] - time.time() > \
+            constants.CREDENTIALS_REFRESH_WINDOW:
+        return cached[1].copy()
+
+    try:
+        role = STSConnection(**credentials).assume_role(
+            role_arn, constants.ASSUMED_ROLE_SESSION_NAME,
+            duration_seconds=constants.ASSUMED_ROLE_DURATION,
+            external_id=external_id)
+    except exception.BotoServerError as e:
+        raise NonRecoverableError(
+            'Unable to assume role {0}: {1}'.format(role_arn, str(e)))
+
+    role_credentials = {
+        'aws_access_key_id': role.credentials.access_key,
+        'aws_secret_access_key': role.credentials.secret_key,
+        'security_token': role.credentials.session_token
+    }
+    expires_at = calendar.timegm(
+        parse_ts(role.credentials.expiration).timetuple())
+    _assumed_role_credentials[key] = (expires_at, role_credentials)
+    return role_credentials.copy()
+
 
 class EC2ConnectionClient():
     """Provides functions for getting the EC2 Client
@@ -37,32 +169,78 @@ class EC2ConnectionClient():
     def __init__(self):
         self.connection = None
 
-    def client(self):
+    def client(self, aws_config=None):
         """Represents the EC2Connection Client
+
+        :param aws_config: An aws_config to use instead of the one in the
+        current node's properties, e.g. outside of an operation.
         """
 
-        aws_config_property = (self._get_aws_config_property() or
+        aws_config_property = (self._get_aws_config_property(aws_config) or
                                self._get_aws_config_from_file())
+        return self._operation_client(aws_config_property)
+
+    def _operation_client(self, aws_config_property):
+        """Returns the connection the current operation already opened
+        with this config, so that an operation and all of its helpers
+        share a single connection.
+        """
+
+        try:
+            operation_ctx = current_ctx.get_ctx()
+        except RuntimeError:
+            return self._cache_signing_keys(self._connect(aws_config_property))
+
+        key = (type(self),
+               tuple(sorted(aws_config_property.items()))
+               if aws_config_property else None)
+        clients = _operation_clients.setdefault(operation_ctx, {})
+        if key not in clients:
+            clients[key] = self._cache_signing_keys(
+                self._connect(aws_config_property))
+        return clients[key]
+
+    def _cache_signing_keys(self, client):
+        """Makes a SigV4 connection reuse derived signing keys. If boto
+        no longer keeps its handler where it is expected, the connection
+        is left to sign requests on its own.
+        """
+
+        auth_handler = getattr(client, '_auth_handler', None)
+        if type(auth_handler) is HmacAuthV4Handler:
+            client._auth_handler = CachedSigningKeyHandler(
+                client.host, config, client.provider,
+                service_name=auth_handler.service_name,
+                region_name=auth_handler.region_name)
+        return client
+
+    def _connect(self, aws_config_property):
+        """Opens a new EC2Connection
+        """
+
         if not aws_config_property:
-            return EC2Connection()
+            return EC2Connection(**self.credentials_cleanup({}))
         elif aws_config_property.get('ec2_region_name'):
-            region_object = \
-                get_region(aws_config_property['ec2_region_name'])
             aws_config = aws_config_property.copy()
-            if region_object and 'ec2_region_endpoint' in aws_config_property:
-                region_object.endpoint = \
-                    aws_config_property['ec2_region_endpoint']
-            aws_config['region'] = region_object
+            aws_config['region'] = _get_region(
+                aws_config_property['ec2_region_name'],
+                aws_config_property.get('ec2_region_endpoint'))
         else:
             aws_config = aws_config_property.copy()
 
         aws_config = self.aws_config_cleanup(aws_config)
 
-        return EC2Connection(**aws_config)
-
-    def _get_aws_config_property(self):
-        node_properties = \
-            utils.get_instance_or_source_node_properties()
+        return EC2Connection(**self.credentials_cleanup(aws_config))
+
+    def _get_aws_config_property(self, aws_config=None):
+        if aws_config:
+            return aws_config
+        try:
+            node_properties = \
+                utils.get_instance_or_source_node_properties()
+        except RuntimeError:
+            # Not in an operation, e.g. in a workflow.
+            return None
         return node_properties[constants.AWS_CONFIG_PROPERTY]
 
     def _get_aws_config_from_file(self):
@@ -77,12 +255,22 @@ class EC2ConnectionClient():
         return os.environ.get(constants.AWS_CONFIG_PATH_ENV_VAR_NAME)
 
     def _parse_config_file(self, path):
-        """Parse and validate Boto cfg file
+        """Parse and validate Boto cfg file, unless it was already
+        parsed and has not changed since
         """
         path = str(path)
-        if not os.path.isfile(path):
+        try:
+            config_stat = os.stat(path)
+        except OSError:
+            config_stat = None
+        if not config_stat or not stat.S_ISREG(config_stat.st_mode):
             raise NonRecoverableError('no aws config file at {0}'.format(path))
 
+        stat_key = (config_stat.st_mtime, config_stat.st_size)
+        cached = _config_file_cache.get(path)
+        if cached and cached[0] == stat_key:
+            return cached[1].copy()
+
         parser = ConfigParser.ConfigParser()
         parser.read(path)
 
@@ -114,7 +302,8 @@ class EC2ConnectionClient():
             raise NonRecoverableError("Unsupported Boto option(s): {0}".
                                       format(invalid_options))
 
-        return config
+        _config_file_cache[path] = (stat_key, config)
+        return config.copy()
 
     def aws_config_cleanup(self, aws_config):
 
@@ -134,32 +323,49 @@ class EC2ConnectionClient():
 
         return aws_config
 
+    def credentials_cleanup(self, aws_config):
+        """Replaces the role keys of an aws_config with the credentials
+        of the role, and fills in cached credentials when there are
+        none, so that boto does not look them up for every connection.
+        """
+
+        role_arn = aws_config.pop('role_arn', None)
+        external_id = aws_config.pop('role_external_id', None) or None
+
+        if not aws_config.get('aws_access_key_id'):
+            aws_config.update(_get_default_credentials())
+
+        if role_arn:
+            aws_config.update(_get_assumed_role_credentials(
+                role_arn, external_id,
+                dict((key, aws_config.get(key))
+                     for key in constants.AWS_CREDENTIALS)))
+
+        return aws_config
+
 
 class ELBConnectionClient(EC2ConnectionClient):
 
-    def client(self):
-        """Represents the ELBConnection Client
+    def _connect(self, aws_config_property):
+        """Opens a new ELBConnection
         """
 
-        aws_config_property = (self._get_aws_config_property() or
-                               self._get_aws_config_from_file())
         if not aws_config_property:
-            return ELBConnection()
+            return ELBConnection(**self.credentials_cleanup({}))
 
         aws_config = aws_config_property.copy()
 
         if aws_config_property.get('elb_region_name') and \
                 aws_config_property.get('elb_region_endpoint'):
-            region_object = \
-                get_region(aws_config_property['elb_region_name'])
-            region_object.endpoint = \
-                aws_config_property['elb_region_endpoint']
-            aws_config['region'] = region_object
+            aws_config['region'] = _get_region(
+                aws_config_property['elb_region_name'],
+                aws_config_property['elb_region_endpoint'])
         elif aws_config_property.get('elb_region_name') and \
                 not aws_config_property.get('elb_region_endpoint'):
             aws_config['region'] = aws_config_property['elb_region_name']
 
-        aws_config = self.aws_config_cleanup(aws_config)
+        aws_config = self.credentials_cleanup(
+            self.aws_config_cleanup(aws_config))
 
         if 'region' in aws_config:
             if type(aws_config['region']) is RegionInfo:
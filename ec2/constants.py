@@ -18,11 +18,20 @@
 INSTANCE_STATE_STARTED = 16
 INSTANCE_STATE_TERMINATED = 48
 INSTANCE_STATE_STOPPED = 80
+INSTANCE_REACHABILITY_PASSED = 'passed'
+INSTANCE_REACHABILITY_FAILED = 'failed'
 
 AWS_TYPE_PROPERTY = 'external_type'  # resource's openstack type
 
 INSTANCE_REQUIRED_PROPERTIES = ['image_id', 'instance_type']
 
+USERDATA_MAX_SIZE = 16384  # bytes EC2 accepts, before base64 encoding
+USERDATA_GZIP_SIZE = 12288  # bytes of user data that are gzip compressed
+USERDATA_CACHE_SIZE = 128  # user data kept in memory
+USERDATA_LOG_SIZE = 256  # characters of user data that are logged
+# user data EC2Config runs on Windows, which must not be compressed
+USERDATA_WINDOWS_TAGS = ['<powershell>', '<script>']
+
 INSTANCE_INTERNAL_ATTRIBUTES = \
     ['private_dns_name', 'public_dns_name',
      'public_ip_address', 'ip']
@@ -30,6 +39,12 @@ INSTANCE_INTERNAL_ATTRIBUTES = \
 INSTANCE_INTERNAL_ATTRIBUTES_POST_CREATE = \
     ['vpc_id', 'subnet_id', 'placement']
 
+# runtime properties named differently from the boto instance attribute
+INSTANCE_RUNTIME_PROPERTY_ATTRIBUTES = {
+    'ip': 'private_ip_address',
+    'public_ip_address': 'ip_address'
+}
+
 RUN_INSTANCE_PARAMETERS = {
     'image_id': None, 'key_name': None, 'security_groups': None,
     'user_data': None, 'addressing_type': None,
@@ -47,10 +62,70 @@ RUN_INSTANCE_PARAMETERS = {
 INSTANCE_SECURITY_GROUP_RELATIONSHIP = 'instance_connected_to_security_group'
 INSTANCE_KEYPAIR_RELATIONSHIP = 'instance_connected_to_keypair'
 INSTANCE_SUBNET_RELATIONSHIP = 'instance_contained_in_subnet'
+INSTANCE_SUBNET_CONNECTED_RELATIONSHIP = 'instance_connected_to_subnet'
 SECURITY_GROUP_VPC_RELATIONSHIP = 'security_group_contained_in_vpc'
 
+# The relationship types of this plugin that can connect a node to a
+# resource of an AWS type. Relationships of the other types of this plugin
+# are never checked for targets of that AWS type.
+AWS_RELATIONSHIP_PREFIX = 'cloudify.aws.relationships.'
+AWS_TYPE_RELATIONSHIPS = {
+    'keypair': [INSTANCE_KEYPAIR_RELATIONSHIP]
+}
+
 ADMIN_PASSWORD_PROPERTY = 'password'  # the server's password
 
+# warm pool of stopped instances, shared by instances with the same
+# WARM_POOL_KEY_PARAMETERS
+WARM_POOL_SIZE_PROPERTY = 'warm_pool_size'
+WARM_POOL_TAG = 'cloudify_warm_pool'
+WARM_POOL_LEASE_TAG = 'cloudify_warm_pool_lease'
+WARM_POOL_OWNER_TAG = 'cloudify_warm_pool_owner'
+WARM_POOL_INTERFACE = 'cloudify.interfaces.warm_pool'
+WARM_POOL_KEY_PARAMETERS = [
+    'image_id', 'instance_type', 'subnet_id', 'security_group_ids',
+    'security_groups', 'key_name', 'placement', 'user_data',
+    'instance_profile_name', 'instance_profile_arn', 'ebs_optimized'
+]
+WARM_POOL_STATES = ['pending', 'running', 'stopping', 'stopped']
+WARM_POOL_LEASE_SETTLE = 2  # seconds before a lease is read back
+
+# run_instances errors that another zone or instance type may not have
+LAUNCH_CAPACITY_ERRORS = ['InsufficientInstanceCapacity', 'Unsupported']
+LAUNCH_CAPACITY_EXHAUSTED_TTL = 300  # seconds to try other launches first
+
+INSTANCE_NODE_TYPE = 'cloudify.aws.nodes.Instance'
+BATCH_INSTANCE_IDS_LIMIT = 1000  # instance IDs per EC2 request
+BATCH_UPDATE_ATTEMPTS = 5  # node instance updates before giving up
+NODE_INSTANCE_STATE_STARTED = 'started'
+NODE_INSTANCE_STATE_STOPPED = 'stopped'
+NODE_INSTANCE_STATE_DELETED = 'deleted'
+DESCRIBE_PAGE_SIZE = 1000  # results per page of a paginated describe
+# DescribeInstances response paths of boto Instance attributes, that
+# can be described without building boto Instance objects
+INSTANCE_FIELD_PATHS = {
+    'id': 'instanceId',
+    'state': 'instanceState/name',
+    'state_code': 'instanceState/code',
+    'image_id': 'imageId',
+    'instance_type': 'instanceType',
+    'key_name': 'keyName',
+    'launch_time': 'launchTime',
+    'placement': 'placement/availabilityZone',
+    'private_dns_name': 'privateDnsName',
+    'public_dns_name': 'dnsName',
+    'private_ip_address': 'privateIpAddress',
+    'ip_address': 'ipAddress',
+    'subnet_id': 'subnetId',
+    'vpc_id': 'vpcId'
+}
+INSTANCE_INTEGER_FIELDS = ['state_code']
+IMAGE_AVAILABLE = 'available'
+IMAGE_CACHE_SIZE = 256  # AMIs kept in memory
+IMAGE_CACHE_TTL = 3600  # seconds until an available AMI is checked again
+DESCRIBE_CACHE_TTL = 30  # seconds a shared describe result is reused
+DESCRIBE_CACHE_LOCKS = 64  # lock files of the shared describe cache
+
 # securitygroup module constants
 SECURITY_GROUP_REQUIRED_PROPERTIES = ['description', 'rules']
 
@@ -65,6 +140,7 @@ ELB_REQUIRED_PROPERTIES = ['elb_name', 'zones', 'listeners']
 # ebs module constants
 ZONE = 'zone'
 VOLUME_REQUIRED_PROPERTIES = ['size', ZONE, 'device']
+VOLUME_INSTANCE_RELATIONSHIP = 'volume_connected_to_instance'
 VOLUME_SNAPSHOT_ATTRIBUTE = 'snapshots_ids'
 VOLUME_AVAILABLE = 'available'
 VOLUME_CREATING = 'creating'
@@ -72,9 +148,16 @@ VOLUME_IN_USE = 'in-use'
 
 # keypair module constants
 KEYPAIR_REQUIRED_PROPERTIES = ['private_key_path']
+KEYPAIR_FINGERPRINT = 'fingerprint'
 
 # elastic ip module contants
 ALLOCATION_ID = 'allocation_id'
+ASSOCIATION_ID = 'association_id'
+ADDRESS_POOL_PROPERTY = 'address_pool'
+POOLED_ADDRESS = 'pooled_address'
+ADDRESS_POOL_CLAIM_TTL = 3600  # seconds an unassociated claim is kept
+ADDRESS_POOL_CLAIM_TAG = 'cloudify_address_pool_claim'
+ADDRESS_POOL_CLAIM_SETTLE = 2  # seconds before a claim is read back
 
 # config
 AWS_CONFIG_PROPERTY = 'aws_config'
@@ -83,6 +166,16 @@ EXTERNAL_RESOURCE_ID = 'aws_resource_id'
 NODE_INSTANCE = 'node-instance'
 RELATIONSHIP_INSTANCE = 'relationship-instance'
 AWS_CONFIG_PATH_ENV_VAR_NAME = "AWS_CONFIG_PATH"
+AWS_CREDENTIALS = ['aws_access_key_id', 'aws_secret_access_key',
+                   'security_token']
+ASSUMED_ROLE_SESSION_NAME = 'cloudify-aws-plugin'
+ASSUMED_ROLE_DURATION = 3600  # seconds an assumed role session is valid
+CREDENTIALS_REFRESH_WINDOW = 300  # seconds before expiry to refresh
+SIGNING_KEY_CACHE_SIZE = 64  # derived SigV4 signing keys kept in memory
+# optional file that persists AMI metadata between processes
+AWS_IMAGE_CACHE_PATH_ENV_VAR_NAME = "AWS_IMAGE_CACHE_PATH"
+# optional directory that shares describe results between processes
+AWS_DESCRIBE_CACHE_PATH_ENV_VAR_NAME = "AWS_DESCRIBE_CACHE_PATH"
 
 # Boto config schema (section > options)
 BOTO_CONFIG_SCHEMA = {
@@ -66,7 +66,7 @@ def create(args, **_):
 
     create_volume_args = dict(
         size=ctx.node.properties['size'],
-        zone=ctx.node.properties[constants.ZONE]
+        zone=_get_volume_zone()
     )
 
     create_volume_args.update(args)
@@ -125,12 +125,14 @@ def attach(**_):
         utils.get_external_resource_id_or_raise(
             'attach volume', ctx.target.instance)
 
-    if ctx.source.node.properties[constants.ZONE] not in \
+    volume_zone = ctx.source.instance.runtime_properties.get(
+        constants.ZONE, ctx.source.node.properties[constants.ZONE])
+    if volume_zone not in \
             ctx.target.instance.runtime_properties.get('placement'):
         ctx.logger.info(
             'Volume Zone {0} and Instance Zone {1} do not match. '
             'This may lead to an error.'.format(
-                ctx.source.node.properties[constants.ZONE],
+                volume_zone,
                 ctx.target.instance.runtime_properties.get('placement')
             )
         )
@@ -326,6 +328,40 @@ def _delete_external_volume():
     return True
 
 
+def _get_volume_zone():
+    """Gets the zone to create the volume in, which is the zone of the
+    instance the volume is connected to, if the instance was already
+    placed, and otherwise the zone node property.
+
+    :raises NonRecoverableError: If there is no zone for the volume.
+    """
+
+    zone = ctx.node.properties[constants.ZONE]
+
+    instance_zones = []
+    index = utils.get_relationship_index(ctx.instance)
+    for type_name, relationships in index['by_type'].items():
+        if constants.VOLUME_INSTANCE_RELATIONSHIP in type_name:
+            instance_zones.extend(
+                r.target.instance.runtime_properties['placement']
+                for _, r in relationships
+                if r.target.instance.runtime_properties.get('placement'))
+
+    if instance_zones:
+        if zone and zone != instance_zones[0]:
+            ctx.logger.info(
+                'Creating volume in zone {0} of its instance instead of {1}.'
+                .format(instance_zones[0], zone))
+        zone = instance_zones[0]
+
+    if not zone:
+        raise NonRecoverableError(
+            'Unable to create volume, because it has no zone '
+            'and is not connected to an instance with a placement.')
+
+    return zone
+
+
 def _attach_external_volume_or_instance(instance_id):
     """Pretends to attach an external EBC volume with an EC2 instance
     but if one was not created by Cloudify, it just sets runtime_properties
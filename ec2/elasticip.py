@@ -13,6 +13,15 @@
 #    * See the License for the specific language governing permissions and
 #    * limitations under the License.
 
+# Built-in Imports
+import os
+import json
+import time
+import random
+import hashlib
+from contextlib import closing
+from contextlib import contextmanager
+
 # Third-party Imports
 import boto.exception
 
@@ -55,6 +64,9 @@ def allocate(**_):
     if _allocate_external_elasticip():
         return
 
+    if _allocate_elasticip_from_pool(ec2_client):
+        return
+
     ctx.logger.debug('Attempting to allocate elasticip.')
 
     provider_variables = utils.get_provider_variables()
@@ -81,11 +93,16 @@ def allocate(**_):
 
 
 @operation
-def release(**_):
+def release(verify=False, **_):
     """This releases an Elastic IP created by Cloudify
     in the connected account.
+
+    :param verify: Describe the address after releasing it,
+        and retry until it is no longer in the account.
     """
 
+    ec2_client = connection.EC2ConnectionClient().client()
+
     elasticip = \
         utils.get_external_resource_id_or_raise(
             'release elasticip', ctx.instance)
@@ -93,37 +110,44 @@ def release(**_):
     if _release_external_elasticip():
         return
 
-    address_object = _get_address_object_by_id(elasticip)
-
-    if not address_object:
-        raise NonRecoverableError(
-            'Unable to release elasticip. Elasticip not in account.')
+    if _release_elasticip_to_pool(elasticip):
+        return
 
     ctx.logger.debug('Attempting to release an Elastic IP.')
 
+    allocation_id = \
+        ctx.instance.runtime_properties.get(constants.ALLOCATION_ID)
+
+    if allocation_id:
+        release_args = dict(allocation_id=allocation_id)
+    else:
+        release_args = dict(public_ip=elasticip)
+
     try:
-        deleted = address_object.delete()
-    except (boto.exception.EC2ResponseError,
-            boto.exception.BotoServerError) as e:
+        deleted = ec2_client.release_address(**release_args)
+    except boto.exception.EC2ResponseError as e:
+        if _address_not_found(e):
+            raise NonRecoverableError(
+                'Unable to release elasticip. Elasticip not in account.')
+        raise NonRecoverableError('{0}'.format(str(e)))
+    except boto.exception.BotoServerError as e:
         raise NonRecoverableError('{0}'.format(str(e)))
 
     if not deleted:
         raise NonRecoverableError(
             'Elastic IP {0} deletion failed for an unknown reason.'
-            .format(address_object.public_ip))
+            .format(elasticip))
 
-    address = _get_address_object_by_id(address_object.public_ip)
-
-    if not address:
-        for runtime_property in \
-                [constants.ALLOCATION_ID,
-                 constants.EXTERNAL_RESOURCE_ID]:
-            utils.unassign_runtime_property_from_resource(
-                runtime_property, ctx.instance)
-    else:
+    if verify and _get_address_object_by_id(elasticip):
         return ctx.operation.retry(
             message='Elastic IP not released. Retrying...')
 
+    for runtime_property in \
+            [constants.ALLOCATION_ID,
+             constants.EXTERNAL_RESOURCE_ID]:
+        utils.unassign_runtime_property_from_resource(
+            runtime_property, ctx.instance)
+
 
 @operation
 def associate(**_):
@@ -143,6 +167,8 @@ def associate(**_):
     if _associate_external_elasticip_or_instance(elasticip):
         return
 
+    _check_address_pool_claim(ec2_client, elasticip)
+
     kw = dict(instance_id=instance_id, public_ip=elasticip)
 
     if constants.ALLOCATION_ID in ctx.target.instance.runtime_properties:
@@ -156,7 +182,7 @@ def associate(**_):
         .format(kw))
 
     try:
-        ec2_client.associate_address(**kw)
+        address_object = ec2_client.associate_address_object(**kw)
     except (boto.exception.EC2ResponseError,
             boto.exception.BotoServerError) as e:
         raise NonRecoverableError('{0}'.format(str(e)))
@@ -167,15 +193,21 @@ def associate(**_):
     ctx.source.instance.runtime_properties['public_ip_address'] = elasticip
     ctx.target.instance.runtime_properties['instance_id'] = \
         ctx.source.instance.runtime_properties[constants.EXTERNAL_RESOURCE_ID]
+    if address_object.association_id:
+        ctx.target.instance.runtime_properties[constants.ASSOCIATION_ID] = \
+            address_object.association_id
     vpc_id = ctx.source.instance.runtime_properties.get('vpc_id')
     if vpc_id:
         ctx.target.instance.runtime_properties['vpc_id'] = vpc_id
 
 
 @operation
-def disassociate(**_):
+def disassociate(verify=False, **_):
     """ Disassocates an Elastic IP created by Cloudify from an EC2 Instance
     that was also created by Cloudify.
+
+    :param verify: Describe the address before disassociating it,
+        instead of trusting the runtime properties set by associate.
     """
     ec2_client = connection.EC2ConnectionClient().client()
 
@@ -189,29 +221,42 @@ def disassociate(**_):
     if _disassociate_external_elasticip_or_instance():
         return
 
-    elasticip_object = _get_address_object_by_id(elasticip)
+    association_id = \
+        ctx.target.instance.runtime_properties.get(constants.ASSOCIATION_ID)
 
-    if not elasticip_object:
-        raise NonRecoverableError(
-            'no matching elastic ip in account: {0}'.format(elasticip))
+    # VPC addresses are disassociated by association id. If associate did
+    # not record it, fall back to reading it from the address.
+    if verify or (not association_id and constants.ALLOCATION_ID in
+                  ctx.target.instance.runtime_properties):
+        elasticip_object = _get_address_object_by_id(elasticip)
+        if not elasticip_object:
+            raise NonRecoverableError(
+                'no matching elastic ip in account: {0}'.format(elasticip))
+        association_id = elasticip_object.association_id
 
     disassociate_args = dict(
-        public_ip=elasticip_object.public_ip,
-        association_id=elasticip_object.association_id
+        public_ip=elasticip,
+        association_id=association_id
     )
 
     ctx.logger.debug('Disassociating Elastic IP {0}'.format(elasticip))
 
     try:
         ec2_client.disassociate_address(**disassociate_args)
-    except (boto.exception.EC2ResponseError,
-            boto.exception.BotoServerError) as e:
+    except boto.exception.EC2ResponseError as e:
+        if _address_not_found(e):
+            raise NonRecoverableError(
+                'no matching elastic ip in account: {0}'.format(elasticip))
+        raise NonRecoverableError('{0}'.format(str(e)))
+    except boto.exception.BotoServerError as e:
         raise NonRecoverableError('{0}'.format(str(e)))
 
     utils.unassign_runtime_property_from_resource(
         'public_ip_address', ctx.source.instance)
     utils.unassign_runtime_property_from_resource(
         'instance_id', ctx.target.instance)
+    utils.unassign_runtime_property_from_resource(
+        constants.ASSOCIATION_ID, ctx.target.instance)
     if ctx.source.instance.runtime_properties.get('vpc_id'):
         utils.unassign_runtime_property_from_resource(
             'vpc_id', ctx.target.instance)
@@ -261,6 +306,301 @@ def _release_external_elasticip():
     return True
 
 
+def _allocate_elasticip_from_pool(ec2_client):
+    """Claims an unassociated Elastic IP from the address_pool node property
+    instead of allocating a new one. Addresses that are claimed, but not
+    associated yet, are not handed out again.
+
+    :return False: No pool, or no free address in it. Continue operation.
+    :return True: Claimed a pool address. Set runtime_properties.
+        Ignore operation.
+    """
+
+    address_pool = ctx.node.properties.get(constants.ADDRESS_POOL_PROPERTY)
+
+    if not address_pool:
+        return False
+
+    claimant = _get_address_pool_claimant(ctx.instance)
+
+    with _address_pool_claims(address_pool) as claims:
+        claimed_on_host = set(claims)
+
+    free_addresses = [
+        address for address in
+        _get_unassociated_addresses(ec2_client, address_pool)
+        if address.public_ip not in claimed_on_host]
+    claim_tags = _get_address_claim_tags(
+        ec2_client, [address.allocation_id for address in free_addresses])
+    free_addresses = [
+        address for address in free_addresses
+        if not _get_tag_claimant(claim_tags.get(address.allocation_id))]
+
+    # Concurrent claims start with different addresses, so that they
+    # rarely compete for the same one.
+    random.shuffle(free_addresses)
+    address_object = next(
+        (address for address in free_addresses
+         if _claim_pool_address(ec2_client, address, claimant)), None)
+
+    if not address_object:
+        ctx.logger.info(
+            'No free address in address_pool, '
+            'allocating a new elasticip.')
+        return False
+
+    with _address_pool_claims(address_pool) as claims:
+        claims[address_object.public_ip] = {
+            'claimed_by': claimant,
+            'claimed_at': time.time()
+        }
+
+    if address_object.allocation_id:
+        ctx.instance.runtime_properties[constants.ALLOCATION_ID] = \
+            address_object.allocation_id
+    ctx.instance.runtime_properties[constants.POOLED_ADDRESS] = True
+
+    utils.set_external_resource_id(
+        address_object.public_ip, ctx.instance, external=False)
+    return True
+
+
+def _release_elasticip_to_pool(elasticip):
+    """Returns an Elastic IP claimed from the address_pool to the pool
+    instead of releasing it from the account.
+
+    :return False: Not a pool address. Continue operation.
+    :return True: Pool address. Unset runtime_properties. Ignore operation.
+    """
+
+    if not ctx.instance.runtime_properties.get(constants.POOLED_ADDRESS):
+        return False
+
+    address_pool = ctx.node.properties.get(constants.ADDRESS_POOL_PROPERTY)
+
+    with _address_pool_claims(address_pool or []) as claims:
+        claims.pop(elasticip, None)
+
+    allocation_id = ctx.instance.runtime_properties.get(
+        constants.ALLOCATION_ID)
+    if allocation_id:
+        _remove_address_claim_tag(
+            connection.EC2ConnectionClient().client(), allocation_id,
+            _get_address_pool_claimant(ctx.instance))
+
+    ctx.logger.info(
+        'Returned Elastic IP {0} to the address pool.'.format(elasticip))
+
+    for runtime_property in \
+            [constants.ALLOCATION_ID,
+             constants.POOLED_ADDRESS,
+             constants.EXTERNAL_RESOURCE_ID]:
+        utils.unassign_runtime_property_from_resource(
+            runtime_property, ctx.instance)
+    return True
+
+
+def _check_address_pool_claim(ec2_client, elasticip):
+    """Checks that a pool address is claimed by the node instance it is
+    associated with, and renews the claim. The address is described
+    again, because claims on other hosts are only recorded on the address.
+
+    :raises NonRecoverableError: If another node instance claimed it, or
+    it is associated with another instance.
+    """
+
+    if not ctx.target.instance.runtime_properties.get(
+            constants.POOLED_ADDRESS):
+        return
+
+    address_pool = ctx.target.node.properties.get(
+        constants.ADDRESS_POOL_PROPERTY)
+    claimant = _get_address_pool_claimant(ctx.target.instance)
+    instance_id = ctx.source.instance.runtime_properties.get(
+        constants.EXTERNAL_RESOURCE_ID)
+
+    address = _get_address_object_by_id(elasticip)
+    if address and address.instance_id and \
+            address.instance_id != instance_id:
+        raise NonRecoverableError(
+            'Unable to associate Elastic IP {0}, because it is associated '
+            'with instance {1}.'.format(elasticip, address.instance_id))
+
+    if address and address.allocation_id:
+        tag_claimant = _get_tag_claimant(_get_address_claim_tags(
+            ec2_client, [address.allocation_id]).get(address.allocation_id))
+        if tag_claimant and tag_claimant != claimant:
+            raise NonRecoverableError(
+                'Unable to associate Elastic IP {0}, because {1} claimed '
+                'it from the address pool.'.format(elasticip, tag_claimant))
+        _tag_address_claim(ec2_client, address.allocation_id, claimant)
+
+    with _address_pool_claims(address_pool or []) as claims:
+        claim = claims.get(elasticip)
+        if claim and claim['claimed_by'] != claimant:
+            raise NonRecoverableError(
+                'Unable to associate Elastic IP {0}, because {1} claimed '
+                'it from the address pool.'
+                .format(elasticip, claim['claimed_by']))
+        claims[elasticip] = {'claimed_by': claimant,
+                             'claimed_at': time.time()}
+
+
+def _claim_pool_address(ec2_client, address, claimant):
+    """Claims a pool address on the address itself. EC2 has no conditional
+    tagging, so the claim tag is written, and read back after
+    ADDRESS_POOL_CLAIM_SETTLE seconds. A concurrent claim on any host
+    overwrites the tag, so the address is only taken while the claim is
+    still this one. Addresses outside of a VPC cannot be tagged, and are
+    only checked when they are associated.
+
+    :returns True if the address was claimed.
+    """
+
+    if not address.allocation_id:
+        return True
+
+    try:
+        claim = _tag_address_claim(
+            ec2_client, address.allocation_id, claimant)
+        time.sleep(constants.ADDRESS_POOL_CLAIM_SETTLE)
+        claim_tags = _get_address_claim_tags(
+            ec2_client, [address.allocation_id])
+    except NonRecoverableError as e:
+        ctx.logger.debug(
+            'Unable to claim Elastic IP {0}: {1}'
+            .format(address.public_ip, str(e)))
+        return False
+
+    if claim_tags.get(address.allocation_id) != claim:
+        ctx.logger.debug(
+            'Lost the claim of Elastic IP {0}.'.format(address.public_ip))
+        return False
+
+    return True
+
+
+def _tag_address_claim(ec2_client, allocation_id, claimant):
+    """Records a claim on an address allocation.
+
+    :returns the value of the claim tag.
+    """
+
+    claim = '{0}@{1}'.format(claimant, int(time.time()))
+
+    try:
+        ec2_client.create_tags(
+            [allocation_id], {constants.ADDRESS_POOL_CLAIM_TAG: claim})
+    except (boto.exception.EC2ResponseError,
+            boto.exception.BotoServerError) as e:
+        raise NonRecoverableError('{0}'.format(str(e)))
+
+    return claim
+
+
+def _remove_address_claim_tag(ec2_client, allocation_id, claimant):
+    """Removes the claim of a node instance from an address allocation.
+    A claim that cannot be removed expires after ADDRESS_POOL_CLAIM_TTL.
+    """
+
+    try:
+        claim = _get_address_claim_tags(
+            ec2_client, [allocation_id]).get(allocation_id)
+        if _get_tag_claimant(claim) == claimant:
+            ec2_client.delete_tags(
+                [allocation_id], [constants.ADDRESS_POOL_CLAIM_TAG])
+    except (NonRecoverableError,
+            boto.exception.EC2ResponseError,
+            boto.exception.BotoServerError) as e:
+        ctx.logger.debug(
+            'Unable to remove the claim of {0}: {1}'
+            .format(allocation_id, str(e)))
+
+
+def _get_address_claim_tags(ec2_client, allocation_ids):
+    """Returns the claim tags of address allocations with a single
+    describe call.
+
+    :param allocation_ids: A list of allocation IDs. Addresses outside of
+    a VPC have None instead, and no claim tag.
+    :returns a dict of allocation ID to the value of its claim tag.
+    :raises NonRecoverableError: If Boto errors.
+    """
+
+    allocation_ids = [allocation_id for allocation_id in allocation_ids
+                      if allocation_id]
+
+    if not allocation_ids:
+        return {}
+
+    try:
+        tags = ec2_client.get_all_tags(filters={
+            'resource-id': allocation_ids,
+            'key': constants.ADDRESS_POOL_CLAIM_TAG
+        })
+    except (boto.exception.EC2ResponseError,
+            boto.exception.BotoServerError) as e:
+        raise NonRecoverableError('{0}'.format(str(e)))
+
+    return dict((tag.res_id, tag.value) for tag in tags)
+
+
+def _get_tag_claimant(claim):
+    """The node instance of a claim tag value, or None if there is no
+    claim or it expired.
+    """
+
+    if not claim:
+        return None
+
+    claimant, _, claimed_at = claim.rpartition('@')
+    try:
+        claimed_at = float(claimed_at)
+    except ValueError:
+        return None
+
+    if claimed_at < time.time() - constants.ADDRESS_POOL_CLAIM_TTL:
+        return None
+
+    return claimant
+
+
+@contextmanager
+def _address_pool_claims(address_pool):
+    """Yields the claims of an address pool while holding its lock, a dict
+    of address to the node instance that claimed it and when. This is a
+    cache of the claims that the operations on this host made. Claims of
+    addresses in a VPC are recorded on the addresses themselves, and
+    other addresses are checked when they are associated.
+    """
+
+    pool_key = hashlib.sha1(','.join(sorted(address_pool))).hexdigest()
+    path = os.path.join(utils.get_lock_directory(),
+                        'address-pool-{0}.json'.format(pool_key))
+
+    with closing(utils.acquire_lock('address-pool-{0}'.format(pool_key))):
+        try:
+            with open(path) as f:
+                claims = json.load(f)
+        except (IOError, ValueError):
+            claims = {}
+
+        # Claims of operations that never associated the address expire.
+        claimed_after = time.time() - constants.ADDRESS_POOL_CLAIM_TTL
+        claims = dict((address, claim) for address, claim in claims.items()
+                      if claim['claimed_at'] > claimed_after)
+
+        yield claims
+
+        with open('{0}.tmp'.format(path), 'w') as f:
+            json.dump(claims, f)
+        os.rename('{0}.tmp'.format(path), path)
+
+
+def _get_address_pool_claimant(instance):
+    return '{0}:{1}'.format(ctx.deployment.id, instance.id)
+
+
 def _associate_external_elasticip_or_instance(elasticip):
     """Pretends to associate an Elastic IP with an EC2 instance but if one
     was not created by Cloudify, it just sets runtime_properties
@@ -307,6 +647,14 @@ def _disassociate_external_elasticip_or_instance():
     return True
 
 
+def _address_not_found(error):
+    """Checks if a Boto error means that the address is not in the account.
+    """
+
+    return 'InvalidAddress.NotFound' in str(error) or \
+        'InvalidAllocationID.NotFound' in str(error)
+
+
 def _get_address_by_id(address_id):
     """Returns the elastip ip for a given address elastip.
 
@@ -352,3 +700,23 @@ def _get_all_addresses(address=None):
         raise NonRecoverableError('{0}'.format(str(e)))
 
     return addresses
+
+
+def _get_unassociated_addresses(ec2_client, list_of_addresses):
+    """Returns the elasticip objects for a list of addresses that are
+    not associated with an instance, using a single describe call.
+
+    :param list_of_addresses: A list of elasticips.
+    :returns A list of elasticip objects.
+    :raises NonRecoverableError: If Boto errors.
+    """
+
+    try:
+        addresses = ec2_client.get_all_addresses(
+            addresses=list_of_addresses)
+    except (boto.exception.EC2ResponseError,
+            boto.exception.BotoServerError) as e:
+        raise NonRecoverableError('{0}'.format(str(e)))
+
+    return [address for address in addresses
+            if not address.instance_id and not address.association_id]
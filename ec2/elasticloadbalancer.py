@@ -61,23 +61,174 @@ def create_elb(**_):
 
     health_checks = ctx.node.properties.get('health_checks')
 
+    # A load balancer has a single health check, so only the last one
+    # in the list would remain in effect.
     if health_checks:
-        for health_check in health_checks:
-            _add_health_check_to_elb(lb, health_check)
+        _add_health_check_to_elb(lb, health_checks[-1])
 
 
-def _add_instance_to_elb_list_in_properties(instance_id):
+@operation
+def reconfigure_elb(listeners=None, health_checks=None,
+                    security_groups=None, subnets=None, **_):
+    """Updates the listeners, health check, security groups and subnets
+    of an existing load balancer in place. The load balancer is described
+    once and only the settings that differ from it are changed.
+    Each setting that is not provided is taken from the node properties.
+    """
+
+    elb_name = \
+        utils.get_external_resource_id_or_raise(
+            'reconfigure elb', ctx.instance)
+
+    lb = _get_existing_elb(elb_name)
+
+    if not lb:
+        raise NonRecoverableError(
+            'Load Balancer {0} does not exist in the account.'
+            .format(elb_name))
+
+    elb_client = connection.ELBConnectionClient().client()
+
+    _reconfigure_listeners(
+        elb_client, lb, listeners or ctx.node.properties['listeners'])
+
+    health_checks = \
+        health_checks or ctx.node.properties.get('health_checks')
+    if health_checks:
+        _reconfigure_health_check(elb_client, lb, health_checks[-1])
 
-    if 'instance_list' not in ctx.target.instance.runtime_properties.keys():
-        ctx.target.instance.runtime_properties['instance_list'] = []
+    security_groups = \
+        security_groups or ctx.node.properties.get('security_groups')
+    if security_groups and \
+            set(security_groups) != set(lb.security_groups or []):
+        _execute_elb_update(
+            'Security groups', elb_client.apply_security_groups_to_lb,
+            lb.name, security_groups)
 
-    ctx.target.instance.runtime_properties['instance_list'].append(instance_id)
+    subnets = subnets or ctx.node.properties.get('subnets')
+    if subnets:
+        _reconfigure_subnets(elb_client, lb, subnets)
 
+    ctx.logger.info('Load Balancer {0} reconfigured.'.format(elb_name))
 
-def _remove_instance_from_elb_list_in_properties(instance_id):
-    if instance_id in ctx.target.instance.runtime_properties['instance_list']:
-        ctx.target.instance.runtime_properties['instance_list'].remove(
-            instance_id)
+
+def _listener_key(listener):
+
+    protocol = listener[2].upper()
+    ssl_certificate_id = \
+        listener[3] if protocol in ['HTTPS', 'SSL'] and \
+        len(listener) > 3 else None
+
+    return (int(listener[0]), int(listener[1]), protocol, ssl_certificate_id)
+
+
+def _reconfigure_listeners(elb_client, lb, listeners):
+
+    current = dict(
+        (listener.load_balancer_port,
+         (listener.load_balancer_port, listener.instance_port,
+          listener.protocol.upper(),
+          listener.ssl_certificate_id
+          if listener.protocol.upper() in ['HTTPS', 'SSL'] else None))
+        for listener in lb.listeners or [])
+    desired = dict(
+        (_listener_key(listener)[0], listener) for listener in listeners)
+
+    ports_to_delete = [
+        port for port, key in current.items()
+        if port not in desired or _listener_key(desired[port]) != key]
+    listeners_to_create = [
+        listener for port, listener in desired.items()
+        if port not in current or _listener_key(listener) != current[port]]
+
+    if ports_to_delete:
+        _execute_elb_update(
+            'Listeners', elb_client.delete_load_balancer_listeners,
+            lb.name, ports_to_delete)
+
+    if listeners_to_create:
+        _execute_elb_update(
+            'Listeners', elb_client.create_load_balancer_listeners,
+            lb.name, listeners_to_create)
+
+
+def _reconfigure_health_check(elb_client, lb, health_check):
+
+    hc = _create_health_check(health_check)
+    current = lb.health_check
+    attributes = \
+        ['interval', 'healthy_threshold', 'timeout', 'unhealthy_threshold']
+
+    if current and current.target == hc.target and \
+            all(int(getattr(current, attribute)) ==
+                int(getattr(hc, attribute)) for attribute in attributes):
+        return
+
+    _execute_elb_update(
+        'Health check', elb_client.configure_health_check, lb.name, hc)
+
+
+def _reconfigure_subnets(elb_client, lb, subnets):
+
+    current = set(lb.subnets or [])
+    subnets_to_attach = sorted(set(subnets) - current)
+    subnets_to_detach = sorted(current - set(subnets))
+
+    # A load balancer has at most one subnet in each zone, so subnets are
+    # detached before new ones are attached. If all of its subnets are
+    # replaced, one of them is kept until the new ones are attached, since
+    # a load balancer needs at least one subnet.
+    subnets_to_keep = [] if current.difference(subnets_to_detach) \
+        else subnets_to_detach[:1]
+    subnets_to_detach_first = [
+        subnet for subnet in subnets_to_detach
+        if subnet not in subnets_to_keep]
+
+    if subnets_to_detach_first:
+        _execute_elb_update(
+            'Subnets', elb_client.detach_lb_from_subnets,
+            lb.name, subnets_to_detach_first)
+
+    if subnets_to_attach:
+        _execute_elb_update(
+            'Subnets', elb_client.attach_lb_to_subnets,
+            lb.name, subnets_to_attach)
+
+    if subnets_to_keep:
+        _execute_elb_update(
+            'Subnets', elb_client.detach_lb_from_subnets,
+            lb.name, subnets_to_keep)
+
+
+def _execute_elb_update(setting, update_function, elb_name, value):
+
+    try:
+        update_function(elb_name, value)
+    except (boto.exception.EC2ResponseError,
+            boto.exception.BotoServerError,
+            boto.exception.BotoClientError) as e:
+        raise NonRecoverableError('{0} not updated on Load Balancer '
+                                  '{1}: {2}'.format(setting, elb_name, str(e)))
+
+    ctx.logger.info(
+        '{0} updated on Load Balancer {1}: {2}.'
+        .format(setting, elb_name, value))
+
+
+def _add_instances_to_elb_list_in_properties(ctx_instance, instance_ids):
+
+    instance_list = \
+        set(ctx_instance.runtime_properties.get('instance_list', []))
+    instance_list.update(instance_ids)
+    ctx_instance.runtime_properties['instance_list'] = sorted(instance_list)
+
+
+def _remove_instances_from_elb_list_in_properties(ctx_instance, instance_ids):
+
+    instance_list = \
+        set(ctx_instance.runtime_properties.get('instance_list', []))
+    instance_list.difference_update(instance_ids)
+    ctx_instance.runtime_properties['instance_list'] = sorted(instance_list)
 
 
 @operation
@@ -91,25 +242,16 @@ def remove_instance_from_elb(**_):
         utils.get_external_resource_id_or_raise(
             'instance_id', ctx.source.instance)
 
-    instance_list = [instance_id]
-    lb = _get_existing_elb(elb_name)
-
     ctx.logger.info('Attemping to remove instance: {0} from elb {1}'
                     .format(instance_id, elb_name))
 
-    try:
-        lb.deregister_instances(instance_list)
-    except (boto.exception.EC2ResponseError,
-            boto.exception.BotoServerError,
-            boto.exception.BotoClientError) as e:
-        if instance_id in _get_instance_list():
-            raise RecoverableError('Instance not removed from Load Balancer '
-                                   '{0}'.format(str(e)))
+    _deregister_instances(elb_name, [instance_id])
 
     ctx.logger.info(
         'Instance {0} removed from Load Balancer {1}.'
         .format(instance_id, elb_name))
-    _remove_instance_from_elb_list_in_properties(instance_id)
+    _remove_instances_from_elb_list_in_properties(
+        ctx.target.instance, [instance_id])
 
 
 @operation
@@ -123,24 +265,97 @@ def add_instance_to_elb(**_):
         utils.get_external_resource_id_or_raise(
             'instance_id', ctx.source.instance)
 
-    ctx.logger.info('Attemping to remove instance: {0} from elb {1}'
+    ctx.logger.info('Attemping to add instance: {0} to elb {1}'
                     .format(instance_id, elb_name))
 
-    lb = _get_existing_elb(elb_name)
+    _register_instances(elb_name, [instance_id])
+
+    ctx.logger.info(
+        'Instance {0} added to Load Balancer {1}.'
+        .format(instance_id, elb_name))
+
+    _add_instances_to_elb_list_in_properties(
+        ctx.target.instance, [instance_id])
+
+
+@operation
+def register_instances(instance_ids, **_):
+    """Registers a list of instances with the load balancer
+    in a single API call.
+    """
+
+    elb_name = \
+        utils.get_external_resource_id_or_raise(
+            'register instances', ctx.instance)
+
+    ctx.logger.info('Attempting to add instances: {0} to elb {1}'
+                    .format(instance_ids, elb_name))
+
+    _register_instances(elb_name, instance_ids)
+
+    ctx.logger.info(
+        'Instances {0} added to Load Balancer {1}.'
+        .format(instance_ids, elb_name))
+
+    _add_instances_to_elb_list_in_properties(ctx.instance, instance_ids)
+
+
+@operation
+def deregister_instances(instance_ids, **_):
+    """Deregisters a list of instances from the load balancer
+    in a single API call.
+    """
+
+    elb_name = \
+        utils.get_external_resource_id_or_raise(
+            'deregister instances', ctx.instance)
+
+    ctx.logger.info('Attempting to remove instances: {0} from elb {1}'
+                    .format(instance_ids, elb_name))
+
+    _deregister_instances(elb_name, instance_ids)
+
+    ctx.logger.info(
+        'Instances {0} removed from Load Balancer {1}.'
+        .format(instance_ids, elb_name))
+
+    _remove_instances_from_elb_list_in_properties(ctx.instance, instance_ids)
+
+
+def _register_instances(elb_name, instance_ids):
+
+    if not instance_ids:
+        return
+
+    elb_client = connection.ELBConnectionClient().client()
 
     try:
-        lb.register_instances(instance_id)
+        elb_client.register_instances(elb_name, instance_ids)
     except (boto.exception.EC2ResponseError,
             boto.exception.BotoServerError,
             boto.exception.BotoClientError) as e:
-            raise NonRecoverableError('Instance not added to Load Balancer '
-                                      '{0}'.format(str(e)))
+        raise NonRecoverableError('Instance not added to Load Balancer '
+                                  '{0}'.format(str(e)))
 
-    ctx.logger.info(
-        'Instance {0} added to Load Balancer {1}.'
-        .format(instance_id, elb_name))
 
-    _add_instance_to_elb_list_in_properties(instance_id)
+def _deregister_instances(elb_name, instance_ids):
+
+    if not instance_ids:
+        return
+
+    elb_client = connection.ELBConnectionClient().client()
+
+    try:
+        elb_client.deregister_instances(elb_name, instance_ids)
+    except (boto.exception.EC2ResponseError,
+            boto.exception.BotoServerError,
+            boto.exception.BotoClientError) as e:
+        lb = _get_existing_elb(elb_name)
+        registered_ids = [instance.id for instance in lb.instances] \
+            if lb else []
+        if set(instance_ids) & set(registered_ids):
+            raise RecoverableError('Instance not removed from Load Balancer '
+                                   '{0}'.format(str(e)))
 
 
 def _add_health_check_to_elb(elb, health_check):
@@ -278,17 +493,24 @@ def _get_elbs_by_names(list_of_names):
     elb_client = connection.ELBConnectionClient().client()
 
     try:
-        total_elb_list = elb_client.get_all_load_balancers()
         elb_list = elb_client.get_all_load_balancers(
             load_balancer_names=list_of_names)
     except (boto.exception.EC2ResponseError,
             boto.exception.BotoServerError,
             boto.exception.BotoClientError) as e:
-        if 'LoadBalancerNotFound' in e:
+        if 'LoadBalancerNotFound' in str(e):
             ctx.logger.info('Unable to find load balancers matching: '
                             '{0}'.format(list_of_names))
-            ctx.logger.info('load balancers available: '
-                            '{0}'.format(total_elb_list))
+            try:
+                utils.log_available_resources(utils.iterate_pages(
+                    elb_client.get_all_load_balancers,
+                    token_argument='marker', token_attribute='next_marker'))
+            except (boto.exception.EC2ResponseError,
+                    boto.exception.BotoServerError,
+                    boto.exception.BotoClientError) as list_error:
+                ctx.logger.debug(
+                    'Unable to list the available load balancers: '
+                    '{0}'.format(str(list_error)))
         raise NonRecoverableError('Error when accessing ELB interface '
                                   '{0}'.format(str(e)))
     return elb_list
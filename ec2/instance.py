@@ -13,10 +13,23 @@
 #    * See the License for the specific language governing permissions and
 #    * limitations under the License.
 
+import io
 import os
+import gzip
+import json
+import time
+import anydbm
+import pickle
+import random
+import shelve
+import zlib
+import hashlib
+import collections
+from contextlib import closing, contextmanager
 
 # Third-party Imports
 import boto.exception
+from requests import exceptions as requests_exceptions
 
 # Cloudify imports
 from ec2 import utils
@@ -24,11 +37,36 @@ from ec2 import constants
 from ec2 import connection
 from cloudify import ctx
 from cloudify import compute
-from cloudify.exceptions import NonRecoverableError
+from cloudify import manager
+from cloudify import constants as cloudify_constants
+from cloudify.utils import internal
+from cloudify.exceptions import NonRecoverableError, RecoverableError
 from cloudify.decorators import operation
+from cloudify_rest_client.exceptions import CloudifyClientError
 from ec2 import passwd
 from ec2.keypair import KEYPAIR_AWS_TYPE
 
+# Windows instances in this worker that are waiting for their password,
+# and those of them that already passed their reachability check,
+# by EC2 endpoint and access key.
+_pending_password_instances = collections.defaultdict(set)
+_reachable_instances = collections.defaultdict(set)
+
+# AMI metadata by region and image id, least recently used first.
+_image_cache = collections.OrderedDict()
+
+# Errors of an unreadable or corrupt persistent image cache file.
+_image_cache_errors = anydbm.error + (
+    IOError, OSError, EOFError, pickle.UnpicklingError)
+
+# user data by deployment, node and a digest of the agent configuration
+# and node user data, least recently used first.
+_userdata_cache = collections.OrderedDict()
+
+# Sorted node instance IDs of the nodes that are spread across subnets,
+# by deployment and node.
+_sibling_instance_ids = {}
+
 
 @operation
 def creation_validation(**_):
@@ -50,9 +88,9 @@ def creation_validation(**_):
             'but the instance already exists.')
 
     image_id = ctx.node.properties['image_id']
-    image_object = _get_image(image_id)
+    image = _get_image(image_id)
 
-    if 'available' not in image_object.state:
+    if not image or constants.IMAGE_AVAILABLE not in image['state']:
         raise NonRecoverableError(
             'image_id {0} not available to this account.'.format(image_id))
 
@@ -69,13 +107,18 @@ def run_instances(**_):
 
     instance_parameters = _get_instance_parameters()
 
+    if _claim_warm_pool_instance(ec2_client, instance_parameters):
+        return
+
     ctx.logger.info(
         'Attempting to create EC2 Instance with these API parameters: {0}.'
-        .format(instance_parameters))
+        .format(_get_loggable_parameters(instance_parameters)))
 
-    instance_id = _run_instances_if_needed(ec2_client, instance_parameters)
+    instance_id, instance = \
+        _run_instances_if_needed(ec2_client, instance_parameters)
 
-    instance = _get_instance_from_id(instance_id)
+    if instance is None:
+        instance = _get_instance_from_id(instance_id)
 
     if instance is None:
         return ctx.operation.retry(
@@ -84,7 +127,7 @@ def run_instances(**_):
 
     utils.set_external_resource_id(
         instance_id, ctx.instance, external=False)
-    _instance_created_assign_runtime_properties()
+    _instance_created_assign_runtime_properties(instance)
 
 
 @operation
@@ -228,23 +271,76 @@ def terminate(**_):
             message='Waiting server to terminate. Retrying...')
 
 
-def _assign_runtime_properties_to_instance(runtime_properties):
+@operation
+def refill_warm_pool(**_):
+    """Refills the warm pool of the instance, and waits until all of the
+    pool's instances are stopped.
+    """
+
+    ec2_client = connection.EC2ConnectionClient().client()
+
+    pool_size = _get_warm_pool_size()
+    if not pool_size:
+        return
+
+    instance_parameters = _get_instance_parameters()
+    pool_key = _get_warm_pool_key(instance_parameters)
+
+    if not _refill_warm_pool(ec2_client, instance_parameters, pool_key,
+                             pool_size):
+        return ctx.operation.retry(
+            message='Waiting for the instances of warm pool {0} '
+            'to be stopped.'.format(pool_key))
+
+
+@operation
+def drain_warm_pool(**_):
+    """Terminates the unclaimed warm pool instances that the node started.
+    """
+
+    ec2_client = connection.EC2ConnectionClient().client()
+
+    try:
+        members = ec2_client.get_only_instances(filters={
+            'tag-key': constants.WARM_POOL_TAG,
+            'tag:{0}'.format(constants.WARM_POOL_OWNER_TAG):
+                _get_warm_pool_owner(),
+            'instance-state-name': constants.WARM_POOL_STATES
+        })
+        if members:
+            instance_ids = [instance.id for instance in members]
+            ctx.logger.info(
+                'Terminating warm pool instances {0}.'.format(instance_ids))
+            ec2_client.terminate_instances(instance_ids)
+    except (boto.exception.EC2ResponseError,
+            boto.exception.BotoServerError) as e:
+        raise NonRecoverableError('{0}'.format(str(e)))
+
+
+def _assign_runtime_properties_to_instance(runtime_properties,
+                                           instance=None):
+    """Sets runtime properties from the attributes of an instance.
+
+    :param runtime_properties: The names of the runtime properties to set.
+    :param instance: The boto instance object, as returned by the call
+    that created or described it. If not provided, the instance is
+    described once.
+    """
+
+    if instance is None:
+        instance = _get_instance_object()
 
     for property_name in runtime_properties:
-        if 'ip' is property_name:
-            ctx.instance.runtime_properties[property_name] = \
-                _get_instance_attribute('private_ip_address')
-        elif 'public_ip_address' is property_name:
-            ctx.instance.runtime_properties[property_name] = \
-                _get_instance_attribute('ip_address')
-        else:
-            ctx.instance.runtime_properties[property_name] = \
-                _get_instance_attribute(property_name)
+        attribute = constants.INSTANCE_RUNTIME_PROPERTY_ATTRIBUTES.get(
+            property_name, property_name)
+        ctx.instance.runtime_properties[property_name] = \
+            getattr(instance, attribute)
 
 
-def _instance_created_assign_runtime_properties():
+def _instance_created_assign_runtime_properties(instance=None):
     _assign_runtime_properties_to_instance(
-        runtime_properties=constants.INSTANCE_INTERNAL_ATTRIBUTES_POST_CREATE)
+        runtime_properties=constants.INSTANCE_INTERNAL_ATTRIBUTES_POST_CREATE,
+        instance=instance)
 
 
 def _instance_started_assign_runtime_properties_and_tag(instance_id):
@@ -253,7 +349,8 @@ def _instance_started_assign_runtime_properties_and_tag(instance_id):
     utils.add_tag(instance)
 
     _assign_runtime_properties_to_instance(
-        runtime_properties=constants.INSTANCE_INTERNAL_ATTRIBUTES)
+        runtime_properties=constants.INSTANCE_INTERNAL_ATTRIBUTES,
+        instance=instance)
     ctx.logger.info('Instance {0} is running.'.format(instance_id))
 
 
@@ -261,12 +358,21 @@ def _retrieve_windows_pass(ec2_client,
                            instance_id,
                            private_key_path):
     private_key = _get_private_key(private_key_path)
+
+    if not _windows_instance_reachable(ec2_client, instance_id):
+        ctx.logger.debug('server is not reachable yet')
+        return False
+
     ctx.logger.debug('retrieving password for server')
     password = _get_windows_password(ec2_client=ec2_client,
                                      instance_id=instance_id,
                                      private_key_path=private_key)
 
     if password:
+        password_instances_key = _get_password_instances_key(ec2_client)
+        _pending_password_instances[password_instances_key].discard(
+            instance_id)
+        _reachable_instances[password_instances_key].discard(instance_id)
         ctx.instance.runtime_properties[
             constants.ADMIN_PASSWORD_PROPERTY] = password
         ctx.logger.info('Server has been set with a password')
@@ -303,6 +409,70 @@ def _get_private_key(private_key_path):
     raise NonRecoverableError(err_message)
 
 
+def _windows_instance_reachable(ec2_client, instance_id):
+    """Checks whether an instance passed its reachability check, so that
+    password data is only requested once it can have been posted.
+    The status of every instance in this worker that is waiting for its
+    password in the same account and region is described in the same
+    request.
+
+    :param ec2_client: The EC2 connection.
+    :param instance_id: The ID of the instance waiting for its password.
+    :returns True if the instance is reachable, False otherwise.
+    """
+
+    password_instances_key = _get_password_instances_key(ec2_client)
+    pending = _pending_password_instances[password_instances_key]
+    reachable = _reachable_instances[password_instances_key]
+
+    if instance_id in reachable:
+        return True
+
+    pending.add(instance_id)
+
+    try:
+        statuses = ec2_client.get_all_instance_status(
+            instance_ids=list(pending), include_all_instances=True)
+    except boto.exception.EC2ResponseError:
+        # One of the pending instances is gone, so each of them is
+        # described on its own, and only those that fail are dropped.
+        statuses = []
+        for pending_id in list(pending):
+            try:
+                statuses.extend(ec2_client.get_all_instance_status(
+                    instance_ids=[pending_id], include_all_instances=True))
+            except boto.exception.EC2ResponseError as e:
+                ctx.logger.debug(
+                    'Unable to describe the status of instance {0}: {1}'
+                    .format(pending_id, str(e)))
+                pending.discard(pending_id)
+
+    for status in statuses:
+        reachability = status.instance_status.details.get('reachability')
+        if reachability == constants.INSTANCE_REACHABILITY_PASSED:
+            reachable.add(status.id)
+        elif reachability != constants.INSTANCE_REACHABILITY_FAILED and \
+                status.state_code not in (
+                    constants.INSTANCE_STATE_TERMINATED,
+                    constants.INSTANCE_STATE_STOPPED):
+            continue
+        # Reachable, terminated, stopped or failed instances are not
+        # described again for the other pending instances.
+        pending.discard(status.id)
+
+    return instance_id in reachable
+
+
+def _get_password_instances_key(ec2_client):
+    """Returns the key of the Windows instances waiting for their password
+    that can be described with an EC2 connection.
+
+    :param ec2_client: The EC2 connection.
+    """
+
+    return ec2_client.host, ec2_client.aws_access_key_id
+
+
 def _get_windows_password(ec2_client,
                           instance_id,
                           private_key_path):
@@ -320,16 +490,18 @@ def _unassign_runtime_properties(runtime_properties, ctx_instance):
 
 
 def _run_instances_if_needed(ec2_client, instance_parameters):
+    """Runs the instance on the first try, and finds it on retries.
+
+    :returns a tuple of the instance id and the boto instance object,
+    which is None if the instance id was already known.
+    """
 
-    if ctx.operation.retry_number == 0:
+    if 'reservation_id' not in ctx.instance.runtime_properties:
 
-        try:
-            reservation = ec2_client.run_instances(**instance_parameters)
-        except (boto.exception.EC2ResponseError,
-                boto.exception.BotoServerError) as e:
-            raise NonRecoverableError('{0}'.format(str(e)))
+        reservation = \
+            _run_instances_with_failover(ec2_client, instance_parameters)
         ctx.instance.runtime_properties['reservation_id'] = reservation.id
-        return reservation.instances[0].id
+        return reservation.instances[0].id, reservation.instances[0]
 
     elif constants.EXTERNAL_RESOURCE_ID not in ctx.instance.runtime_properties:
 
@@ -344,19 +516,342 @@ def _run_instances_if_needed(ec2_client, instance_parameters):
                 'More than one instance was created by the install workflow. '
                 'Unable to handle request.')
 
-        return instances[0].id
+        return instances[0].id, instances[0]
+
+    return ctx.instance.runtime_properties[constants.EXTERNAL_RESOURCE_ID], \
+        None
+
+
+def _run_instances_with_failover(ec2_client, instance_parameters):
+    """Runs the instance, moving on to the fallback subnets, availability
+    zones and instance types of the node when EC2 has no capacity.
+    Launches that recently failed for lack of capacity are tried last.
+
+    :returns the reservation of the instance.
+    :raises RecoverableError: If no launch had capacity.
+    :raises NonRecoverableError: If Boto errors otherwise.
+    """
+
+    exhausted = _get_exhausted_capacity()
+    candidates = sorted(
+        _get_launch_candidates(instance_parameters),
+        key=lambda parameters:
+            _get_capacity_key(ec2_client, parameters) in exhausted)
+
+    for parameters in candidates:
+        try:
+            return ec2_client.run_instances(**parameters)
+        except boto.exception.EC2ResponseError as e:
+            if e.error_code not in constants.LAUNCH_CAPACITY_ERRORS:
+                raise NonRecoverableError('{0}'.format(str(e)))
+            _set_capacity_exhausted(
+                _get_capacity_key(ec2_client, parameters))
+            ctx.logger.info(
+                'No capacity for {0} in {1}: {2}'.format(
+                    parameters.get('instance_type'),
+                    parameters.get('subnet_id') or
+                    parameters.get('placement'), e.error_code))
+        except boto.exception.BotoServerError as e:
+            raise NonRecoverableError('{0}'.format(str(e)))
+
+    raise RecoverableError(
+        'No capacity for any of the {0} instance types and locations.'
+        .format(len(candidates)))
+
+
+def _get_launch_candidates(instance_parameters):
+    """The run_instances parameters to try in order, for the instance type
+    and each of fallback_instance_types, in the subnet or zone and each of
+    fallback_subnets and fallback_availability_zones.
+    """
+
+    instance_types = [{}] + [
+        {'instance_type': instance_type} for instance_type in
+        ctx.node.properties.get('fallback_instance_types', [])]
+    locations = [{}] + [
+        {'subnet_id': subnet_id} for subnet_id in
+        ctx.node.properties.get('fallback_subnets', [])]
+    if not instance_parameters.get('subnet_id'):
+        locations += [
+            {'placement': zone} for zone in
+            ctx.node.properties.get('fallback_availability_zones', [])]
+
+    candidates = []
+    for instance_type in instance_types:
+        for location in locations:
+            parameters = dict(instance_parameters)
+            parameters.update(instance_type)
+            if 'subnet_id' in location:
+                # The zone of a fallback subnet may differ from placement.
+                parameters.pop('placement', None)
+            parameters.update(location)
+            if parameters not in candidates:
+                candidates.append(parameters)
+
+    return candidates
+
+
+def _get_capacity_key(ec2_client, parameters):
+
+    return '{0}/{1}/{2}'.format(
+        ec2_client.region.name,
+        parameters.get('subnet_id') or parameters.get('placement'),
+        parameters.get('instance_type'))
+
+
+def _get_exhausted_capacity():
+    """The launches that recently failed for lack of capacity, shared by
+    the operations on this host, so that instances created at the same
+    time try other launches first.
+
+    :returns a dict of capacity key to until when other launches are
+    tried first.
+    """
+
+    try:
+        with open(_get_exhausted_capacity_path()) as f:
+            exhausted = json.load(f)
+    except (IOError, ValueError):
+        return {}
+
+    now = time.time()
+    return dict((capacity_key, until)
+                for capacity_key, until in exhausted.items() if until > now)
+
+
+def _set_capacity_exhausted(capacity_key):
+
+    path = _get_exhausted_capacity_path()
+
+    with closing(utils.acquire_lock('exhausted-capacity')):
+        exhausted = _get_exhausted_capacity()
+        exhausted[capacity_key] = \
+            time.time() + constants.LAUNCH_CAPACITY_EXHAUSTED_TTL
+        with open('{0}.tmp'.format(path), 'w') as f:
+            json.dump(exhausted, f)
+        os.rename('{0}.tmp'.format(path), path)
+
+
+def _get_exhausted_capacity_path():
+
+    return os.path.join(utils.get_lock_directory(), 'exhausted-capacity.json')
+
+
+def _claim_warm_pool_instance(ec2_client, instance_parameters):
+    """Takes a stopped instance from the warm pool instead of running a
+    new one. The pool is shared by every host that uses the account, so
+    an instance is only taken once its lease was verified on the instance
+    itself.
+
+    :returns True if an instance was claimed, False if there is no warm
+    pool or none of its stopped instances could be leased.
+    """
+
+    if ctx.operation.retry_number != 0 or \
+            constants.EXTERNAL_RESOURCE_ID in ctx.instance.runtime_properties:
+        return False
+
+    if not _get_warm_pool_size():
+        return False
+
+    pool_key = _get_warm_pool_key(instance_parameters)
+    lease = '{0}:{1}'.format(ctx.deployment.id, ctx.instance.id)
+
+    # Concurrent claims start with different instances, so that they
+    # rarely compete for the same one.
+    stopped = _get_warm_pool_instances(ec2_client, pool_key, ['stopped'])
+    random.shuffle(stopped)
+
+    claimed = None
+    for instance in stopped:
+        claimed = _lease_warm_pool_instance(ec2_client, instance.id, lease)
+        if claimed:
+            break
+
+    if not claimed:
+        ctx.logger.info('The warm pool has no stopped instances.')
+        return False
+
+    ctx.logger.info(
+        'Claimed instance {0} from the warm pool.'.format(claimed.id))
+    utils.set_external_resource_id(claimed.id, ctx.instance, external=False)
+    _instance_created_assign_runtime_properties(claimed)
+    return True
+
+
+def _lease_warm_pool_instance(ec2_client, instance_id, lease):
+    """Leases a stopped warm pool instance. EC2 has no conditional
+    tagging, so the lease tag is written, and read back after
+    WARM_POOL_LEASE_SETTLE seconds. A concurrent claim on any host
+    overwrites the tag, and the first claim that reads back its own lease
+    removes the instance from the pool, so the claims that read back later
+    find it gone.
+
+    :returns the leased boto instance, or None if the lease was lost.
+    """
+
+    try:
+        ec2_client.create_tags(
+            [instance_id], {constants.WARM_POOL_LEASE_TAG: lease})
+        time.sleep(constants.WARM_POOL_LEASE_SETTLE)
+        leased = ec2_client.get_only_instances([instance_id])
+        if not leased or \
+                leased[0].tags.get(constants.WARM_POOL_LEASE_TAG) != lease or \
+                constants.WARM_POOL_TAG not in leased[0].tags or \
+                leased[0].state_code != constants.INSTANCE_STATE_STOPPED:
+            ctx.logger.debug(
+                'Lost the lease of warm pool instance {0}.'
+                .format(instance_id))
+            return None
+        ec2_client.delete_tags([instance_id], [constants.WARM_POOL_TAG])
+    except (boto.exception.EC2ResponseError,
+            boto.exception.BotoServerError) as e:
+        ctx.logger.debug(
+            'Unable to lease instance {0}: {1}'.format(instance_id, str(e)))
+        return None
 
-    return ctx.instance.runtime_properties[constants.EXTERNAL_RESOURCE_ID]
+    return leased[0]
+
+
+def _refill_warm_pool(ec2_client, instance_parameters, pool_key,
+                      pool_size):
+    """Stops the pool instances that finished booting and runs new ones
+    until the pool has pool_size instances. New instances are tagged with
+    the node that started them, and those that cannot be tagged are
+    terminated, so that none are left running outside of the pool.
+
+    :returns True if the pool is full and all of its instances are stopped.
+    """
+
+    members = _get_warm_pool_instances(
+        ec2_client, pool_key, constants.WARM_POOL_STATES)
+    running = [instance.id for instance in members
+               if instance.state_code == constants.INSTANCE_STATE_STARTED]
+    missing = pool_size - len(members)
+
+    try:
+        if running:
+            ec2_client.stop_instances(running)
+        if missing > 0:
+            ctx.logger.info(
+                'Adding {0} instances to the warm pool.'.format(missing))
+            reservation = ec2_client.run_instances(**dict(
+                instance_parameters, min_count=missing, max_count=missing))
+            instance_ids = [instance.id for instance in reservation.instances]
+            try:
+                ec2_client.create_tags(instance_ids, {
+                    constants.WARM_POOL_TAG: pool_key,
+                    constants.WARM_POOL_OWNER_TAG: _get_warm_pool_owner()
+                })
+            except (boto.exception.EC2ResponseError,
+                    boto.exception.BotoServerError):
+                ctx.logger.error(
+                    'Unable to tag instances {0} for the warm pool, '
+                    'terminating them.'.format(instance_ids))
+                ec2_client.terminate_instances(instance_ids)
+                raise
+    except (boto.exception.EC2ResponseError,
+            boto.exception.BotoServerError) as e:
+        raise NonRecoverableError(
+            'Unable to refill the warm pool: {0}'.format(str(e)))
+
+    return missing <= 0 and all(
+        instance.state_code == constants.INSTANCE_STATE_STOPPED
+        for instance in members)
+
+
+def _get_warm_pool_instances(ec2_client, pool_key, states):
+
+    try:
+        return ec2_client.get_only_instances(filters={
+            'tag:{0}'.format(constants.WARM_POOL_TAG): pool_key,
+            'instance-state-name': states
+        })
+    except (boto.exception.EC2ResponseError,
+            boto.exception.BotoServerError) as e:
+        raise NonRecoverableError('{0}'.format(str(e)))
+
+
+def _get_warm_pool_size():
+    """The size of the node's warm pool.
+
+    :returns the warm_pool_size property, or 0 if the node installs the
+    agent with user data that is specific to each instance.
+    """
+
+    pool_size = ctx.node.properties.get(constants.WARM_POOL_SIZE_PROPERTY, 0)
+
+    if pool_size and internal.get_install_method(ctx.node.properties) in \
+            cloudify_constants.AGENT_INSTALL_METHODS_SCRIPTS:
+        ctx.logger.info(
+            'Not using the warm pool, because the agent is installed '
+            'with user data that is specific to this instance.')
+        return 0
+
+    return pool_size
+
+
+def _get_warm_pool_owner():
+    """The value of the owner tag of the warm pool instances that the
+    node starts.
+    """
+
+    return '{0}:{1}'.format(ctx.deployment.id, ctx.node.id)
+
+
+def _get_warm_pool_key(instance_parameters):
+    """The warm pool of an instance, a digest of the run_instances
+    parameters that pooled instances must share.
+    """
+
+    key_parameters = dict(
+        (name, instance_parameters.get(name))
+        for name in constants.WARM_POOL_KEY_PARAMETERS)
+    if key_parameters['security_group_ids']:
+        key_parameters['security_group_ids'] = \
+            sorted(key_parameters['security_group_ids'])
+
+    return hashlib.sha1(
+        json.dumps(key_parameters, sort_keys=True, default=str)).hexdigest()
 
 
 def _handle_userdata(parameters):
 
     existing_userdata = parameters.get('user_data')
+    # The agent install script is specific to each instance, and
+    # init_script also sets the instance's cloudify_agent runtime property.
     install_agent_userdata = ctx.agent.init_script()
 
     if not (existing_userdata or install_agent_userdata):
         return parameters
 
+    cache_key = hashlib.sha1(
+        repr((existing_userdata, install_agent_userdata))).hexdigest()
+
+    if cache_key in _userdata_cache:
+        final_userdata = _userdata_cache.pop(cache_key)
+    else:
+        final_userdata = _build_userdata(
+            existing_userdata, install_agent_userdata)
+    _userdata_cache[cache_key] = final_userdata
+    while len(_userdata_cache) > constants.USERDATA_CACHE_SIZE:
+        _userdata_cache.popitem(last=False)
+
+    parameters['user_data'] = final_userdata
+
+    return parameters
+
+
+def _build_userdata(existing_userdata, install_agent_userdata):
+    """Combines the node's user data with the agent install script, and
+    gzip compresses the result if it is close to the EC2 size limit.
+    cloud-init decompresses gzip user data, EC2Config on Windows does
+    not, so Windows scripts are never compressed.
+
+    :raises NonRecoverableError: If the user data is too large for EC2
+    even when compressed.
+    """
+
     if not existing_userdata:
         final_userdata = install_agent_userdata
     elif not install_agent_userdata:
@@ -365,9 +860,43 @@ def _handle_userdata(parameters):
         final_userdata = compute.create_multi_mimetype_userdata(
             [existing_userdata, install_agent_userdata])
 
-    parameters['user_data'] = final_userdata
+    if len(final_userdata) > constants.USERDATA_GZIP_SIZE and \
+            not final_userdata.lstrip().startswith(
+                tuple(constants.USERDATA_WINDOWS_TAGS)):
+        compressed = io.BytesIO()
+        with gzip.GzipFile(fileobj=compressed, mode='wb', mtime=0) as f:
+            f.write(final_userdata)
+        ctx.logger.debug(
+            'Compressed {0} bytes of user data to {1} bytes.'
+            .format(len(final_userdata), len(compressed.getvalue())))
+        final_userdata = compressed.getvalue()
+
+    if len(final_userdata) > constants.USERDATA_MAX_SIZE:
+        raise NonRecoverableError(
+            'User data is {0} bytes, more than the {1} bytes EC2 allows.'
+            .format(len(final_userdata), constants.USERDATA_MAX_SIZE))
 
-    return parameters
+    return final_userdata
+
+
+def _get_loggable_parameters(parameters):
+    """Returns the run_instances parameters with the user data truncated,
+    so that agent scripts do not fill the logs.
+    """
+
+    user_data = parameters.get('user_data')
+    loggable_parameters = dict(parameters)
+
+    if not user_data:
+        return parameters
+    elif user_data.startswith(b'\x1f\x8b'):
+        loggable_parameters['user_data'] = \
+            '<{0} bytes of gzip user data>'.format(len(user_data))
+    elif len(user_data) > constants.USERDATA_LOG_SIZE:
+        loggable_parameters['user_data'] = '{0}... <{1} bytes>'.format(
+            user_data[:constants.USERDATA_LOG_SIZE], len(user_data))
+
+    return loggable_parameters
 
 
 def _get_instances_from_reservation_id(ec2_client):
@@ -455,9 +984,12 @@ def _get_all_instances(list_of_instance_ids=None):
         reservations = ec2_client.get_all_reservations(list_of_instance_ids)
     except boto.exception.EC2ResponseError as e:
         if 'InvalidInstanceID.NotFound' in e:
-            instances = [instance for res in ec2_client.get_all_reservations()
-                         for instance in res.instances]
-            utils.log_available_resources(instances)
+            reservations = utils.iterate_pages(
+                ec2_client.get_all_reservations,
+                max_results=constants.DESCRIBE_PAGE_SIZE)
+            utils.log_available_resources(
+                instance for res in reservations
+                for instance in res.instances)
         return None
     except boto.exception.BotoServerError as e:
         raise NonRecoverableError('{0}'.format(str(e)))
@@ -484,10 +1016,14 @@ def _get_instance_from_id(instance_id):
 
 
 def _get_image(image_id):
-    """Gets the boto object that represents the AMI image for image id.
+    """Gets the metadata of the AMI image for image id. AMIs do not change,
+    so their metadata is cached, and only their state is checked again
+    once IMAGE_CACHE_TTL has passed.
 
     :param image_id: The ID of the AMI image.
-    :returns an object that represents an AMI image.
+    :returns a dict with the id, state, architecture, root_device_name,
+    root_device_type and block_device_mapping of the image, or None if
+    the image does not exist.
     """
 
     ec2_client = connection.EC2ConnectionClient().client()
@@ -496,13 +1032,104 @@ def _get_image(image_id):
         raise NonRecoverableError(
             'No image_id was provided.')
 
+    cache_key = '{0}:{1}'.format(ec2_client.region.name, image_id)
+    image = _get_cached_image(cache_key)
+
+    if image and image['state'] == constants.IMAGE_AVAILABLE and \
+            time.time() - image['verified_at'] < constants.IMAGE_CACHE_TTL:
+        return image
+
     try:
         image_object = ec2_client.get_image(image_id)
     except (boto.exception.EC2ResponseError,
             boto.exception.BotoServerError) as e:
         raise NonRecoverableError('{0}.'.format(str(e)))
 
-    return image_object
+    if not image_object:
+        return None
+
+    image = dict(
+        id=image_object.id,
+        state=image_object.state,
+        architecture=image_object.architecture,
+        root_device_name=image_object.root_device_name,
+        root_device_type=image_object.root_device_type,
+        block_device_mapping=dict(
+            (device_name, dict(
+                snapshot_id=device.snapshot_id,
+                size=device.size,
+                volume_type=device.volume_type,
+                delete_on_termination=device.delete_on_termination))
+            for device_name, device in
+            (image_object.block_device_mapping or {}).items()),
+        verified_at=time.time())
+    _cache_image(cache_key, image)
+
+    return image
+
+
+def _get_cached_image(cache_key):
+    """Returns the cached metadata of an image, first from memory, then
+    from the persistent image cache file, if there is one.
+    """
+
+    if cache_key in _image_cache:
+        image = _image_cache.pop(cache_key)
+        _image_cache[cache_key] = image
+        return image
+
+    image = None
+    cache_path = os.environ.get(constants.AWS_IMAGE_CACHE_PATH_ENV_VAR_NAME)
+    if cache_path:
+        try:
+            with _open_image_cache_file(cache_path) as image_cache_file:
+                image = image_cache_file.get(cache_key)
+        except _image_cache_errors as e:
+            ctx.logger.debug(
+                'Unable to read image cache {0}: {1}'
+                .format(cache_path, str(e)))
+
+    if image:
+        _cache_image(cache_key, image, persist=False)
+
+    return image
+
+
+def _cache_image(cache_key, image, persist=True):
+    """Keeps the metadata of an image in memory, evicting the least
+    recently used image, and in the persistent image cache file.
+    """
+
+    _image_cache.pop(cache_key, None)
+    _image_cache[cache_key] = image
+    while len(_image_cache) > constants.IMAGE_CACHE_SIZE:
+        _image_cache.popitem(last=False)
+
+    cache_path = os.environ.get(constants.AWS_IMAGE_CACHE_PATH_ENV_VAR_NAME)
+    if persist and cache_path:
+        try:
+            with _open_image_cache_file(cache_path) as image_cache_file:
+                image_cache_file[cache_key] = image
+        except _image_cache_errors as e:
+            ctx.logger.debug(
+                'Unable to write image cache {0}: {1}'
+                .format(cache_path, str(e)))
+
+
+@contextmanager
+def _open_image_cache_file(cache_path):
+    """Opens the persistent image cache file while holding its lock, so
+    that the operations of other processes never read or write the file
+    at the same time.
+
+    :param cache_path: The path of the persistent image cache file.
+    """
+
+    lock_name = 'image-cache-{0}'.format(
+        hashlib.sha1(os.path.abspath(cache_path)).hexdigest())
+    with closing(utils.acquire_lock(lock_name)):
+        with closing(shelve.open(cache_path)) as image_cache_file:
+            yield image_cache_file
 
 
 def _get_instance_attribute(attribute):
@@ -514,6 +1141,35 @@ def _get_instance_attribute(attribute):
     :raises NonRecoverableError if no instance is found.
     """
 
+    instance_id = ctx.instance.runtime_properties.get(
+        constants.EXTERNAL_RESOURCE_ID)
+
+    if instance_id and attribute in constants.INSTANCE_FIELD_PATHS:
+        ec2_client = connection.EC2ConnectionClient().client()
+        try:
+            records = utils.describe_instance_fields(
+                ec2_client, [instance_id], [attribute])
+        except (boto.exception.EC2ResponseError,
+                boto.exception.BotoServerError):
+            # _get_instance_object handles missing instances and errors.
+            records = None
+        if records:
+            return getattr(records[0], attribute)
+
+    return getattr(_get_instance_object(attribute), attribute)
+
+
+def _get_instance_object(attribute=None):
+    """Describes the EC2 Instance of this node instance.
+
+    :param attribute: The attribute that is needed, for error messages.
+    :returns a boto object representing an EC2 instance.
+    :raises NonRecoverableError if constants.EXTERNAL_RESOURCE_ID not set
+    :raises NonRecoverableError if no instance is found.
+    """
+
+    attribute = attribute or 'attributes'
+
     if constants.EXTERNAL_RESOURCE_ID not in ctx.instance.runtime_properties:
         raise NonRecoverableError(
             'Unable to get instance attibute {0}, because {1} is not set.'
@@ -543,8 +1199,7 @@ def _get_instance_attribute(attribute):
                 'External resource, but the supplied '
                 'instance id {0} is not in the account.'.format(instance_id))
 
-    attribute = getattr(instance_object, attribute)
-    return attribute
+    return instance_object
 
 
 def _get_instance_state():
@@ -621,4 +1276,71 @@ def _get_instance_subnet(provider_variables):
         raise NonRecoverableError(
             'instance may only be attached to one subnet')
 
+    list_of_subnets.extend(
+        subnet_id for subnet_id in utils.get_target_external_resource_ids(
+            constants.INSTANCE_SUBNET_CONNECTED_RELATIONSHIP, ctx.instance)
+        if subnet_id not in list_of_subnets)
+
+    if len(list_of_subnets) > 1:
+        return _schedule_instance_subnet(list_of_subnets)
+
     return list_of_subnets[0] if list_of_subnets else None
+
+
+def _schedule_instance_subnet(list_of_subnets):
+    """Spreads the instances of this node across several subnets round
+    robin: an instance takes the subnet at its index among the node's
+    sorted instance IDs. When the IDs cannot be listed, the subnet is
+    picked by a hash of the instance ID instead.
+
+    :param list_of_subnets: The IDs of the subnets to choose from.
+    :returns the ID of the chosen subnet.
+    """
+
+    subnet_id = ctx.instance.runtime_properties.get('subnet_id')
+    if subnet_id in list_of_subnets:
+        return subnet_id
+
+    instance_ids = _get_sibling_instance_ids()
+    if ctx.instance.id in instance_ids:
+        index = instance_ids.index(ctx.instance.id)
+    else:
+        index = zlib.crc32(ctx.instance.id)
+    subnet_id = list_of_subnets[index % len(list_of_subnets)]
+
+    ctx.logger.info(
+        'Placing instance in subnet {0} of {1}.'
+        .format(subnet_id, list_of_subnets))
+    ctx.instance.runtime_properties['subnet_id'] = subnet_id
+    return subnet_id
+
+
+def _get_sibling_instance_ids():
+    """The sorted IDs of the instances of this node. They are listed once
+    per node in each process, and again when this instance is not among
+    them, like after a scale out. Local runs have no manager to list them
+    from.
+
+    :returns a list of node instance IDs, empty if they are unknown.
+    """
+
+    key = (ctx.deployment.id, ctx.node.id)
+    instance_ids = _sibling_instance_ids.get(key, [])
+
+    if ctx.instance.id in instance_ids or \
+            cloudify_constants.MANAGER_IP_KEY not in os.environ:
+        return instance_ids
+
+    try:
+        node_instances = manager.get_rest_client().node_instances.list(
+            deployment_id=ctx.deployment.id, node_id=ctx.node.id,
+            _include=['id'])
+    except (CloudifyClientError, requests_exceptions.ConnectionError) as e:
+        ctx.logger.debug(
+            'Unable to list the instances of the node: {0}'.format(str(e)))
+        return instance_ids
+
+    instance_ids = sorted(
+        node_instance.id for node_instance in node_instances)
+    _sibling_instance_ids[key] = instance_ids
+    return instance_ids
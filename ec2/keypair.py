@@ -15,12 +15,14 @@
 
 # Built-in Imports
 import os
+import hashlib
 
 # Third-party Imports
 import boto.exception
 
 # Cloudify imports
 from ec2 import utils
+from ec2 import passwd
 from ec2 import constants
 from ec2 import connection
 from cloudify import ctx
@@ -29,7 +31,12 @@ from cloudify.decorators import operation
 
 KEYPAIR_AWS_TYPE = 'keypair'
 RUNTIME_PROPERTIES = [constants.AWS_TYPE_PROPERTY,
-                      constants.EXTERNAL_RESOURCE_ID]
+                      constants.EXTERNAL_RESOURCE_ID,
+                      constants.KEYPAIR_FINGERPRINT]
+
+# Fingerprints of local key files by path, along with the (mtime, size)
+# of the file they were computed from.
+_fingerprint_cache = {}
 
 
 @operation
@@ -42,18 +49,45 @@ def creation_validation(**_):
 
     key_file = _get_path_to_key_file()
     key_file_in_filesystem = _search_for_key_file(key_file)
+    public_key_file = _get_path_to_public_key_file()
+
+    if public_key_file and not _search_for_key_file(public_key_file):
+        raise NonRecoverableError(
+            'The public key file {0} does not exist locally.'
+            .format(public_key_file))
 
     if ctx.node.properties['use_external_resource']:
         if not key_file_in_filesystem:
             raise NonRecoverableError(
                 'External resource, but the key file does not exist locally.')
         try:
-            _get_key_pair_by_id(ctx.node.properties['resource_id'])
+            key_pair = \
+                _get_key_pair_by_id(ctx.node.properties['resource_id'])
         except NonRecoverableError as e:
             raise NonRecoverableError(
                 'External resource, '
                 'but the key pair does not exist in the account: '
                 '{0}'.format(str(e)))
+        fingerprints = _get_key_file_fingerprints(public_key_file or key_file)
+        if key_pair and fingerprints and \
+                key_pair.fingerprint.lower() not in fingerprints:
+            raise NonRecoverableError(
+                'External resource, but the key pair fingerprint {0} '
+                'does not match the local key file.'
+                .format(key_pair.fingerprint))
+    elif public_key_file:
+        if not key_file_in_filesystem:
+            raise NonRecoverableError(
+                'Importing a public key, '
+                'but the key file does not exist locally.')
+        try:
+            _get_key_pair_by_id(ctx.node.properties['resource_id'])
+        except NonRecoverableError:
+            pass
+        else:
+            raise NonRecoverableError(
+                'Not external resource, '
+                'but the key pair exists in the account.')
     else:
         if key_file_in_filesystem:
             raise NonRecoverableError(
@@ -71,7 +105,9 @@ def creation_validation(**_):
 
 @operation
 def create(**kwargs):
-    """Creates a keypair."""
+    """Creates a keypair, or imports the public key in public_key_path
+    if it is set.
+    """
 
     ec2_client = connection.EC2ConnectionClient().client()
 
@@ -79,11 +115,23 @@ def create(**kwargs):
         return
 
     key_pair_name = utils.get_resource_id()
+    public_key_file = _get_path_to_public_key_file()
 
-    ctx.logger.debug('Attempting to create key pair.')
+    if public_key_file:
+        if not _search_for_key_file(_get_path_to_key_file()):
+            raise NonRecoverableError(
+                'Importing a public key, '
+                'but the key file does not exist locally.')
+        ctx.logger.debug('Attempting to import key pair.')
+    else:
+        ctx.logger.debug('Attempting to create key pair.')
 
     try:
-        kp = ec2_client.create_key_pair(key_pair_name)
+        if public_key_file:
+            kp = ec2_client.import_key_pair(
+                key_pair_name, _read_public_key(public_key_file))
+        else:
+            kp = ec2_client.create_key_pair(key_pair_name)
     except (boto.exception.EC2ResponseError,
             boto.exception.BotoServerError,
             boto.exception.BotoClientError) as e:
@@ -91,7 +139,10 @@ def create(**kwargs):
 
     utils.set_external_resource_id(
         kp.name, ctx.instance, external=False)
-    _save_key_pair(kp)
+    if not public_key_file:
+        _save_key_pair(kp)
+    ctx.instance.runtime_properties[constants.KEYPAIR_FINGERPRINT] = \
+        kp.fingerprint
 
     ctx.instance.runtime_properties[constants.AWS_TYPE_PROPERTY] = \
         KEYPAIR_AWS_TYPE
@@ -119,7 +170,8 @@ def delete(**kwargs):
 
     utils.unassign_runtime_properties_from_resource(RUNTIME_PROPERTIES,
                                                     ctx.instance)
-    _delete_key_file()
+    if not _get_path_to_public_key_file():
+        _delete_key_file()
     ctx.logger.info('Deleted key pair: {0}.'.format(key_pair_name))
 
 
@@ -214,6 +266,7 @@ def _save_key_pair(key_pair_object):
     fp.close()
 
     _set_key_file_permissions(file_path)
+    _cache_fingerprints(file_path, (key_pair_object.fingerprint.lower(),))
 
 
 def _set_key_file_permissions(key_file):
@@ -267,3 +320,77 @@ def _search_for_key_file(path_to_key_file):
     """
 
     return True if os.path.exists(path_to_key_file) else False
+
+
+def _get_path_to_public_key_file():
+    """Gets the path to the public key file to import, if there is one.
+
+    :returns the path to the public key file, or None if the key pair
+    should be created by EC2.
+    """
+
+    public_key_path = ctx.node.properties.get('public_key_path')
+    return os.path.expanduser(public_key_path) if public_key_path else None
+
+
+def _read_public_key(path_to_public_key_file):
+    """Reads the public key material to import.
+
+    :raises NonRecoverableError: If unable to read the public key file.
+    """
+
+    try:
+        with open(path_to_public_key_file, 'r') as public_key_file:
+            return public_key_file.read().strip()
+    except IOError as e:
+        raise NonRecoverableError(
+            'Unable to read public key file: {0}.'.format(str(e)))
+
+
+def _get_key_file_fingerprints(path_to_key_file, logger=None):
+    """Returns the fingerprints EC2 may report for a local key file, using
+    the fingerprint index unless the file changed since it was indexed.
+    EC2 reports the MD5 of the public key for imported key pairs and
+    the SHA1 of the PKCS#8 private key for key pairs it created.
+
+    :param path_to_key_file: The path to a private or public key file.
+    :param logger: The logger to use outside of operations.
+    :returns a tuple of fingerprints, empty if the file is not an RSA key.
+    """
+
+    key_stat = os.stat(path_to_key_file)
+    stat_key = (key_stat.st_mtime, key_stat.st_size)
+
+    cached = _fingerprint_cache.get(path_to_key_file)
+    if cached and cached[0] == stat_key:
+        return cached[1]
+
+    try:
+        key = passwd.get_rsa_key(path_to_key_file)
+    except NonRecoverableError as e:
+        (logger or ctx.logger).debug(
+            'Unable to compute fingerprint of {0}: {1}'
+            .format(path_to_key_file, str(e)))
+        return ()
+
+    fingerprints = (_format_fingerprint(
+        hashlib.md5(key.publickey().exportKey('DER'))),)
+    if key.has_private():
+        fingerprints += (_format_fingerprint(
+            hashlib.sha1(key.exportKey('DER', pkcs=8))),)
+
+    _fingerprint_cache[path_to_key_file] = (stat_key, fingerprints)
+    return fingerprints
+
+
+def _cache_fingerprints(path_to_key_file, fingerprints):
+
+    key_stat = os.stat(path_to_key_file)
+    _fingerprint_cache[path_to_key_file] = \
+        ((key_stat.st_mtime, key_stat.st_size), fingerprints)
+
+
+def _format_fingerprint(digest):
+
+    hex_digest = digest.hexdigest()
+    return ':'.join(hex_digest[i:i + 2] for i in range(0, len(hex_digest), 2))
@@ -13,57 +13,55 @@
 #    * See the License for the specific language governing permissions and
 #    * limitations under the License.
 
-# Taken from https://github.com/tomrittervg/decrypt-windows-ec2-passwd
+# Originally based on https://github.com/tomrittervg/decrypt-windows-ec2-passwd
+import os
 import base64
-import binascii
 
+from Crypto.Cipher import PKCS1_v1_5
 from Crypto.PublicKey import RSA
 
 from cloudify.exceptions import NonRecoverableError
 
+# Parsed keys by path, along with the (mtime, size) of the file they
+# were parsed from.
+_key_cache = {}
 
-def _pkcs1_unpad(text):
-    if len(text) > 0 and text[0] == '\x02':
-        # Find end of padding marked by nul
-        pos = text.find('\x00')
-        if pos > 0:
-            return text[pos+1:]
-    return None
 
+def get_rsa_key(private_key_path):
+    """Returns the parsed RSA key in private_key_path, reading and parsing
+    the file only if it changed since it was last parsed.
+    """
 
-def _long_to_bytes(val, endianness='big'):
-    # one (1) hex digit per four (4) bits
-    width = val.bit_length()
-    width += 8 - ((width % 8) or 8)
-    fmt = '%%0%dx' % (width // 4)
-    s = binascii.unhexlify(fmt % val)
-    if endianness == 'little':
-        s = s[::-1]
+    key_stat = os.stat(private_key_path)
+    stat_key = (key_stat.st_mtime, key_stat.st_size)
 
-    return s
+    cached = _key_cache.get(private_key_path)
+    if cached and cached[0] == stat_key:
+        return cached[1]
 
+    with open(private_key_path, 'r') as key_file:
+        key_material = key_file.read()
+    try:
+        key = RSA.importKey(key_material)
+    except ValueError as e:
+        raise NonRecoverableError(
+            'Could not import SSH Key: {0}'.format(str(e)))
 
-def _decrypt_password(rsa_key, password):
-    encrypted_data = base64.b64decode(password)
-    cipher_text = int(binascii.hexlify(encrypted_data), 16)
+    _key_cache[private_key_path] = (stat_key, key)
+    return key
 
-    plaintext = rsa_key.decrypt(cipher_text)
 
-    decrypted_data = _long_to_bytes(plaintext)
-    unpadded_data = _pkcs1_unpad(decrypted_data)
+def _decrypt_password(rsa_key, password):
+    encrypted_data = base64.b64decode(password)
+    cipher = PKCS1_v1_5.new(rsa_key)
 
-    return unpadded_data
+    # decrypt returns the sentinel if the padding is invalid.
+    return cipher.decrypt(encrypted_data, None)
 
 
 def get_windows_passwd(private_key_path, password_data):
 
-    with open(private_key_path, 'r') as key_file:
-        key_lines = key_file.readlines()
-    try:
-        key = RSA.importKey(key_lines)
-    except ValueError as e:
-        raise NonRecoverableError(
-            'Could not import SSH Key: {0}'.format(str(e)))
+    key = get_rsa_key(private_key_path)
 
     password = _decrypt_password(key, password_data)
 
@@ -165,6 +165,9 @@ def _delete_security_group(group_id):
     except (exception.EC2ResponseError,
             exception.BotoServerError) as e:
         raise NonRecoverableError('{0}'.format(str(e)))
+    finally:
+        utils.invalidate_described(group_to_delete.connection,
+                                   [group_to_delete.id])
 
 
 def _create_group_rules(group_object):
@@ -211,6 +214,9 @@ def _create_group_rules(group_object):
         except Exception as e:
             _delete_security_group(group_object.id)
             raise
+        finally:
+            utils.invalidate_described(group_object.connection,
+                                       [group_object.id])
 
 
 def _create_external_securitygroup(name):
@@ -265,9 +271,11 @@ def _get_security_group_from_id(group_id):
         group = _get_security_group_from_name(group_id)
         return group
 
-    group = _get_all_security_groups(list_of_group_ids=group_id)
+    ec2_client = connection.EC2ConnectionClient().client()
 
-    return group[0] if group else group
+    return utils.describe_by_ids(
+        ec2_client.get_all_security_groups, 'group_ids', [group_id],
+        not_found_token='InvalidGroup.NotFound').get(group_id)
 
 
 def _get_security_group_from_name(group_name):
@@ -14,12 +14,19 @@
 #    * limitations under the License.
 
 # Built-in Imports
+import os
+import mock
+import time
 import testtools
 
 # Third Party Imports
 from moto import mock_ec2
 from moto import mock_elb
 from boto.ec2 import EC2Connection
+from boto.auth import HmacAuthV4Handler
+from boto.sts import STSConnection
+from boto.sts.credentials import AssumedRole
+from boto.sts.credentials import Credentials
 
 # Cloudify Imports is imported and used in operations
 from ec2 import constants
@@ -95,3 +102,178 @@ class TestConnection(testtools.TestCase):
         self.assertEqual(
             ec2_client.DefaultRegionName,
             ec2_client.region.name)
+
+    @mock_ec2
+    def test_connect_region_resolved_once(self):
+        """ this tests that a region is only resolved once
+        for the same region name and endpoint
+        """
+
+        ctx = self.get_mock_context('test_connect_region_resolved_once')
+        ctx.node.properties['aws_config'] = {
+            'ec2_region_name': 'us-west-2',
+            'ec2_region_endpoint': 'ec2.us-west-2.example.com'
+        }
+        current_ctx.set(ctx=ctx)
+        self.addCleanup(connection._region_cache.clear)
+
+        with mock.patch('ec2.connection.get_region',
+                        wraps=connection.get_region) as mock_get_region:
+            first_client = connection.EC2ConnectionClient().client()
+            second_client = connection.EC2ConnectionClient().client()
+        self.assertEqual(1, mock_get_region.call_count)
+        self.assertIs(first_client.region, second_client.region)
+        self.assertEqual('ec2.us-west-2.example.com',
+                         second_client.region.endpoint)
+
+    @mock_ec2
+    def test_connect_once_per_operation(self):
+        """ this tests that an operation reuses its connection,
+        and that another operation gets its own
+        """
+
+        ctx = self.get_mock_context('test_connect_once_per_operation')
+        current_ctx.set(ctx=ctx)
+        ec2_client = connection.EC2ConnectionClient().client()
+        self.assertIs(ec2_client, connection.EC2ConnectionClient().client())
+
+        ctx = self.get_mock_context('test_connect_once_per_operation')
+        current_ctx.set(ctx=ctx)
+        self.assertIsNot(
+            ec2_client, connection.EC2ConnectionClient().client())
+
+    @mock_ec2
+    def test_connect_default_credentials_resolved_once(self):
+        """ this tests that credentials boto finds on its own are
+        only looked up for the first connection
+        """
+
+        ctx = self.get_mock_context(
+            'test_connect_default_credentials_resolved_once')
+        ctx.node.properties['aws_config'] = {}
+        current_ctx.set(ctx=ctx)
+        environ = {'AWS_ACCESS_KEY_ID': 'access',
+                   'AWS_SECRET_ACCESS_KEY': 'secret'}
+
+        with mock.patch.dict(os.environ, environ), \
+                mock.patch.dict(connection._default_providers, clear=True), \
+                mock.patch('ec2.connection.Provider',
+                           wraps=connection.Provider) as mock_provider:
+            first_client = connection.EC2ConnectionClient().client()
+            current_ctx.set(ctx=self.get_mock_context(
+                'test_connect_default_credentials_resolved_once'))
+            second_client = connection.EC2ConnectionClient().client()
+        self.assertEqual(1, mock_provider.call_count)
+        self.assertIsNot(first_client, second_client)
+        self.assertEqual('access', second_client.aws_access_key_id)
+        self.assertEqual('secret', second_client.aws_secret_access_key)
+
+    @mock_ec2
+    def test_connect_assume_role_cached(self):
+        """ this tests that an assumed role session is reused
+        until shortly before it expires
+        """
+
+        current_ctx.clear()
+        aws_config = {
+            'aws_access_key_id': 'access',
+            'aws_secret_access_key': 'secret',
+            'role_arn': 'arn:aws:iam::123456789012:role/peer'
+        }
+        credentials = Credentials()
+        credentials.access_key = 'role-access'
+        credentials.secret_key = 'role-secret'
+        credentials.session_token = 'role-token'
+        credentials.expiration = time.strftime(
+            '%Y-%m-%dT%H:%M:%SZ', time.gmtime(
+                time.time() + constants.ASSUMED_ROLE_DURATION))
+        self.addCleanup(connection._assumed_role_credentials.clear)
+
+        with mock.patch.object(STSConnection, 'assume_role',
+                               return_value=AssumedRole(
+                                   credentials=credentials)) as assume_role:
+            ec2_client = connection.EC2ConnectionClient().client(
+                aws_config=aws_config)
+            connection.EC2ConnectionClient().client(aws_config=aws_config)
+        self.assertEqual(1, assume_role.call_count)
+        self.assertEqual('role-access', ec2_client.aws_access_key_id)
+        self.assertEqual('role-token', ec2_client.provider.security_token)
+
+        credentials.expiration = time.strftime(
+            '%Y-%m-%dT%H:%M:%SZ', time.gmtime(
+                time.time() + constants.CREDENTIALS_REFRESH_WINDOW))
+        connection._assumed_role_credentials.clear()
+        with mock.patch.object(STSConnection, 'assume_role',
+                               return_value=AssumedRole(
+                                   credentials=credentials)) as assume_role:
+            connection.EC2ConnectionClient().client(aws_config=aws_config)
+            connection.EC2ConnectionClient().client(aws_config=aws_config)
+        self.assertEqual(2, assume_role.call_count)
+
+    @mock_ec2
+    def test_connect_signing_key_cached(self):
+        """ this tests that requests reuse the derived signing key,
+        and are signed exactly like boto signs them
+        """
+
+        current_ctx.clear()
+        ec2_client = connection.EC2ConnectionClient().client()
+        auth_handler = ec2_client._auth_handler
+        self.assertIsInstance(auth_handler,
+                              connection.CachedSigningKeyHandler)
+
+        with mock.patch.dict(connection._signing_keys, clear=True), \
+                mock.patch.object(auth_handler, '_sign',
+                                  wraps=auth_handler._sign) as sign:
+            ec2_client.get_all_volumes()
+            self.assertEqual(5, sign.call_count)
+            ec2_client.get_all_volumes()
+            self.assertEqual(6, sign.call_count)
+
+            http_request = mock.Mock(timestamp='20150101',
+                                     region_name='us-east-1',
+                                     service_name='ec2')
+            self.assertEqual(
+                HmacAuthV4Handler.signature(
+                    auth_handler, http_request, 'string to sign'),
+                auth_handler.signature(http_request, 'string to sign'))
+            self.assertNotIn(auth_handler._provider.secret_key,
+                             ''.join(connection._signing_keys))
+
+    @mock_ec2
+    def test_connect_boto_auth_handler(self):
+        """ this tests that boto still keeps the SigV4 handler of
+        a connection where the signing key cache replaces it
+        """
+
+        current_ctx.clear()
+        ec2_client = connection.EC2ConnectionClient()._connect({})
+        self.assertIs(HmacAuthV4Handler,
+                      type(getattr(ec2_client, '_auth_handler', None)))
+
+    def test_connect_signing_key_cache_bounded(self):
+        """ this tests that the least recently used signing keys
+        are evicted once the cache is full
+        """
+
+        auth_handler = connection.CachedSigningKeyHandler(
+            'ec2.us-east-1.amazonaws.com', mock.Mock(),
+            mock.Mock(access_key='access', secret_key='secret'),
+            service_name='ec2', region_name='us-east-1')
+        with mock.patch.dict(connection._signing_keys, clear=True), \
+                mock.patch.object(connection.constants,
+                                  'SIGNING_KEY_CACHE_SIZE', 2):
+            for timestamp in ('20150101', '20150102', '20150101',
+                              '20150103'):
+                auth_handler.signature(
+                    mock.Mock(timestamp=timestamp, region_name='us-east-1',
+                              service_name='ec2'), 'string to sign')
+            self.assertEqual(2, len(connection._signing_keys))
+            sign_calls = []
+            with mock.patch.object(auth_handler, '_sign',
+                                   side_effect=lambda *a, **k: (
+                                       sign_calls.append(a) or 'x')):
+                auth_handler.signature(
+                    mock.Mock(timestamp='20150101', region_name='us-east-1',
+                              service_name='ec2'), 'string to sign')
+            self.assertEqual(1, len(sign_calls))
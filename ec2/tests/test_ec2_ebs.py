@@ -17,6 +17,7 @@
 import testtools
 
 # Third Party Imports
+import mock
 from boto.ec2 import EC2Connection
 from moto import mock_ec2
 
@@ -166,6 +167,34 @@ class TestEBS(testtools.TestCase):
         self.assertEqual(zone, ctx.instance.runtime_properties.get(
                 constants.ZONE))
 
+    @mock_ec2
+    def test_create_in_instance_zone(self):
+        """ This tests that a volume connected to an instance is created
+        in the zone of the instance."""
+
+        ctx = self.mock_ctx('test_create_in_instance_zone', zone='')
+        relationship = mock.Mock()
+        relationship.type = \
+            'cloudify.aws.relationships.volume_connected_to_instance'
+        relationship.target.instance.runtime_properties = {
+            'placement': 'us-east-1c'}
+        ctx.instance.relationships = [relationship]
+        current_ctx.set(ctx=ctx)
+        ebs.create(dict(), ctx=ctx)
+        self.assertEqual('us-east-1c', ctx.instance.runtime_properties.get(
+                constants.ZONE))
+
+    @mock_ec2
+    def test_create_no_zone(self):
+        """ This tests that a volume without a zone, that is not
+        connected to an instance, is not created."""
+
+        ctx = self.mock_ctx('test_create_no_zone', zone='')
+        current_ctx.set(ctx=ctx)
+        ex = self.assertRaises(NonRecoverableError, ebs.create,
+                               dict(), ctx=ctx)
+        self.assertIn('it has no zone', ex.message)
+
     @mock_ec2
     def test_attach_external_volume_or_instance(self):
         """ This tests that this function returns False
@@ -14,6 +14,10 @@
 #    * limitations under the License.
 
 # Built-in Imports
+import mock
+import time
+import shutil
+import tempfile
 import testtools
 
 # Third Party Imports
@@ -36,6 +40,19 @@ FQDN = '((?:[a-z][a-z\\.\\d\\-]+)\\.(?:[a-z][a-z\\-]+))(?![\\w\\.])'
 
 class TestElasticIP(testtools.TestCase):
 
+    def setUp(self):
+        super(TestElasticIP, self).setUp()
+        lock_directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, lock_directory)
+        lock_patcher = mock.patch('ec2.utils.get_lock_directory',
+                                  return_value=lock_directory)
+        lock_patcher.start()
+        self.addCleanup(lock_patcher.stop)
+        settle_patcher = mock.patch.object(
+            constants, 'ADDRESS_POOL_CLAIM_SETTLE', 0)
+        settle_patcher.start()
+        self.addCleanup(settle_patcher.stop)
+
     def mock_ctx(self, test_name):
 
         test_node_id = test_name
@@ -246,10 +263,11 @@ class TestElasticIP(testtools.TestCase):
 
         ctx = self.mock_ctx('test_good_address_delete')
         current_ctx.set(ctx=ctx)
-        address = self.get_address()
+        address = self.get_client().allocate_address(domain='vpc')
         ctx.instance.runtime_properties['aws_resource_id'] = \
             address.public_ip
-        ctx.instance.runtime_properties['allocation_id'] = 'random'
+        ctx.instance.runtime_properties['allocation_id'] = \
+            address.allocation_id
         elasticip.release(ctx=ctx)
         self.assertNotIn('aws_resource_id',
                          ctx.instance.runtime_properties)
@@ -554,3 +572,239 @@ class TestElasticIP(testtools.TestCase):
         output = \
             elasticip._disassociate_external_elasticip_or_instance()
         self.assertEqual(False, output)
+
+    @mock_ec2
+    def test_allocate_from_address_pool(self):
+        """ Tests that allocate claims a free address from the
+        address_pool instead of allocating a new one.
+        """
+
+        ctx = self.mock_elastic_ip_node('test_allocate_from_address_pool')
+        current_ctx.set(ctx=ctx)
+        address = self.get_address()
+        ctx.node.properties['address_pool'] = [address.public_ip]
+        elasticip.allocate(ctx=ctx)
+        self.assertEqual(
+            address.public_ip,
+            ctx.instance.runtime_properties['aws_resource_id'])
+        self.assertTrue(
+            ctx.instance.runtime_properties[constants.POOLED_ADDRESS])
+        self.assertEqual(1, len(self.get_client().get_all_addresses()))
+
+    @mock_ec2
+    def test_allocate_from_exhausted_address_pool(self):
+        """ Tests that allocate allocates a new address when every
+        address in the address_pool is associated.
+        """
+
+        ctx = self.mock_elastic_ip_node(
+            'test_allocate_from_exhausted_address_pool')
+        current_ctx.set(ctx=ctx)
+        address = self.get_address()
+        self.get_client().associate_address(
+            instance_id=self.get_instance_id(),
+            public_ip=address.public_ip)
+        ctx.node.properties['address_pool'] = [address.public_ip]
+        elasticip.allocate(ctx=ctx)
+        self.assertNotEqual(
+            address.public_ip,
+            ctx.instance.runtime_properties['aws_resource_id'])
+        self.assertNotIn(
+            constants.POOLED_ADDRESS, ctx.instance.runtime_properties)
+
+    @mock_ec2
+    def test_allocate_claimed_address_pool(self):
+        """ Tests that an address claimed from the address_pool is not
+        handed out again before it is associated, until it is released.
+        """
+
+        address = self.get_address()
+        contexts = []
+        for index in range(3):
+            ctx = self.mock_elastic_ip_node(
+                'test_allocate_claimed_address_pool')
+            ctx.node.properties['address_pool'] = [address.public_ip]
+            contexts.append(ctx)
+
+        current_ctx.set(ctx=contexts[0])
+        elasticip.allocate(ctx=contexts[0])
+        current_ctx.set(ctx=contexts[1])
+        elasticip.allocate(ctx=contexts[1])
+        self.assertEqual(
+            address.public_ip,
+            contexts[0].instance.runtime_properties['aws_resource_id'])
+        self.assertNotIn(
+            constants.POOLED_ADDRESS, contexts[1].instance.runtime_properties)
+
+        current_ctx.set(ctx=contexts[0])
+        elasticip.release(ctx=contexts[0])
+        current_ctx.set(ctx=contexts[2])
+        elasticip.allocate(ctx=contexts[2])
+        self.assertEqual(
+            address.public_ip,
+            contexts[2].instance.runtime_properties['aws_resource_id'])
+
+    @mock_ec2
+    def test_allocate_address_pool_claimed_on_address(self):
+        """ Tests that a VPC address that another host claimed from the
+        address_pool is not handed out until the claim expires, and that
+        the claim is recorded on the address and removed on release.
+        """
+
+        client = self.get_client()
+        address = client.allocate_address(domain='vpc')
+        client.create_tags([address.allocation_id], {
+            constants.ADDRESS_POOL_CLAIM_TAG:
+                'other:eip@{0}'.format(int(time.time()))})
+
+        ctx = self.mock_elastic_ip_node(
+            'test_allocate_address_pool_claimed_on_address')
+        ctx.node.properties['address_pool'] = [address.public_ip]
+        current_ctx.set(ctx=ctx)
+        elasticip.allocate(ctx=ctx)
+        self.assertNotIn(
+            constants.POOLED_ADDRESS, ctx.instance.runtime_properties)
+
+        expired_at = time.time() - constants.ADDRESS_POOL_CLAIM_TTL - 1
+        client.create_tags([address.allocation_id], {
+            constants.ADDRESS_POOL_CLAIM_TAG:
+                'other:eip@{0}'.format(int(expired_at))})
+        ctx = self.mock_elastic_ip_node(
+            'test_allocate_address_pool_claimed_on_address')
+        ctx.node.properties['address_pool'] = [address.public_ip]
+        current_ctx.set(ctx=ctx)
+        elasticip.allocate(ctx=ctx)
+        self.assertEqual(
+            address.public_ip,
+            ctx.instance.runtime_properties['aws_resource_id'])
+        claim = client.get_all_tags(
+            filters={'resource-id': address.allocation_id})[0].value
+        current_ctx.set(ctx=ctx)
+        self.assertTrue(claim.startswith(
+            elasticip._get_address_pool_claimant(ctx.instance) + '@'))
+
+        elasticip.release(ctx=ctx)
+        self.assertEqual([], client.get_all_tags(
+            filters={'resource-id': address.allocation_id}))
+
+    @mock_ec2
+    def test_allocate_address_pool_claim_lost(self):
+        """ Tests that allocate moves on to the next free address when
+        another claim overwrites its claim of an address.
+        """
+
+        client = self.get_client()
+        addresses = [client.allocate_address(domain='vpc')
+                     for _ in range(2)]
+        create_tags = client.create_tags
+        lost = []
+
+        def compete(resource_ids, tags):
+            create_tags(resource_ids, tags)
+            if not lost:
+                lost.extend(resource_ids)
+                create_tags(resource_ids, {
+                    constants.ADDRESS_POOL_CLAIM_TAG:
+                        'other:eip@{0}'.format(int(time.time()))})
+
+        ctx = self.mock_elastic_ip_node(
+            'test_allocate_address_pool_claim_lost')
+        ctx.node.properties['address_pool'] = \
+            [address.public_ip for address in addresses]
+        current_ctx.set(ctx=ctx)
+        with mock.patch('ec2.connection.EC2ConnectionClient.client',
+                        return_value=client), \
+                mock.patch.object(client, 'create_tags',
+                                  side_effect=compete):
+            elasticip.allocate(ctx=ctx)
+        self.assertNotEqual(
+            lost[0], ctx.instance.runtime_properties[constants.ALLOCATION_ID])
+        self.assertTrue(
+            ctx.instance.runtime_properties[constants.POOLED_ADDRESS])
+
+    @mock_ec2
+    def test_associate_pool_address_associated_elsewhere(self):
+        """ Tests that associate fails for a pool address that is already
+        associated with another instance.
+        """
+
+        ctx = self.mock_relationship_context(
+            'test_associate_pool_address_associated_elsewhere')
+        current_ctx.set(ctx=ctx)
+        client = self.get_client()
+        address = client.allocate_address(domain='vpc')
+        client.associate_address(instance_id=self.get_instance_id(),
+                                 allocation_id=address.allocation_id)
+        ctx.target.instance['id'] = 'eip'
+        ctx.target.instance.runtime_properties.update({
+            'aws_resource_id': address.public_ip,
+            constants.ALLOCATION_ID: address.allocation_id,
+            constants.POOLED_ADDRESS: True})
+        ctx.source.instance.runtime_properties['aws_resource_id'] = \
+            self.get_instance_id()
+
+        error = self.assertRaises(
+            NonRecoverableError, elasticip.associate, ctx=ctx)
+        self.assertIn('is associated with instance', error.message)
+
+    @mock_ec2
+    def test_release_to_address_pool(self):
+        """ Tests that release keeps an address claimed from the
+        address_pool in the account.
+        """
+
+        ctx = self.mock_elastic_ip_node('test_release_to_address_pool')
+        current_ctx.set(ctx=ctx)
+        address = self.get_address()
+        ctx.node.properties['address_pool'] = [address.public_ip]
+        elasticip.allocate(ctx=ctx)
+        elasticip.release(ctx=ctx)
+        self.assertNotIn(
+            'aws_resource_id', ctx.instance.runtime_properties)
+        self.assertNotIn(
+            constants.POOLED_ADDRESS, ctx.instance.runtime_properties)
+        self.assertEqual(
+            address.public_ip,
+            self.get_client().get_all_addresses()[0].public_ip)
+
+    @mock_ec2
+    def test_release_verify(self):
+        """ Tests that release with verify checks that the
+        address is no longer in the account.
+        """
+
+        ctx = self.mock_ctx('test_release_verify')
+        current_ctx.set(ctx=ctx)
+        address = self.get_address()
+        ctx.instance.runtime_properties['aws_resource_id'] = \
+            address.public_ip
+        elasticip.release(ctx=ctx, verify=True)
+        self.assertNotIn(
+            'aws_resource_id', ctx.instance.runtime_properties)
+        self.assertEqual([], self.get_client().get_all_addresses())
+
+    @mock_ec2
+    def test_associate_disassociate_vpc_association_id(self):
+        """ Tests that associate records the association id and
+        disassociate uses and removes it.
+        """
+
+        ctx = self.mock_relationship_context(
+            'test_associate_disassociate_vpc_association_id')
+        current_ctx.set(ctx=ctx)
+        address = self.get_client().allocate_address(domain='vpc')
+        instance_id = self.get_instance_id()
+        ctx.target.instance.runtime_properties['aws_resource_id'] = \
+            address.public_ip
+        ctx.target.instance.runtime_properties['allocation_id'] = \
+            address.allocation_id
+        ctx.source.instance.runtime_properties['aws_resource_id'] = \
+            instance_id
+        elasticip.associate(ctx=ctx)
+        self.assertIn(constants.ASSOCIATION_ID,
+                      ctx.target.instance.runtime_properties)
+        elasticip.disassociate(ctx=ctx)
+        self.assertNotIn(constants.ASSOCIATION_ID,
+                         ctx.target.instance.runtime_properties)
+        self.assertFalse(
+            self.get_client().get_all_addresses()[0].instance_id)
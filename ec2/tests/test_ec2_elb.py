@@ -223,6 +223,47 @@ class TestLoadBalancer(testtools.TestCase):
                          len(ctx.target.instance.runtime_properties.get(
                              'instance_list')))
 
+    @mock_ec2
+    @mock_elb
+    def test_add_instance_to_elb_twice(self):
+        self._create_external_elb()
+        instance_id = self._create_external_instance().id
+        instance_ctx = self.mock_instance_ctx(
+            'source_test_add_instance_to_elb_twice',
+            instance_id=instance_id, use_external_resource=True)
+        ctx = self.mock_relationship_context('test_add_instance_to_elb_twice',
+                                             use_external_resource=True,
+                                             instance_context=instance_ctx)
+        current_ctx.set(ctx=ctx)
+        elasticloadbalancer.add_instance_to_elb(ctx=ctx)
+        elasticloadbalancer.add_instance_to_elb(ctx=ctx)
+        self.assertEqual([instance_id],
+                         ctx.target.instance.runtime_properties.get(
+                             'instance_list'))
+
+    @mock_ec2
+    @mock_elb
+    def test_register_and_deregister_instances(self):
+        self._create_external_elb()
+        reservation = boto.connect_ec2().run_instances(
+            image_id=TEST_AMI_IMAGE_ID, instance_type=TEST_INSTANCE_TYPE,
+            min_count=3, max_count=3)
+        instance_ids = [instance.id for instance in reservation.instances]
+        ctx = self.mock_elb_ctx('test_register_and_deregister_instances',
+                                instance_list=[])
+        current_ctx.set(ctx=ctx)
+        elasticloadbalancer.register_instances(
+            instance_ids=instance_ids, ctx=ctx)
+        self.assertEqual(sorted(instance_ids),
+                         ctx.instance.runtime_properties['instance_list'])
+        self.assertEqual(sorted(instance_ids),
+                         sorted(self._get_elb_instances()))
+        elasticloadbalancer.deregister_instances(
+            instance_ids=instance_ids[:2], ctx=ctx)
+        self.assertEqual(instance_ids[2:],
+                         ctx.instance.runtime_properties['instance_list'])
+        self.assertEqual(instance_ids[2:], self._get_elb_instances())
+
     @mock_ec2
     @mock_elb
     def test_delete_external_elb(self):
@@ -311,3 +352,80 @@ class TestLoadBalancer(testtools.TestCase):
         self.assertRaises(NonRecoverableError,
                           elasticloadbalancer.create_elb,
                           ctx=ctx)
+
+    @mock_elb
+    def test_reconfigure_elb(self):
+        ctx = self.mock_elb_ctx('test_reconfigure_elb')
+        ctx.node.properties['security_groups'] = []
+        self._create_external_elb()
+        current_ctx.set(ctx=ctx)
+        elasticloadbalancer.reconfigure_elb(
+            listeners=[[80, 8081, 'http'], [443, 8443, 'tcp'],
+                       [8080, 8080, 'http']], ctx=ctx)
+        lb = self._get_elbs()[0]
+        self.assertEqual(
+            sorted([(80, 8081, 'HTTP'), (443, 8443, 'TCP'),
+                    (8080, 8080, 'HTTP')]),
+            sorted((listener.load_balancer_port, listener.instance_port,
+                    listener.protocol.upper())
+                   for listener in lb.listeners))
+        self.assertEqual('HTTP:8080/health', lb.health_check.target)
+
+    @mock_elb
+    def test_reconfigure_elb_unchanged(self):
+        ctx = self.mock_elb_ctx('test_reconfigure_elb_unchanged')
+        ctx.node.properties['security_groups'] = []
+        current_ctx.set(ctx=ctx)
+        elasticloadbalancer.create_elb(ctx=ctx)
+        with mock.patch('ec2.elasticloadbalancer._execute_elb_update') \
+                as update:
+            elasticloadbalancer.reconfigure_elb(ctx=ctx)
+        self.assertFalse(update.called)
+
+    def test_reconfigure_subnets_detaches_first(self):
+        ctx = self.mock_elb_ctx('test_reconfigure_subnets_detaches_first')
+        current_ctx.set(ctx=ctx)
+        elb_client = mock.Mock()
+        lb = mock.Mock(subnets=['subnet-a', 'subnet-b'])
+        lb.name = 'myelb'
+
+        elasticloadbalancer._reconfigure_subnets(
+            elb_client, lb, ['subnet-a', 'subnet-c'])
+        self.assertEqual(
+            [mock.call.detach_lb_from_subnets('myelb', ['subnet-b']),
+             mock.call.attach_lb_to_subnets('myelb', ['subnet-c'])],
+            elb_client.mock_calls)
+
+    def test_reconfigure_subnets_replaced(self):
+        ctx = self.mock_elb_ctx('test_reconfigure_subnets_replaced')
+        current_ctx.set(ctx=ctx)
+        elb_client = mock.Mock()
+        lb = mock.Mock(subnets=['subnet-a', 'subnet-b'])
+        lb.name = 'myelb'
+
+        elasticloadbalancer._reconfigure_subnets(
+            elb_client, lb, ['subnet-c'])
+        self.assertEqual(
+            [mock.call.detach_lb_from_subnets('myelb', ['subnet-b']),
+             mock.call.attach_lb_to_subnets('myelb', ['subnet-c']),
+             mock.call.detach_lb_from_subnets('myelb', ['subnet-a'])],
+            elb_client.mock_calls)
+
+    def test_get_elbs_by_names_listing_fails(self):
+        ctx = self.mock_elb_ctx('test_get_elbs_by_names_listing_fails')
+        current_ctx.set(ctx=ctx)
+        elb_client = mock.Mock()
+        elb_client.get_all_load_balancers.side_effect = [
+            boto.exception.BotoServerError(
+                400, 'Bad Request',
+                '<Error><Code>LoadBalancerNotFound</Code></Error>'),
+            boto.exception.BotoServerError(
+                400, 'Bad Request', '<Error><Code>Throttling</Code></Error>')]
+
+        with mock.patch('ec2.connection.ELBConnectionClient.client',
+                        return_value=elb_client):
+            ex = self.assertRaises(
+                NonRecoverableError,
+                elasticloadbalancer._get_elbs_by_names, ['myelb'])
+        self.assertIn('LoadBalancerNotFound', ex.message)
+        self.assertEqual(2, elb_client.get_all_load_balancers.call_count)
@@ -14,25 +14,33 @@
 #    * limitations under the License.
 
 # Built-in Imports
+import io
+import os
+import gzip
 import testtools
+import shutil
 import tempfile
 import uuid
 
 # Third Party Imports
 from moto import mock_ec2
 import mock
+import boto.exception
 from boto.vpc import VPCConnection
 
 # Cloudify Imports is imported and used in operations
 from ec2 import constants
 from ec2 import connection
+from ec2 import utils
 from ec2 import instance
 from cloudify.context import BootstrapContext
 from cloudify.state import current_ctx
 from cloudify.mocks import MockCloudifyContext
 from cloudify.mocks import MockNodeContext
 from cloudify.mocks import MockContext
-from cloudify.exceptions import NonRecoverableError
+from cloudify.exceptions import NonRecoverableError, RecoverableError
+from cloudify.exceptions import OperationRetry
+from cloudify_rest_client.exceptions import CloudifyClientError
 
 TEST_AMI_IMAGE_ID = 'ami-e214778a'
 TEST_INSTANCE_TYPE = 't1.micro'
@@ -46,7 +54,7 @@ class TestInstance(testtools.TestCase):
     def create_vpc_client(self):
         return VPCConnection()
 
-    def mock_ctx(self, test_name):
+    def mock_ctx(self, test_name, deployment_id=None):
         """ Creates a mock context for the instance
             tests
         """
@@ -61,6 +69,7 @@ class TestInstance(testtools.TestCase):
             'cloudify_agent': {},
             'agent_config': {},
             'use_password': False,
+            'warm_pool_size': 0,
             'parameters': {
                 'security_group_ids': ['sg-73cd3f1e'],
                 'instance_initiated_shutdown_behavior': 'stop'
@@ -72,7 +81,7 @@ class TestInstance(testtools.TestCase):
         }
         ctx = MockCloudifyContext(
             node_id=test_node_id,
-            deployment_id=str(uuid.uuid4()),
+            deployment_id=deployment_id or str(uuid.uuid4()),
             properties=test_properties,
             operation=operation,
             provider_context={'resources': {}}
@@ -204,6 +213,81 @@ class TestInstance(testtools.TestCase):
             self.assertEqual(ctx.instance.runtime_properties
                              [constants.ADMIN_PASSWORD_PROPERTY], 'pass')
 
+    @mock_ec2
+    @mock.patch('ec2.instance._get_private_key')
+    def test_windows_password_waits_for_reachability(self, *_):
+        """tests that password data is not requested before the
+        instance passes its reachability check
+        """
+
+        ctx = self.mock_ctx('test_windows_password_waits_for_reachability')
+        current_ctx.set(ctx=ctx)
+        self.addCleanup(instance._pending_password_instances.clear)
+        self.addCleanup(instance._reachable_instances.clear)
+
+        ec2_client = connection.EC2ConnectionClient().client()
+        reservation = ec2_client.run_instances(
+            TEST_AMI_IMAGE_ID, instance_type=TEST_INSTANCE_TYPE, min_count=2)
+        instance_id, other_id = \
+            [i.id for i in reservation.instances]
+        password_instances_key = \
+            instance._get_password_instances_key(ec2_client)
+        pending = instance._pending_password_instances[password_instances_key]
+        reachable = instance._reachable_instances[password_instances_key]
+        pending.add(other_id)
+        instance._pending_password_instances[
+            ('ec2.eu-west-1.amazonaws.com', 'other')].add('i-4339wSD9')
+
+        with mock.patch.object(ec2_client, 'get_all_instance_status',
+                               return_value=[]) as mock_status, \
+                mock.patch('ec2.instance._get_windows_password') \
+                as mock_get_windows_password:
+            output = instance._retrieve_windows_pass(
+                ec2_client, instance_id, None)
+        self.assertFalse(output)
+        self.assertFalse(mock_get_windows_password.called)
+        self.assertEqual(
+            set([instance_id, other_id]),
+            set(mock_status.call_args[1]['instance_ids']))
+
+        with mock.patch('ec2.instance._get_windows_password') \
+                as mock_get_windows_password:
+            mock_get_windows_password.return_value = 'pass'
+            output = instance._retrieve_windows_pass(
+                ec2_client, instance_id, None)
+        self.assertTrue(output)
+        self.assertIn(other_id, reachable)
+        self.assertNotIn(other_id, pending)
+        self.assertNotIn(instance_id, pending)
+        self.assertNotIn(instance_id, reachable)
+
+    @mock_ec2
+    def test_windows_instance_reachable_other_instance_gone(self):
+        """tests that when one of the pending instances is gone, only that
+        instance stops being described with the others
+        """
+
+        ctx = self.mock_ctx('test_windows_instance_reachable_gone')
+        current_ctx.set(ctx=ctx)
+        self.addCleanup(instance._pending_password_instances.clear)
+        self.addCleanup(instance._reachable_instances.clear)
+
+        ec2_client = connection.EC2ConnectionClient().client()
+        reservation = ec2_client.run_instances(
+            TEST_AMI_IMAGE_ID, instance_type=TEST_INSTANCE_TYPE, min_count=2)
+        instance_id, other_id = \
+            [i.id for i in reservation.instances]
+        password_instances_key = \
+            instance._get_password_instances_key(ec2_client)
+        pending = instance._pending_password_instances[password_instances_key]
+        reachable = instance._reachable_instances[password_instances_key]
+        pending.update([other_id, 'i-4339wSD9'])
+
+        self.assertTrue(
+            instance._windows_instance_reachable(ec2_client, instance_id))
+        self.assertEqual(set([instance_id, other_id]), reachable)
+        self.assertEqual(set(), pending)
+
     @mock_ec2
     def test_run_instances_clean(self):
         """ this tests that the instance create function
@@ -216,6 +300,299 @@ class TestInstance(testtools.TestCase):
         self.assertIn('aws_resource_id',
                       ctx.instance.runtime_properties.keys())
 
+    @mock_ec2
+    def test_run_instances_no_describe(self):
+        """ this tests that the instance create function sets the
+        runtime properties from the run_instances response without
+        describing the instance.
+        """
+
+        ctx = self.mock_ctx('test_run_instances_no_describe')
+        current_ctx.set(ctx=ctx)
+        with mock.patch('ec2.instance._get_all_instances') as describe:
+            instance.run_instances(ctx=ctx)
+        self.assertFalse(describe.called)
+        for property_name in \
+                constants.INSTANCE_INTERNAL_ATTRIBUTES_POST_CREATE:
+            self.assertIn(property_name, ctx.instance.runtime_properties)
+        self.assertTrue(ctx.instance.runtime_properties['placement'])
+
+    @mock_ec2
+    def test_run_instances_warm_pool(self):
+        """ this tests that the refill operation fills the warm pool and
+        waits until its instances are stopped, and that the instance
+        create function claims a stopped instance from it.
+        """
+
+        deployment_id = str(uuid.uuid4())
+        ec2_client = connection.EC2ConnectionClient().client()
+        pool_filters = {'tag-key': constants.WARM_POOL_TAG}
+        owner = []
+
+        def refill():
+            ctx = self.mock_ctx('test_run_instances_warm_pool', deployment_id)
+            ctx.node.properties['warm_pool_size'] = 2
+            owner.append('{0}:{1}'.format(deployment_id, ctx.node.id))
+            current_ctx.set(ctx=ctx)
+            instance.refill_warm_pool(ctx=ctx)
+
+        self.assertRaises(OperationRetry, refill)
+        pool = ec2_client.get_only_instances(filters=pool_filters)
+        self.assertEqual(2, len(pool))
+        for pool_instance in pool:
+            self.assertEqual(
+                owner[0], pool_instance.tags[constants.WARM_POOL_OWNER_TAG])
+        self.assertRaises(OperationRetry, refill)
+        refill()
+        pool_ids = [i.id for i in
+                    ec2_client.get_only_instances(filters=pool_filters)]
+        self.assertEqual(2, len(pool_ids))
+
+        ctx = self.mock_ctx('test_run_instances_warm_pool')
+        ctx.node.properties['warm_pool_size'] = 2
+        current_ctx.set(ctx=ctx)
+        with mock.patch('ec2.constants.WARM_POOL_LEASE_SETTLE', 0):
+            instance.run_instances(ctx=ctx)
+        instance_id = ctx.instance.runtime_properties['aws_resource_id']
+        self.assertIn(instance_id, pool_ids)
+        self.assertEqual('{0}:{1}'.format(ctx.deployment.id, ctx.instance.id),
+                         ec2_client.get_only_instances([instance_id])[0]
+                         .tags[constants.WARM_POOL_LEASE_TAG])
+        self.assertEqual(1, len(
+            ec2_client.get_only_instances(filters=pool_filters)))
+        self.assertIn('placement', ctx.instance.runtime_properties)
+
+    @mock_ec2
+    def test_drain_warm_pool(self):
+        """ this tests that the drain operation terminates the unclaimed
+        warm pool instances that the node started, and only those.
+        """
+
+        ctx = self.mock_ctx('test_drain_warm_pool')
+        ctx.node.properties['warm_pool_size'] = 2
+        current_ctx.set(ctx=ctx)
+        ec2_client = connection.EC2ConnectionClient().client()
+        self.assertRaises(OperationRetry,
+                          instance.refill_warm_pool, ctx=ctx)
+        ctx = self.mock_ctx('test_drain_warm_pool', ctx.deployment.id)
+        current_ctx.set(ctx=ctx)
+        other = ec2_client.run_instances(TEST_AMI_IMAGE_ID).instances[0]
+        ec2_client.create_tags([other.id], {
+            constants.WARM_POOL_TAG: 'pool',
+            constants.WARM_POOL_OWNER_TAG: 'other:vm'})
+
+        instance.drain_warm_pool(ctx=ctx)
+        for pool_instance in ec2_client.get_only_instances():
+            if pool_instance.id == other.id:
+                self.assertEqual(constants.INSTANCE_STATE_STARTED,
+                                 pool_instance.state_code)
+            else:
+                self.assertEqual(constants.INSTANCE_STATE_TERMINATED,
+                                 pool_instance.state_code)
+
+    @mock_ec2
+    def test_run_instances_warm_pool_init_script(self):
+        """ this tests that instances that install the agent with
+        init_script user data skip the warm pool, and that the agent
+        script is only built once.
+        """
+
+        ctx = self.mock_ctx('test_run_instances_warm_pool_init_script')
+        ctx.node.properties['warm_pool_size'] = 2
+        ctx.node.properties['agent_config']['install_method'] = 'init_script'
+        ctx.agent.init_script = mock.Mock(return_value='SCRIPT')
+        current_ctx.set(ctx=ctx)
+        with mock.patch('ec2.instance._get_warm_pool_instances') as pool:
+            instance.run_instances(ctx=ctx)
+        self.assertFalse(pool.called)
+        self.assertEqual(1, ctx.agent.init_script.call_count)
+
+    @mock_ec2
+    def test_refill_warm_pool_untagged_terminated(self):
+        """ this tests that warm pool instances that cannot be tagged
+        are terminated instead of being left running.
+        """
+
+        ctx = self.mock_ctx('test_refill_warm_pool_untagged_terminated')
+        current_ctx.set(ctx=ctx)
+        ec2_client = connection.EC2ConnectionClient().client()
+        parameters = {'image_id': TEST_AMI_IMAGE_ID,
+                      'instance_type': TEST_INSTANCE_TYPE}
+        error = boto.exception.EC2ResponseError(500, 'error', 'error')
+
+        with mock.patch.object(ec2_client, 'create_tags',
+                               side_effect=error):
+            self.assertRaises(NonRecoverableError,
+                              instance._refill_warm_pool,
+                              ec2_client, parameters, 'pool', 2)
+        instances = ec2_client.get_only_instances()
+        self.assertEqual(2, len(instances))
+        for pool_instance in instances:
+            self.assertEqual(constants.INSTANCE_STATE_TERMINATED,
+                             pool_instance.state_code)
+
+    @mock_ec2
+    def test_claim_warm_pool_instance_lease_lost(self):
+        """ this tests that a claim moves on to the next stopped instance
+        when another claim overwrites its lease.
+        """
+
+        ctx = self.mock_ctx('test_claim_warm_pool_instance_lease_lost')
+        ctx.node.properties['warm_pool_size'] = 2
+        current_ctx.set(ctx=ctx)
+        ec2_client = connection.EC2ConnectionClient().client()
+        parameters = {'image_id': TEST_AMI_IMAGE_ID,
+                      'instance_type': TEST_INSTANCE_TYPE}
+        pool_key = instance._get_warm_pool_key(parameters)
+        reservation = ec2_client.run_instances(
+            TEST_AMI_IMAGE_ID, min_count=2, max_count=2)
+        pool_ids = [i.id for i in reservation.instances]
+        ec2_client.create_tags(pool_ids, {constants.WARM_POOL_TAG: pool_key})
+        ec2_client.stop_instances(pool_ids)
+        create_tags = ec2_client.create_tags
+        lost = []
+
+        def compete(resource_ids, tags):
+            create_tags(resource_ids, tags)
+            if constants.WARM_POOL_LEASE_TAG in tags and not lost:
+                lost.extend(resource_ids)
+                create_tags(resource_ids,
+                            {constants.WARM_POOL_LEASE_TAG: 'other:lease'})
+
+        with mock.patch('ec2.constants.WARM_POOL_LEASE_SETTLE', 0), \
+                mock.patch.object(ec2_client, 'create_tags',
+                                  side_effect=compete):
+            self.assertTrue(
+                instance._claim_warm_pool_instance(ec2_client, parameters))
+        claimed_id = ctx.instance.runtime_properties['aws_resource_id']
+        self.assertNotEqual(lost[0], claimed_id)
+        self.assertIn(claimed_id, pool_ids)
+        lost_tags = ec2_client.get_only_instances(lost)[0].tags
+        self.assertEqual('other:lease',
+                         lost_tags[constants.WARM_POOL_LEASE_TAG])
+        self.assertIn(constants.WARM_POOL_TAG, lost_tags)
+
+    @mock_ec2
+    def test_run_instances_capacity_failover(self):
+        """ this tests that the instance create function moves on to the
+        fallback instance types and zones when there is no capacity,
+        and tries exhausted launches last for the next instance.
+        """
+
+        ctx = self.mock_ctx('test_run_instances_capacity_failover')
+        ctx.node.properties['fallback_instance_types'] = ['m3.medium']
+        ctx.node.properties['fallback_availability_zones'] = ['us-east-1c']
+        current_ctx.set(ctx=ctx)
+        lock_directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, lock_directory)
+        lock_patcher = mock.patch('ec2.utils.get_lock_directory',
+                                  return_value=lock_directory)
+        lock_patcher.start()
+        self.addCleanup(lock_patcher.stop)
+        ec2_client = connection.EC2ConnectionClient().client()
+        run_instances = ec2_client.run_instances
+        no_capacity = boto.exception.EC2ResponseError(
+            500, 'Server Error',
+            '<Response><Errors><Error>'
+            '<Code>InsufficientInstanceCapacity</Code>'
+            '<Message>No capacity.</Message>'
+            '</Error></Errors></Response>')
+
+        def launch(**parameters):
+            if parameters['instance_type'] == TEST_INSTANCE_TYPE:
+                raise no_capacity
+            return run_instances(**parameters)
+
+        with mock.patch('ec2.connection.EC2ConnectionClient.client',
+                        return_value=ec2_client), \
+                mock.patch.object(ec2_client, 'run_instances',
+                                  side_effect=launch) as launched:
+            instance.run_instances(ctx=ctx)
+            self.assertEqual(
+                [TEST_INSTANCE_TYPE, TEST_INSTANCE_TYPE, 'm3.medium'],
+                [c[1]['instance_type'] for c in launched.call_args_list])
+            self.assertEqual(2, len(instance._get_exhausted_capacity()))
+            self.assertIn('exhausted-capacity.json',
+                          os.listdir(lock_directory))
+
+            launched.reset_mock()
+            ctx = self.mock_ctx('test_run_instances_capacity_failover')
+            ctx.node.properties['fallback_instance_types'] = ['m3.medium']
+            current_ctx.set(ctx=ctx)
+            instance.run_instances(ctx=ctx)
+            self.assertEqual(1, launched.call_count)
+            self.assertEqual('m3.medium',
+                             launched.call_args[1]['instance_type'])
+
+            ctx = self.mock_ctx('test_run_instances_capacity_failover')
+            current_ctx.set(ctx=ctx)
+            self.assertRaises(RecoverableError,
+                              instance.run_instances, ctx=ctx)
+
+    def test_launch_candidates_fallback_subnets(self):
+        """ this tests that launches in fallback subnets do not keep the
+        placement of the instance.
+        """
+
+        ctx = self.mock_ctx('test_launch_candidates_fallback_subnets')
+        ctx.node.properties['fallback_subnets'] = [SUBNET_ID]
+        current_ctx.set(ctx=ctx)
+
+        candidates = instance._get_launch_candidates({
+            'image_id': TEST_AMI_IMAGE_ID,
+            'instance_type': TEST_INSTANCE_TYPE,
+            'placement': TEST_AVAILABILITY_ZONE})
+        self.assertEqual(2, len(candidates))
+        self.assertEqual(TEST_AVAILABILITY_ZONE, candidates[0]['placement'])
+        self.assertEqual(SUBNET_ID, candidates[1]['subnet_id'])
+        self.assertNotIn('placement', candidates[1])
+
+    def test_schedule_instance_subnet(self):
+        """ this tests that instances take turns among the subnets by
+        their index among the node's instances, and stay there.
+        """
+
+        ctx = self.mock_ctx('test_schedule_instance_subnet')
+        current_ctx.set(ctx=ctx)
+        self.addCleanup(instance._sibling_instance_ids.clear)
+        subnets = ['subnet-0000000a', 'subnet-0000000b', 'subnet-0000000c']
+        node_instances = [mock.Mock(id=instance_id) for instance_id in
+                          ['vm_b', 'vm_a', 'vm_c', ctx.instance.id]]
+        rest_client = mock.Mock()
+        rest_client.node_instances.list.return_value = node_instances
+        environ = {'MANAGEMENT_IP': '127.0.0.1'}
+
+        with mock.patch.dict(os.environ, environ), \
+                mock.patch('ec2.instance.manager.get_rest_client',
+                           return_value=rest_client):
+            self.assertEqual('subnet-0000000a',
+                             instance._schedule_instance_subnet(subnets))
+            self.assertEqual('subnet-0000000a',
+                             ctx.instance.runtime_properties['subnet_id'])
+            node_instances.pop()
+            self.assertEqual('subnet-0000000a',
+                             instance._schedule_instance_subnet(subnets))
+
+            ctx.instance.runtime_properties.pop('subnet_id')
+            self.assertEqual('subnet-0000000a',
+                             instance._schedule_instance_subnet(subnets))
+            self.assertEqual(1, rest_client.node_instances.list.call_count)
+
+            error = CloudifyClientError('error')
+            rest_client.node_instances.list.side_effect = error
+            instance._sibling_instance_ids.clear()
+            ctx.instance.runtime_properties.pop('subnet_id')
+            self.assertIn(instance._schedule_instance_subnet(subnets),
+                          subnets)
+
+        ctx.instance.runtime_properties.pop('subnet_id')
+        rest_client.node_instances.list.reset_mock()
+        with mock.patch('ec2.instance.manager.get_rest_client',
+                        return_value=rest_client):
+            self.assertIn(instance._schedule_instance_subnet(subnets),
+                          subnets)
+        self.assertFalse(rest_client.node_instances.list.called)
+
     @mock_ec2
     def test_with_userdata_clean(self):
         """ this tests that handle user data returns the expected output
@@ -260,6 +637,47 @@ class TestInstance(testtools.TestCase):
         self.assertTrue(handle_userdata_output['user_data'].startswith(
             'Content-Type: multi'))
 
+    @mock_ec2
+    def test_userdata_cached_and_compressed(self):
+        """ this tests that large user data is gzip compressed, that the
+        agent script is built for every instance, and that user data is
+        truncated in the log.
+        """
+
+        ctx = self.mock_ctx('test_userdata_cached_and_compressed')
+        script = '#! SCRIPT\n' + 'echo agent\n' * 2000
+        ctx.agent.init_script = mock.Mock(return_value=script)
+        current_ctx.set(ctx=ctx)
+        self.addCleanup(instance._userdata_cache.clear)
+
+        user_data = instance._handle_userdata({})['user_data']
+        self.assertEqual(user_data, instance._handle_userdata({})['user_data'])
+        self.assertEqual(2, ctx.agent.init_script.call_count)
+        self.assertEqual(
+            script, gzip.GzipFile(fileobj=io.BytesIO(user_data)).read())
+        self.assertIn('bytes of gzip user data',
+                      instance._get_loggable_parameters(
+                          {'user_data': user_data})['user_data'])
+        self.assertIn('... <{0} bytes>'.format(len(script)),
+                      instance._get_loggable_parameters(
+                          {'user_data': script})['user_data'])
+
+        other_script = script.replace('agent', 'other')
+        ctx.agent.init_script.return_value = other_script
+        self.assertEqual(other_script, gzip.GzipFile(fileobj=io.BytesIO(
+            instance._handle_userdata({})['user_data'])).read())
+
+        windows_script = '<powershell>\n' + 'echo agent\n' * 1200 + \
+            '</powershell>'
+        ctx.agent.init_script.return_value = windows_script
+        self.assertEqual(windows_script,
+                         instance._handle_userdata({})['user_data'])
+
+        ctx.agent.init_script.return_value = os.urandom(20000)
+        ex = self.assertRaises(
+            NonRecoverableError, instance._handle_userdata, {})
+        self.assertIn('more than the 16384 bytes EC2 allows', ex.message)
+
     @mock_ec2
     def test_without_userdata_clean(self):
         """ this tests that handle user data returns the expected output
@@ -555,6 +973,25 @@ class TestInstance(testtools.TestCase):
             property_name)
         self.assertRegexpMatches(dns_name, FQDN)
 
+    @mock_ec2
+    def test_get_instance_attribute_projected(self):
+        """ This checks that _get_instance_attribute reads attributes
+        that can be projected without building boto Instance objects
+        """
+
+        ctx = self.mock_ctx('test_get_instance_attribute_projected')
+        current_ctx.set(ctx=ctx)
+
+        ec2_client = connection.EC2ConnectionClient().client()
+        reservation = ec2_client.run_instances(
+            TEST_AMI_IMAGE_ID, instance_type=TEST_INSTANCE_TYPE)
+        ctx.instance.runtime_properties['aws_resource_id'] = \
+            reservation.instances[0].id
+        with mock.patch('ec2.instance._get_all_instances') as describe:
+            state_code = instance._get_instance_state()
+        self.assertFalse(describe.called)
+        self.assertEqual(constants.INSTANCE_STATE_STARTED, state_code)
+
     @mock_ec2
     def test_get_all_instances_bad_id(self):
         """this checks that _get_all_instances returns None
@@ -621,6 +1058,65 @@ class TestInstance(testtools.TestCase):
                 'Invalid id:'):
             instance.creation_validation(ctx=ctx)
 
+    @mock_ec2
+    def test_get_image_cached(self):
+        """ this tests that the metadata of an available image is
+        only described once, and again once the ttl has passed.
+        """
+
+        ctx = self.mock_ctx('test_get_image_cached')
+        current_ctx.set(ctx=ctx)
+        self.addCleanup(instance._image_cache.clear)
+        ec2_client = connection.EC2ConnectionClient().client()
+        reservation = ec2_client.run_instances(
+            TEST_AMI_IMAGE_ID, instance_type=TEST_INSTANCE_TYPE)
+        image_id = ec2_client.create_image(
+            reservation.instances[0].id, 'test_get_image_cached')
+
+        with mock.patch.object(ec2_client, 'get_image',
+                               side_effect=ec2_client.get_image) as describe:
+            with mock.patch('ec2.connection.EC2ConnectionClient.client',
+                            return_value=ec2_client):
+                image = instance._get_image(image_id)
+                self.assertEqual(image, instance._get_image(image_id))
+                self.assertEqual(1, describe.call_count)
+                with mock.patch.object(constants, 'IMAGE_CACHE_TTL', 0):
+                    instance._get_image(image_id)
+                self.assertEqual(2, describe.call_count)
+        self.assertEqual(image_id, image['id'])
+        self.assertEqual(constants.IMAGE_AVAILABLE, image['state'])
+
+    @mock_ec2
+    def test_get_image_persistent_cache(self):
+        """ this tests that image metadata is read back from the
+        persistent image cache file.
+        """
+
+        ctx = self.mock_ctx('test_get_image_persistent_cache')
+        current_ctx.set(ctx=ctx)
+        self.addCleanup(instance._image_cache.clear)
+        cache_path = os.path.join(tempfile.mkdtemp(), 'images')
+        env_patcher = mock.patch.dict(os.environ, {
+            constants.AWS_IMAGE_CACHE_PATH_ENV_VAR_NAME: cache_path})
+        env_patcher.start()
+        self.addCleanup(env_patcher.stop)
+        ec2_client = connection.EC2ConnectionClient().client()
+        reservation = ec2_client.run_instances(
+            TEST_AMI_IMAGE_ID, instance_type=TEST_INSTANCE_TYPE)
+        image_id = ec2_client.create_image(
+            reservation.instances[0].id, 'test_get_image_persistent_cache')
+
+        with mock.patch.object(utils, 'acquire_lock',
+                               side_effect=utils.acquire_lock) as lock:
+            image = instance._get_image(image_id)
+            instance._image_cache.clear()
+            with mock.patch('boto.ec2.EC2Connection.get_image') as describe:
+                self.assertEqual(image, instance._get_image(image_id))
+        self.assertFalse(describe.called)
+        self.assertEqual(3, lock.call_count)
+        self.assertTrue(
+            lock.call_args[0][0].startswith('image-cache-'))
+
     @mock_ec2
     def test_start_and_tag_name(self):
         """ this tests that the instance start function
@@ -19,12 +19,15 @@ import os
 import tempfile
 
 # Third Party Imports
+import mock
 from moto import mock_ec2
+from Crypto.PublicKey import RSA
 
 # Cloudify Imports is imported and used in operations
 from ec2 import constants
 from ec2 import connection
 from ec2 import keypair
+from ec2 import passwd
 from cloudify.state import current_ctx
 from cloudify.mocks import MockCloudifyContext
 from cloudify.exceptions import NonRecoverableError
@@ -56,6 +59,20 @@ class TestKeyPair(testtools.TestCase):
 
         return ctx
 
+    def create_key_files(self, ctx):
+        key = RSA.generate(1024)
+        key_path = self.create_dummy_key_path(ctx=ctx)
+        public_key_path = '{0}.pub'.format(key_path)
+        with open(key_path, 'w') as key_file:
+            key_file.write(key.exportKey('PEM'))
+        with open(public_key_path, 'w') as public_key_file:
+            public_key_file.write(key.publickey().exportKey('OpenSSH'))
+        self.addCleanup(os.remove, key_path)
+        self.addCleanup(os.remove, public_key_path)
+        self.addCleanup(keypair._fingerprint_cache.clear)
+        ctx.node.properties['public_key_path'] = public_key_path
+        return key_path, public_key_path
+
     def create_dummy_key_path(self, ctx):
         key_path = os.path.expanduser(
             ctx.node.properties['private_key_path'])
@@ -392,3 +409,89 @@ class TestKeyPair(testtools.TestCase):
         keypair.delete(ctx=ctx)
         self.assertFalse(
             os.path.exists(temp_key))
+
+    @mock_ec2
+    def test_create_import(self):
+        """ This tests that a public key is imported when public_key_path
+        is set, and that the local key file is kept on delete.
+        """
+
+        ctx = self.mock_ctx('test_create_import')
+        current_ctx.set(ctx=ctx)
+        key_path, _ = self.create_key_files(ctx)
+
+        ec2_client = connection.EC2ConnectionClient().client()
+        with mock.patch.object(ec2_client.__class__, 'create_key_pair') \
+                as create_key_pair:
+            keypair.create(ctx=ctx)
+        self.assertFalse(create_key_pair.called)
+        kp = ec2_client.get_key_pair('test_create_import')
+        self.assertEqual(kp.fingerprint,
+                         ctx.instance.runtime_properties['fingerprint'])
+
+        keypair.delete(ctx=ctx)
+        self.assertEquals(None, ec2_client.get_key_pair(kp.name))
+        self.assertNotIn('fingerprint', ctx.instance.runtime_properties)
+        self.assertTrue(os.path.exists(key_path))
+
+    @mock_ec2
+    def test_create_import_no_key_file(self):
+        """ This tests that a public key is not imported without
+        the matching private key file.
+        """
+
+        ctx = self.mock_ctx('test_create_import_no_key_file')
+        current_ctx.set(ctx=ctx)
+        ctx.node.properties['public_key_path'] = tempfile.mktemp()
+        ex = self.assertRaises(NonRecoverableError, keypair.create, ctx=ctx)
+        self.assertIn('but the key file does not exist locally', ex.message)
+
+    def test_key_file_fingerprints(self):
+        """ This tests that a private key file matches the fingerprints of
+        both imported and created key pairs, a public key file matches
+        imported key pairs, and that files are only hashed once.
+        """
+
+        ctx = self.mock_ctx('test_key_file_fingerprints')
+        current_ctx.set(ctx=ctx)
+        key_path, public_key_path = self.create_key_files(ctx)
+
+        with mock.patch('ec2.passwd.get_rsa_key',
+                        side_effect=passwd.get_rsa_key) as get_key:
+            fingerprints = keypair._get_key_file_fingerprints(key_path)
+            self.assertEqual(
+                fingerprints, keypair._get_key_file_fingerprints(key_path))
+            public_fingerprints = \
+                keypair._get_key_file_fingerprints(public_key_path)
+        self.assertEqual(2, get_key.call_count)
+        self.assertEqual(2, len(fingerprints))
+        self.assertEqual(fingerprints[:1], public_fingerprints)
+        self.assertEqual(47, len(public_fingerprints[0]))
+        self.assertEqual(59, len(fingerprints[1]))
+
+    @mock_ec2
+    def test_validation_use_external_fingerprint(self):
+        """ Tests that an error is raised if you use external,
+        but the key pair does not match the local key file.
+        """
+
+        ctx = self.mock_ctx('test_validation_use_external_fingerprint')
+        current_ctx.set(ctx=ctx)
+        key_path, public_key_path = self.create_key_files(ctx)
+
+        ec2_client = connection.EC2ConnectionClient().client()
+        with open(public_key_path, 'r') as public_key_file:
+            kp = ec2_client.import_key_pair(
+                'test_validation_use_external_fingerprint',
+                public_key_file.read())
+        ctx.node.properties['use_external_resource'] = True
+        ctx.node.properties['resource_id'] = kp.name
+        ex = self.assertRaises(
+            NonRecoverableError, keypair.creation_validation, ctx=ctx)
+        self.assertIn('does not match the local key file', ex.message)
+
+        kp.fingerprint = \
+            keypair._get_key_file_fingerprints(public_key_path)[0]
+        with mock.patch('ec2.keypair._get_key_pair_by_id',
+                        return_value=kp):
+            keypair.creation_validation(ctx=ctx)
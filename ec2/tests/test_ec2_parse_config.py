@@ -19,6 +19,7 @@ import tempfile
 from ConfigParser import ConfigParser
 
 # Third Party Imports
+import mock
 import testtools
 from nose.tools import nottest
 
@@ -107,6 +108,30 @@ class TestParser(testtools.TestCase):
         self.assertRaises(NonRecoverableError,
                           client._get_aws_config_from_file)
 
+    @test_config(type="valid")
+    def test_aws_config_file_parsed_once(self):
+        client = connection.EC2ConnectionClient()
+        config = client._get_aws_config_from_file()
+        config['aws_access_key_id'] = 'changed by caller'
+
+        with mock.patch('ConfigParser.ConfigParser.read') as mock_read:
+            cached_config = client._get_aws_config_from_file()
+        self.assertFalse(mock_read.called)
+        self.assertEqual('aws_access_key_id',
+                         cached_config['aws_access_key_id'])
+
+    @test_config(type="valid")
+    def test_aws_config_file_changed(self):
+        client = connection.EC2ConnectionClient()
+        client._get_aws_config_from_file()
+
+        config_path = os.environ[constants.AWS_CONFIG_PATH_ENV_VAR_NAME]
+        with open(config_path, 'a') as config_file:
+            config_file.write('[invalid_section]\n')
+        self.assertRaisesRegexp(Exception,
+                                'Unsupported Boto section',
+                                client._get_aws_config_from_file)
+
     def _generate_config_file(self, config_type):
         """Generate Boto cfg file and return its path
         """
@@ -0,0 +1,94 @@
+########
+# Copyright (c) 2015 GigaSpaces Technologies Ltd. All rights reserved
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+#    * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    * See the License for the specific language governing permissions and
+#    * limitations under the License.
+
+# Built-in Imports
+import os
+import base64
+import tempfile
+
+# Third Party Imports
+import testtools
+import mock
+from Crypto.Cipher import PKCS1_v1_5
+from Crypto.PublicKey import RSA
+from Crypto.Util.number import long_to_bytes
+
+# Cloudify Imports is imported and used in operations
+from ec2 import passwd
+from cloudify.exceptions import NonRecoverableError
+
+
+class TestPasswd(testtools.TestCase):
+
+    def setUp(self):
+        super(TestPasswd, self).setUp()
+        self.key = RSA.generate(1024)
+        fd, self.key_path = tempfile.mkstemp()
+        os.write(fd, self.key.exportKey())
+        os.close(fd)
+        self.addCleanup(os.remove, self.key_path)
+        self.addCleanup(passwd._key_cache.clear)
+
+    def encrypt(self, password):
+        cipher = PKCS1_v1_5.new(self.key.publickey())
+        return base64.b64encode(cipher.encrypt(password))
+
+    def test_get_windows_passwd(self):
+        """ Tests that password data is decrypted with the key file. """
+
+        output = passwd.get_windows_passwd(
+            self.key_path, self.encrypt('Pa$$w0rd'))
+        self.assertEqual('Pa$$w0rd', output)
+
+    def test_get_windows_passwd_bad_padding(self):
+        """ Tests that data without PKCS#1 v1.5 padding
+        decrypts to nothing.
+        """
+
+        unpadded = long_to_bytes(
+            pow(12345, self.key.e, self.key.n), len(long_to_bytes(self.key.n)))
+        output = passwd.get_windows_passwd(
+            self.key_path, base64.b64encode(unpadded))
+        self.assertFalse(output)
+
+    def test_key_is_parsed_once(self):
+        """ Tests that an unchanged key file is only parsed once. """
+
+        with mock.patch('ec2.passwd.RSA.importKey',
+                        return_value=self.key) as import_key:
+            passwd.get_windows_passwd(self.key_path, self.encrypt('a'))
+            passwd.get_windows_passwd(self.key_path, self.encrypt('b'))
+        self.assertEqual(1, import_key.call_count)
+
+    def test_changed_key_is_parsed_again(self):
+        """ Tests that a key file is parsed again when it changes. """
+
+        passwd.get_windows_passwd(self.key_path, self.encrypt('a'))
+        self.key = RSA.generate(2048)
+        with open(self.key_path, 'w') as key_file:
+            key_file.write(self.key.exportKey())
+        output = passwd.get_windows_passwd(
+            self.key_path, self.encrypt('b'))
+        self.assertEqual('b', output)
+
+    def test_bad_key_file(self):
+        """ Tests that a file that is not a key raises an error. """
+
+        with open(self.key_path, 'w') as key_file:
+            key_file.write('not a key')
+        ex = self.assertRaises(
+            NonRecoverableError, passwd.get_windows_passwd,
+            self.key_path, self.encrypt('a'))
+        self.assertIn('Could not import SSH Key', ex.message)
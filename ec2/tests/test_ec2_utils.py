@@ -14,18 +14,26 @@
 #    * limitations under the License.
 
 # Builtin Imports
+import os
+import shutil
 import tempfile
 import testtools
+from StringIO import StringIO
 
 # Third Party Imports
+import mock
 from moto import mock_ec2
 from boto.ec2 import EC2Connection
+from boto.resultset import ResultSet
 
 # Cloudify Imports is imported and used in operations
 from ec2 import utils
 from ec2 import constants
 from cloudify.state import current_ctx
+from cloudify.mocks import MockContext
+from cloudify.mocks import MockNodeContext
 from cloudify.mocks import MockCloudifyContext
+from cloudify.mocks import MockNodeInstanceContext
 from cloudify.exceptions import NonRecoverableError
 
 TEST_AMI_IMAGE_ID = 'ami-e214778a'
@@ -291,3 +299,244 @@ class TestUtils(testtools.TestCase):
             ctx.instance)
 
         self.assertEquals(0, len(output))
+
+    def _mock_relationship(self, relationship_type, resource_id,
+                           aws_type=None):
+        runtime_properties = {constants.EXTERNAL_RESOURCE_ID: resource_id}
+        if aws_type:
+            runtime_properties[constants.AWS_TYPE_PROPERTY] = aws_type
+        return MockContext({
+            'type': relationship_type,
+            'target': MockContext({
+                'node': MockNodeContext(id=resource_id),
+                'instance': MockNodeInstanceContext(
+                    id=resource_id, runtime_properties=runtime_properties)
+            })
+        })
+
+    def test_get_target_external_resource_ids_by_index(self):
+
+        ctx = self.mock_ctx(
+            'test_get_target_external_resource_ids_by_index')
+        current_ctx.set(ctx=ctx)
+        ctx.instance.relationships = [
+            self._mock_relationship(
+                'cloudify.aws.relationships.instance_connected_to_'
+                'security_group', 'sg-1'),
+            self._mock_relationship(
+                'cloudify.aws.relationships.instance_connected_to_keypair',
+                'key', aws_type='keypair'),
+            self._mock_relationship(
+                'derived_instance_connected_to_security_group', 'sg-2')
+        ]
+
+        output = utils.get_target_external_resource_ids(
+            'instance_connected_to_security_group', ctx.instance)
+        self.assertEqual(['sg-1', 'sg-2'], output)
+        self.assertEqual(
+            ['key'],
+            [node.id for node in
+             utils.get_connected_nodes_by_type(ctx, 'keypair')])
+
+        ctx.instance.relationships.insert(0, self._mock_relationship(
+            'cloudify.aws.relationships.instance_connected_to_'
+            'security_group', 'sg-0'))
+        output = utils.get_target_external_resource_ids(
+            'instance_connected_to_security_group', ctx.instance)
+        self.assertEqual(['sg-0', 'sg-1', 'sg-2'], output)
+
+    def test_get_connected_nodes_by_type_reads_candidates(self):
+
+        ctx = self.mock_ctx(
+            'test_get_connected_nodes_by_type_reads_candidates')
+        current_ctx.set(ctx=ctx)
+        security_group_instance = mock.Mock(id='sg-1')
+        runtime_properties = mock.PropertyMock(return_value={})
+        type(security_group_instance).runtime_properties = runtime_properties
+        security_group = MockContext({
+            'type': 'cloudify.aws.relationships.instance_connected_to_'
+                    'security_group',
+            'target': MockContext({
+                'node': MockNodeContext(id='sg-1'),
+                'instance': security_group_instance
+            })
+        })
+        ctx.instance.relationships = [
+            security_group,
+            self._mock_relationship(
+                'cloudify.relationships.connected_to', 'key-1',
+                aws_type='keypair')
+        ]
+
+        self.assertEqual(
+            ['key-1'],
+            [node.id for node in
+             utils.get_connected_nodes_by_type(ctx, 'keypair')])
+        self.assertFalse(runtime_properties.called)
+
+        ctx.instance.relationships[1] = self._mock_relationship(
+            'cloudify.relationships.connected_to', 'key-2',
+            aws_type='keypair')
+        self.assertEqual(
+            ['key-2'],
+            [node.id for node in
+             utils.get_connected_nodes_by_type(ctx, 'keypair')])
+
+    def test_iterate_pages(self):
+
+        pages = {None: (['a', 'b'], 'token-1'),
+                 'token-1': (['c'], 'token-2'),
+                 'token-2': (['d'], None)}
+        calls = []
+
+        def list_function(max_results, next_token=None):
+            calls.append(next_token)
+            page = ResultSet()
+            page.extend(pages[next_token][0])
+            page.next_token = pages[next_token][1]
+            return page
+
+        output = utils.iterate_pages(list_function, max_results=2)
+        self.assertEqual(['a', 'b', 'c', 'd'], list(output))
+        self.assertEqual([None, 'token-1', 'token-2'], calls)
+
+        del calls[:]
+        output = utils.iterate_pages(list_function, max_results=2)
+        self.assertEqual('c', next(r for r in output if r == 'c'))
+        self.assertEqual([None, 'token-1'], calls)
+
+    @mock_ec2
+    def test_describe_by_ids_shared(self):
+        """ this tests that describe results are shared through
+        the cache directory until they are invalidated
+        """
+
+        cache_path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, cache_path)
+        environ = {constants.AWS_DESCRIBE_CACHE_PATH_ENV_VAR_NAME: cache_path}
+        volume_ids = [EC2Connection().create_volume(1, 'us-east-1a').id
+                      for _ in range(2)]
+
+        with mock.patch.dict(os.environ, environ), \
+                mock.patch.object(EC2Connection, 'get_all_volumes',
+                                  autospec=True,
+                                  side_effect=EC2Connection.
+                                  get_all_volumes) as describe:
+            output = utils.describe_by_ids(
+                EC2Connection().get_all_volumes, 'volume_ids', volume_ids,
+                fields=('size', 'zone'))
+            self.assertEqual(set(volume_ids), set(output))
+            self.assertEqual(1, describe.call_count)
+
+            client = EC2Connection()
+            output = utils.describe_by_ids(
+                client.get_all_volumes, 'volume_ids', volume_ids,
+                fields=('size', 'zone'))
+            self.assertEqual(set(volume_ids), set(output))
+            self.assertEqual(1, describe.call_count)
+            self.assertEqual((1, 'us-east-1a'), output[volume_ids[0]])
+
+            utils.invalidate_described(client, volume_ids[:1])
+            output = utils.describe_by_ids(
+                client.get_all_volumes, 'volume_ids', volume_ids,
+                fields=('size', 'zone'))
+            self.assertEqual(set(volume_ids), set(output))
+            self.assertEqual(2, describe.call_count)
+            self.assertEqual(volume_ids[:1],
+                             describe.call_args[1]['volume_ids'])
+
+            other_account = EC2Connection(aws_access_key_id='other',
+                                          aws_secret_access_key='other')
+            utils.describe_by_ids(
+                other_account.get_all_volumes, 'volume_ids', volume_ids,
+                fields=('size', 'zone'))
+            self.assertEqual(3, describe.call_count)
+
+            # Existence checks do not use the cache.
+            output = utils.describe_by_ids(
+                client.get_all_volumes, 'volume_ids', volume_ids)
+            self.assertEqual(4, describe.call_count)
+            self.assertIs(client, output[volume_ids[0]].connection)
+
+    @mock_ec2
+    def test_describe_by_ids_shared_cleanup(self):
+        """ this tests that the describe cache directory must be private,
+        and that expired entries are removed
+        """
+
+        cache_path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, cache_path)
+        self.addCleanup(utils._described_sweeps.clear)
+        environ = {constants.AWS_DESCRIBE_CACHE_PATH_ENV_VAR_NAME: cache_path}
+        volume_id = EC2Connection().create_volume(1, 'us-east-1a').id
+
+        with mock.patch.dict(os.environ, environ):
+            os.chmod(cache_path, 0o777)
+            self.assertRaises(
+                NonRecoverableError, utils.describe_by_ids,
+                EC2Connection().get_all_volumes, 'volume_ids', [volume_id],
+                fields=())
+
+            os.chmod(cache_path, 0o700)
+            utils.describe_by_ids(
+                EC2Connection().get_all_volumes, 'volume_ids', [volume_id],
+                fields=())
+            self.assertEqual(1, len(os.listdir(cache_path)))
+
+            with mock.patch.object(constants, 'DESCRIBE_CACHE_TTL', -1):
+                utils.describe_by_ids(
+                    EC2Connection().get_all_security_groups, 'group_ids',
+                    ['sg-0123abcd'], not_found_token='InvalidGroup.NotFound',
+                    fields=())
+            self.assertEqual([], os.listdir(cache_path))
+
+    @mock_ec2
+    def test_describe_instance_fields(self):
+        """ this tests that only the requested fields are described,
+        with the values of the boto instance attributes
+        """
+
+        ec2_client = EC2Connection()
+        instances = ec2_client.run_instances(
+            TEST_AMI_IMAGE_ID, min_count=3, max_count=3).instances
+        fields = ['state_code', 'placement', 'private_ip_address']
+
+        instance_ids = sorted(i.id for i in instances[:2])
+        records = utils.describe_instance_fields(
+            ec2_client, instance_ids, fields)
+        self.assertEqual(2, len(records))
+        described = sorted(ec2_client.get_only_instances(instance_ids),
+                           key=lambda i: i.id)
+        for record, instance in zip(sorted(records), described):
+            self.assertEqual(('id',) + tuple(fields), record._fields)
+            self.assertEqual(instance.id, record.id)
+            for field in fields:
+                self.assertEqual(getattr(instance, field),
+                                 getattr(record, field))
+
+        records = utils.describe_instance_fields(ec2_client, None, ['state'])
+        self.assertEqual(3, len(records))
+        self.assertEqual(set(['running']), set(r.state for r in records))
+
+    def test_parse_instance_fields(self):
+        """ this tests that nested items are not taken for instances,
+        and that the next page token is returned
+        """
+
+        response = StringIO(
+            '<DescribeInstancesResponse xmlns="http://ec2.amazonaws.com/">'
+            '<reservationSet><item><groupSet><item><groupId>sg-1</groupId>'
+            '</item></groupSet><instancesSet><item><instanceId>i-1'
+            '</instanceId><instanceState><code>80</code><name>stopped'
+            '</name></instanceState><tagSet><item><key>instanceId</key>'
+            '</item></tagSet></item><item><instanceId>i-2</instanceId>'
+            '</item></instancesSet></item></reservationSet>'
+            '<nextToken>token-1</nextToken></DescribeInstancesResponse>')
+        fields = ('id', 'state_code')
+        records = []
+
+        next_token = utils._parse_instance_fields(
+            response, fields, utils.collections.namedtuple(
+                'InstanceRecord', fields), records)
+        self.assertEqual('token-1', next_token)
+        self.assertEqual([('i-1', 80), ('i-2', None)], records)
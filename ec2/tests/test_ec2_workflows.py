@@ -0,0 +1,469 @@
+########
+# Copyright (c) 2015 GigaSpaces Technologies Ltd. All rights reserved
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+#    * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    * See the License for the specific language governing permissions and
+#    * limitations under the License.
+
+# Built-in Imports
+import os
+import shutil
+import tempfile
+import testtools
+
+# Third Party Imports
+import mock
+from moto import mock_ec2
+from boto.ec2 import EC2Connection
+from boto.vpc import VPCConnection
+from boto.exception import EC2ResponseError
+
+# Cloudify Imports is imported and used in operations
+from ec2 import constants
+from ec2 import workflows
+from cloudify.state import current_ctx
+from cloudify.exceptions import NonRecoverableError
+from cloudify_rest_client.exceptions import CloudifyClientError
+
+TEST_AMI_IMAGE_ID = 'ami-e214778a'
+TEST_INSTANCE_TYPE = 't1.micro'
+
+
+class TestBatchWorkflows(testtools.TestCase):
+
+    def setUp(self):
+        super(TestBatchWorkflows, self).setUp()
+        current_ctx.clear()
+
+        self.workflow_ctx = mock.MagicMock()
+        self.workflow_ctx.local = False
+        self.workflow_ctx.get_node.side_effect = self.get_node
+        ctx_patcher = mock.patch('ec2.workflows.ctx', self.workflow_ctx)
+        ctx_patcher.start()
+        self.addCleanup(ctx_patcher.stop)
+
+        self.node_instances = {}
+        self.rest_client = mock.MagicMock()
+        self.rest_client.node_instances.get.side_effect = \
+            self.node_instances.get
+        self.rest_client.node_instances.update.side_effect = \
+            self.update_node_instance
+        rest_patcher = mock.patch('ec2.workflows.manager.get_rest_client',
+                                  return_value=self.rest_client)
+        rest_patcher.start()
+        self.addCleanup(rest_patcher.stop)
+
+    def get_node(self, node_id):
+        node = mock.Mock()
+        node.type_hierarchy = ['cloudify.nodes.Root',
+                               'cloudify.nodes.Compute',
+                               constants.INSTANCE_NODE_TYPE]
+        node.properties = {
+            'use_external_resource': node_id == 'external',
+            constants.AWS_CONFIG_PROPERTY: {}
+        }
+        return node
+
+    def update_node_instance(self, node_instance_id, state=None,
+                             runtime_properties=None, version=0):
+        node_instance = self.node_instances[node_instance_id]
+        node_instance.runtime_properties = runtime_properties
+        node_instance.state = state
+        node_instance.version += 1
+
+    def create_node_instances(self, count, node_id='vm'):
+        ec2_client = EC2Connection()
+        reservation = ec2_client.run_instances(
+            TEST_AMI_IMAGE_ID, instance_type=TEST_INSTANCE_TYPE,
+            min_count=count, max_count=count)
+        node_instances = []
+        for index, instance in enumerate(reservation.instances):
+            node_instance = mock.Mock()
+            node_instance.id = '{0}_{1}'.format(node_id, index)
+            node_instance.node_id = node_id
+            node_instance.version = 1
+            node_instance.runtime_properties = {
+                constants.EXTERNAL_RESOURCE_ID: instance.id
+            }
+            node_instances.append(node_instance)
+            self.node_instances[node_instance.id] = node_instance
+        return node_instances
+
+    @mock_ec2
+    def test_batch_stop_and_start(self):
+        """ this tests that batch stop and start change the state of
+        all instances and update their runtime properties
+        """
+
+        node_instances = self.create_node_instances(3)
+        self.rest_client.node_instances.list.return_value = node_instances
+
+        workflows._run_batch(
+            'stop_instances', constants.INSTANCE_STATE_STOPPED,
+            constants.NODE_INSTANCE_STATE_STOPPED,
+            workflows._instance_stopped_unassign_runtime_properties,
+            None, None, 0, 10)
+        self.assertEqual(3, self.rest_client.node_instances.update.call_count)
+        for node_instance in node_instances:
+            self.assertNotIn('ip', node_instance.runtime_properties)
+            self.assertEqual(constants.NODE_INSTANCE_STATE_STOPPED,
+                             node_instance.state)
+
+        workflows._run_batch(
+            'start_instances', constants.INSTANCE_STATE_STARTED,
+            constants.NODE_INSTANCE_STATE_STARTED,
+            workflows._instance_started_assign_runtime_properties,
+            None, None, 0, 10)
+        instances = EC2Connection().get_only_instances(
+            instance_ids=[n.runtime_properties[
+                constants.EXTERNAL_RESOURCE_ID] for n in node_instances])
+        for instance in instances:
+            self.assertEqual(constants.INSTANCE_STATE_STARTED,
+                             instance.state_code)
+        instances = dict((instance.id, instance) for instance in instances)
+        for node_instance in node_instances:
+            instance = instances[node_instance.runtime_properties[
+                constants.EXTERNAL_RESOURCE_ID]]
+            self.assertEqual(instance.private_ip_address,
+                             node_instance.runtime_properties['ip'])
+            self.assertEqual(
+                instance.ip_address,
+                node_instance.runtime_properties['public_ip_address'])
+            self.assertEqual(constants.NODE_INSTANCE_STATE_STARTED,
+                             node_instance.state)
+
+    @mock_ec2
+    def test_batch_terminate_chunks(self):
+        """ this tests that batch terminate sends one request
+        for each chunk of instance ids
+        """
+
+        node_instances = self.create_node_instances(3)
+        self.rest_client.node_instances.list.return_value = node_instances
+
+        with mock.patch.object(constants, 'BATCH_INSTANCE_IDS_LIMIT', 2), \
+                mock.patch.object(EC2Connection, 'terminate_instances',
+                                  autospec=True,
+                                  side_effect=EC2Connection.
+                                  terminate_instances) as terminate:
+            workflows._run_batch(
+                'terminate_instances', constants.INSTANCE_STATE_TERMINATED,
+                constants.NODE_INSTANCE_STATE_DELETED,
+                workflows._instance_terminated_unassign_runtime_properties,
+                None, None, 0, 10)
+        self.assertEqual(2, terminate.call_count)
+        for node_instance in node_instances:
+            self.assertNotIn(constants.EXTERNAL_RESOURCE_ID,
+                             node_instance.runtime_properties)
+            self.assertNotIn('ip', node_instance.runtime_properties)
+            self.assertEqual(constants.NODE_INSTANCE_STATE_DELETED,
+                             node_instance.state)
+
+    @mock_ec2
+    def test_batch_update_version_conflict(self):
+        """ this tests that a node instance that was changed in the
+        meantime is read again before it is updated
+        """
+
+        node_instances = self.create_node_instances(1)
+        self.rest_client.node_instances.list.return_value = node_instances
+        node_instances[0].runtime_properties['ip'] = '10.0.0.1'
+
+        def update_node_instance(node_instance_id, **kwargs):
+            node_instances[0].runtime_properties = dict(
+                node_instances[0].runtime_properties, other='value')
+            node_instances[0].version += 1
+            self.rest_client.node_instances.update.side_effect = \
+                self.update_node_instance
+            raise CloudifyClientError('conflict', status_code=409)
+        self.rest_client.node_instances.update.side_effect = \
+            update_node_instance
+
+        workflows._run_batch(
+            'stop_instances', constants.INSTANCE_STATE_STOPPED,
+            constants.NODE_INSTANCE_STATE_STOPPED,
+            workflows._instance_stopped_unassign_runtime_properties,
+            None, None, 0, 10)
+        self.assertEqual(2, self.rest_client.node_instances.update.call_count)
+        self.assertEqual(
+            {constants.EXTERNAL_RESOURCE_ID:
+             node_instances[0].runtime_properties[
+                 constants.EXTERNAL_RESOURCE_ID], 'other': 'value'},
+            node_instances[0].runtime_properties)
+        self.assertEqual(3, node_instances[0].version)
+
+    @mock_ec2
+    def test_batch_local_workflow(self):
+        """ this tests that a local workflow reads and updates node
+        instances in its local storage
+        """
+
+        self.workflow_ctx.local = True
+        storage = self.workflow_ctx.internal.handler.storage
+        node_instances = self.create_node_instances(1)
+        storage.get_node_instances.return_value = node_instances
+        storage.get_node_instance.side_effect = self.node_instances.get
+
+        workflows._run_batch(
+            'stop_instances', constants.INSTANCE_STATE_STOPPED,
+            constants.NODE_INSTANCE_STATE_STOPPED,
+            workflows._instance_stopped_unassign_runtime_properties,
+            None, None, 0, 10)
+        self.assertFalse(self.rest_client.node_instances.list.called)
+        storage.update_node_instance.assert_has_calls([
+            mock.call('vm_0', version=1,
+                      runtime_properties=node_instances[0].runtime_properties),
+            mock.call('vm_0', version=None,
+                      state=constants.NODE_INSTANCE_STATE_STOPPED)])
+
+    @mock_ec2
+    def test_batch_selection(self):
+        """ this tests that only the selected Cloudify instances are
+        included in a batch
+        """
+
+        node_instances = self.create_node_instances(2) + \
+            self.create_node_instances(1, node_id='other') + \
+            self.create_node_instances(1, node_id='external')
+        self.rest_client.node_instances.list.return_value = node_instances
+
+        selected = workflows._get_batch_node_instances(None, None)
+        self.assertEqual(['vm_0', 'vm_1', 'other_0'],
+                         [n.id for n in selected])
+        selected = workflows._get_batch_node_instances(['vm'], ['vm_1'])
+        self.assertEqual(['vm_1'], [n.id for n in selected])
+
+    @mock_ec2
+    def test_batch_timeout(self):
+        """ this tests that instances that do not reach the
+        state in time raise an error
+        """
+
+        node_instances = self.create_node_instances(1)
+        self.rest_client.node_instances.list.return_value = node_instances
+
+        ex = self.assertRaises(
+            NonRecoverableError, workflows._run_batch,
+            'start_instances', constants.INSTANCE_STATE_STOPPED,
+            constants.NODE_INSTANCE_STATE_STOPPED,
+            workflows._instance_stopped_unassign_runtime_properties,
+            None, None, 0, 0)
+        self.assertIn('Timed out', ex.message)
+        self.assertFalse(self.rest_client.node_instances.update.called)
+
+    def mock_node(self, node_id, node_type, **properties):
+        node = mock.Mock()
+        node.id = node_id
+        node.type_hierarchy = ['cloudify.nodes.Root', node_type]
+        node.properties = {
+            'use_external_resource': False,
+            'resource_id': '',
+            constants.AWS_CONFIG_PROPERTY: {}
+        }
+        node.properties.update(properties)
+        return node
+
+    @mock_ec2
+    def test_batch_creation_validation(self):
+        """ this tests that all nodes are validated with one describe
+        call per resource type
+        """
+
+        ec2_client = VPCConnection()
+        instance_ids = [i.id for i in ec2_client.run_instances(
+            TEST_AMI_IMAGE_ID, min_count=2, max_count=2).instances]
+        image_id = ec2_client.create_image(instance_ids[0], 'image')
+        group = ec2_client.create_security_group('group', 'description')
+        subnet_id = ec2_client.create_subnet(
+            ec2_client.create_vpc('10.0.0.0/16').id, '10.0.0.0/24').id
+        instance_properties = dict(
+            use_external_resource=True, image_id=image_id,
+            instance_type=TEST_INSTANCE_TYPE)
+
+        self.workflow_ctx.nodes = [
+            self.mock_node('vm_1', constants.INSTANCE_NODE_TYPE,
+                           resource_id=instance_ids[0],
+                           **instance_properties),
+            self.mock_node('vm_2', constants.INSTANCE_NODE_TYPE,
+                           resource_id=instance_ids[1],
+                           **instance_properties),
+            self.mock_node('group', 'cloudify.aws.nodes.SecurityGroup',
+                           resource_id=group.name, description='',
+                           rules=[], use_external_resource=True),
+            self.mock_node('subnet', 'cloudify.aws.nodes.Subnet',
+                           resource_id=subnet_id, cidr_block='',
+                           use_external_resource=True)
+        ]
+
+        with mock.patch.object(EC2Connection, 'get_only_instances',
+                               autospec=True,
+                               side_effect=EC2Connection.
+                               get_only_instances) as describe:
+            errors = workflows._get_validation_errors(
+                self.workflow_ctx.nodes)
+        self.assertEqual([], errors)
+        self.assertEqual(1, describe.call_count)
+
+        self.workflow_ctx.nodes.extend([
+            self.mock_node('vm_3', constants.INSTANCE_NODE_TYPE,
+                           resource_id=instance_ids[1],
+                           image_id='ami-0123abcd',
+                           instance_type=TEST_INSTANCE_TYPE),
+            self.mock_node('volume', 'cloudify.aws.nodes.Volume',
+                           resource_id='vol-0123abcd', size=1,
+                           zone='', device='',
+                           use_external_resource=True)
+        ])
+        errors = workflows._get_validation_errors(self.workflow_ctx.nodes)
+        self.assertEqual(3, len(errors))
+        self.assertIn('vm_3: Not external resource', '\n'.join(errors))
+        self.assertIn('volume: External resource', '\n'.join(errors))
+        self.assertIn('vm_3: image_id ami-0123abcd', '\n'.join(errors))
+
+    @mock_ec2
+    def test_batch_creation_validation_malformed_id(self):
+        """ this tests that an ID that fails the describe call is
+        reported for its node only
+        """
+
+        ec2_client = EC2Connection()
+        volume_id = ec2_client.create_volume(1, 'us-east-1a').id
+        get_all_volumes = EC2Connection.get_all_volumes
+
+        def describe(connection, volume_ids=None, **kwargs):
+            if 'vol-malformed' in volume_ids:
+                raise EC2ResponseError(
+                    400, 'Bad Request',
+                    '<Code>InvalidVolumeID.Malformed</Code>')
+            return get_all_volumes(connection, volume_ids=volume_ids,
+                                   **kwargs)
+
+        nodes = [
+            self.mock_node('volume', 'cloudify.aws.nodes.Volume',
+                           resource_id=volume_id, size=1, zone='',
+                           device='', use_external_resource=True),
+            self.mock_node('malformed', 'cloudify.aws.nodes.Volume',
+                           resource_id='vol-malformed', size=1, zone='',
+                           device='', use_external_resource=True)
+        ]
+
+        with mock.patch.object(EC2Connection, 'get_all_volumes',
+                               autospec=True, side_effect=describe):
+            errors = workflows._get_validation_errors(nodes)
+        self.assertEqual(1, len(errors))
+        self.assertIn('malformed: Unable to look up the supplied '
+                      'EBS volume vol-malformed', errors[0])
+        self.assertIn('InvalidVolumeID.Malformed', errors[0])
+
+    @mock_ec2
+    def test_batch_creation_validation_invalid_image(self):
+        """ this tests that an image ID that fails the describe call is
+        reported for its node only
+        """
+
+        ec2_client = EC2Connection()
+        instance_id = ec2_client.run_instances(
+            TEST_AMI_IMAGE_ID).instances[0].id
+        image_id = ec2_client.create_image(instance_id, 'image')
+        get_all_images = EC2Connection.get_all_images
+
+        def describe(connection, image_ids=None, **kwargs):
+            if 'ami-invalid' in image_ids:
+                raise EC2ResponseError(
+                    400, 'Bad Request',
+                    '<Code>InvalidParameterValue</Code>')
+            return get_all_images(connection, image_ids=image_ids, **kwargs)
+
+        nodes = [
+            self.mock_node('vm', constants.INSTANCE_NODE_TYPE,
+                           image_id=image_id,
+                           instance_type=TEST_INSTANCE_TYPE),
+            self.mock_node('invalid', constants.INSTANCE_NODE_TYPE,
+                           image_id='ami-invalid',
+                           instance_type=TEST_INSTANCE_TYPE)
+        ]
+
+        with mock.patch.object(EC2Connection, 'get_all_images',
+                               autospec=True, side_effect=describe):
+            errors = workflows._get_validation_errors(nodes)
+        self.assertEqual(1, len(errors))
+        self.assertIn('invalid: Unable to look up the supplied image_id '
+                      'ami-invalid', errors[0])
+        self.assertIn('InvalidParameterValue', errors[0])
+
+    @mock_ec2
+    def test_batch_creation_validation_key_files(self):
+        """ this tests that the local key files of key pairs are
+        validated
+        """
+
+        key_directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, key_directory)
+        existing_key_path = os.path.join(key_directory, 'existing.pem')
+        open(existing_key_path, 'w').close()
+        EC2Connection().create_key_pair('external')
+
+        nodes = [
+            self.mock_node('new', 'cloudify.aws.nodes.KeyPair',
+                           private_key_path=existing_key_path),
+            self.mock_node('external', 'cloudify.aws.nodes.KeyPair',
+                           resource_id='external',
+                           use_external_resource=True,
+                           private_key_path=os.path.join(
+                               key_directory, 'external.pem'))
+        ]
+
+        errors = workflows._get_validation_errors(nodes)
+        self.assertEqual(
+            ['external: External resource, but the key file does not '
+             'exist locally.',
+             'new: Not external resource, but the key file exists locally.'],
+            sorted(errors))
+
+    def test_warm_pool_operations(self):
+        """ this tests that the refill operation is executed on all of the
+        instances of the selected nodes, and the drain operation once per
+        node.
+        """
+
+        nodes = [
+            self.mock_node('vm', constants.INSTANCE_NODE_TYPE),
+            self.mock_node('other_vm', constants.INSTANCE_NODE_TYPE),
+            self.mock_node('volume', 'cloudify.aws.nodes.Volume')
+        ]
+        for node in nodes:
+            node.instances = [mock.Mock(), mock.Mock()]
+            node.operations = {}
+            if node.id != 'volume':
+                node.operations = {
+                    'cloudify.interfaces.warm_pool.refill': {},
+                    'cloudify.interfaces.warm_pool.drain': {}
+                }
+        self.workflow_ctx.nodes = nodes
+
+        workflows._execute_warm_pool_operation(
+            'refill', ['vm', 'volume'], all_instances=True)
+        for node_instance in nodes[0].instances:
+            node_instance.execute_operation.assert_called_once_with(
+                'cloudify.interfaces.warm_pool.refill')
+        for node in nodes[1:]:
+            for node_instance in node.instances:
+                self.assertFalse(node_instance.execute_operation.called)
+
+        workflows._execute_warm_pool_operation(
+            'drain', None, all_instances=False)
+        for node in nodes[:2]:
+            node.instances[0].execute_operation.assert_called_with(
+                'cloudify.interfaces.warm_pool.drain')
+        self.assertEqual(1, nodes[0].instances[1].execute_operation.call_count)
+        self.assertFalse(nodes[1].instances[1].execute_operation.called)
+        for node_instance in nodes[2].instances:
+            self.assertFalse(node_instance.execute_operation.called)
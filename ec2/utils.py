@@ -15,7 +15,18 @@
 
 # Built-in Imports
 import os
+import glob
+import fcntl
+import time
 import uuid
+import json
+import errno
+import hashlib
+import weakref
+import tempfile
+import collections
+from contextlib import closing
+from xml.etree import cElementTree
 
 # Cloudify Imports
 from ec2 import constants
@@ -25,6 +36,16 @@ from cloudify.exceptions import NonRecoverableError
 # Third-party Imports
 from boto import exception
 
+# Relationship indexes by node instance context.
+_relationship_indexes = weakref.WeakKeyDictionary()
+
+# When each shared describe cache directory was last swept, by path.
+_described_sweeps = {}
+
+# Record types of describe_instance_fields and describe_by_ids,
+# by their names and fields.
+_record_types = {}
+
 
 def validate_node_property(key, ctx_node_properties):
     """Checks if the node property exists in the blueprint.
@@ -49,6 +70,409 @@ def log_available_resources(list_of_resources):
     ctx.logger.debug(message)
 
 
+def iterate_pages(list_function, token_argument='next_token',
+                  token_attribute='next_token', **kwargs):
+    """Yields the resources of a paginated describe call page by page,
+    so that callers can stop as soon as they found what they need.
+
+    :param list_function: A boto describe method.
+    :param token_argument: The list_function argument that takes the
+    token of the next page.
+    :param token_attribute: The result set attribute that holds the token
+    of the next page.
+    :param kwargs: Passed to every list_function call.
+    """
+
+    while True:
+        page = list_function(**kwargs)
+        for resource in page:
+            yield resource
+        token = getattr(page, token_attribute, None)
+        if not token:
+            return
+        kwargs[token_argument] = token
+
+
+def describe_by_ids(describe_function, argument, resource_ids,
+                    id_attribute='id', not_found_token='NotFound',
+                    fields=None):
+    """Resolves many resource IDs with a single describe call.
+
+    Existence checks must see resources that were just deleted, so only
+    lookups that pass fields read the describe cache. When
+    AWS_DESCRIBE_CACHE_PATH is set, their results are shared with the
+    operations of other processes on this host.
+
+    :param describe_function: A boto describe method.
+    :param argument: The describe_function argument that takes IDs.
+    :param resource_ids: A list of resource IDs.
+    :param id_attribute: The resource attribute that holds its ID.
+    :param not_found_token: The error code of a missing ID.
+    :param fields: Names of resource attributes with plain values, like
+    strings and numbers. When they are passed, the resources are returned
+    as records with only these attributes.
+    :returns a dict of resource ID to resource, for the IDs that exist.
+    :raises NonRecoverableError: If Boto errors.
+    """
+
+    resource_ids = set(
+        resource_id for resource_id in resource_ids if resource_id)
+
+    if not resource_ids:
+        return {}
+
+    if fields is None:
+        return _describe_by_ids(describe_function, argument, resource_ids,
+                                id_attribute, not_found_token)
+
+    fields = tuple(fields)
+    record_type = _get_record_type('DescribedRecord', fields)
+    cache_path = os.environ.get(
+        constants.AWS_DESCRIBE_CACHE_PATH_ENV_VAR_NAME)
+
+    if not cache_path:
+        described = _describe_by_ids(describe_function, argument,
+                                     resource_ids, id_attribute,
+                                     not_found_token)
+        return dict(
+            (resource_id, record_type(**_get_fields(resource, fields)))
+            for resource_id, resource in described.items())
+
+    return dict(
+        (resource_id, record_type(**values))
+        for resource_id, values in _describe_by_ids_shared(
+            cache_path, describe_function, argument, resource_ids,
+            id_attribute, not_found_token, fields).items())
+
+
+def invalidate_described(client, resource_ids):
+    """Removes resources from the shared describe cache after
+    the plugin changed them.
+
+    :param client: The boto connection that changed the resources.
+    :param resource_ids: A list of resource IDs.
+    """
+
+    cache_path = os.environ.get(
+        constants.AWS_DESCRIBE_CACHE_PATH_ENV_VAR_NAME)
+
+    if not cache_path:
+        return
+
+    for resource_id in resource_ids:
+        if not resource_id:
+            continue
+        prefix = _get_described_prefix(client, resource_id)
+        for path in glob.glob(os.path.join(
+                cache_path, '{0}-*.json'.format(prefix))):
+            _remove_described(path)
+
+
+def _describe_by_ids(describe_function, argument, resource_ids,
+                     id_attribute, not_found_token):
+
+    def describe(ids):
+        try:
+            return describe_function(**{argument: ids})
+        except (exception.EC2ResponseError,
+                exception.BotoServerError) as e:
+            if not_found_token in str(e):
+                return []
+            raise NonRecoverableError('{0}'.format(str(e)))
+
+    resources = describe(list(resource_ids))
+
+    if not resources and len(resource_ids) > 1:
+        # A single missing ID fails the whole request.
+        resources = [resource for resource_id in resource_ids
+                     for resource in describe([resource_id])]
+
+    return dict((getattr(resource, id_attribute), resource)
+                for resource in resources
+                if getattr(resource, id_attribute) in resource_ids)
+
+
+def _describe_by_ids_shared(cache_path, describe_function, argument,
+                            resource_ids, id_attribute, not_found_token,
+                            fields):
+    """Resolves resource IDs through the describe cache that the
+    operations of all processes on this host share.
+
+    Resources that are not cached are described with a single call by
+    the process that locks them first. Other processes wait for the
+    locks, and then read the resources from the cache.
+
+    :returns a dict of resource ID to a dict of the fields' values.
+    """
+
+    client = describe_function.__self__
+    cache_path = get_private_directory(cache_path)
+    _sweep_described(cache_path)
+    describe_key = hashlib.sha1('{0}\0{1}\0{2}\0{3}'.format(
+        describe_function.__name__, argument, id_attribute,
+        ','.join(fields))).hexdigest()
+    paths = dict(
+        (resource_id, os.path.join(cache_path, '{0}-{1}.json'.format(
+            _get_described_prefix(client, resource_id), describe_key)))
+        for resource_id in resource_ids)
+
+    def read_cached(ids):
+        cached = {}
+        for resource_id in ids:
+            values = _read_described(paths[resource_id])
+            if values is not None:
+                cached[resource_id] = values
+        return cached
+
+    resources = read_cached(resource_ids)
+    missing = resource_ids.difference(resources)
+
+    if not missing:
+        return resources
+
+    # A fixed number of locks, so that lock files do not pile up.
+    # Locking them in order keeps overlapping requests from deadlocking.
+    lock_numbers = sorted(set(
+        int(hashlib.sha1(paths[resource_id]).hexdigest(), 16) %
+        constants.DESCRIBE_CACHE_LOCKS for resource_id in missing))
+    locks = []
+    try:
+        for lock_number in lock_numbers:
+            locks.append(acquire_lock('describe-{0}'.format(lock_number)))
+
+        resources.update(read_cached(missing))
+        missing = missing.difference(resources)
+
+        if missing:
+            described = _describe_by_ids(
+                describe_function, argument, missing,
+                id_attribute, not_found_token)
+            for resource_id, resource in described.items():
+                values = _get_fields(resource, fields)
+                _write_described(cache_path, paths[resource_id], values)
+                resources[resource_id] = values
+    finally:
+        for lock in locks:
+            lock.close()
+
+    return resources
+
+
+def _get_fields(resource, fields):
+    return dict((field, getattr(resource, field)) for field in fields)
+
+
+def _get_record_type(name, fields):
+    """The record type of describe results with these fields.
+    """
+
+    record_type = _record_types.get((name, fields))
+    if record_type is None:
+        record_type = collections.namedtuple(name, fields)
+        _record_types[(name, fields)] = record_type
+    return record_type
+
+
+def _get_described_prefix(client, resource_id):
+    """The start of the cache file names of a resource. Names are only
+    unique within an account, so the access key is part of it.
+    """
+
+    return hashlib.sha1('{0}\0{1}\0{2}'.format(
+        client.host, client.aws_access_key_id, resource_id)).hexdigest()
+
+
+def _read_described(path):
+    """Returns the cached fields of a resource, or None if they are
+    missing or expired.
+    """
+
+    try:
+        with open(path, 'rb') as f:
+            entry = json.load(f)
+        expires_at, values = entry['expires_at'], entry['fields']
+    except (IOError, ValueError, KeyError, TypeError):
+        return None
+
+    if expires_at < time.time():
+        _remove_described(path)
+        return None
+
+    return values
+
+
+def _write_described(cache_path, path, values):
+
+    expires_at = time.time() + constants.DESCRIBE_CACHE_TTL
+    fd, temp_path = tempfile.mkstemp(dir=cache_path, suffix='.tmp')
+    with closing(os.fdopen(fd, 'wb')) as f:
+        json.dump({'expires_at': expires_at, 'fields': values}, f)
+    # Readers see either the old entry or the new one, never a partial one.
+    os.rename(temp_path, path)
+
+
+def _remove_described(path):
+    try:
+        os.remove(path)
+    except OSError as e:
+        if e.errno != errno.ENOENT:
+            raise
+
+
+def _sweep_described(cache_path):
+    """Removes the expired entries, and files of interrupted writes,
+    at most once per DESCRIBE_CACHE_TTL in each process.
+    """
+
+    now = time.time()
+    if now - _described_sweeps.get(cache_path, 0) < \
+            constants.DESCRIBE_CACHE_TTL:
+        return
+    _described_sweeps[cache_path] = now
+
+    for path in glob.glob(os.path.join(cache_path, '*.json')) + \
+            glob.glob(os.path.join(cache_path, '*.tmp')):
+        try:
+            expired = os.path.getmtime(path) + \
+                constants.DESCRIBE_CACHE_TTL < now
+        except OSError:
+            continue
+        if expired:
+            _remove_described(path)
+
+
+def describe_instance_fields(ec2_client, instance_ids, fields):
+    """Describes instances, but only reads the fields the caller needs
+    from the response, instead of building boto Instance objects.
+
+    :param ec2_client: An EC2Connection.
+    :param instance_ids: A list of instance IDs, or None for all instances.
+    :param fields: Names of boto Instance attributes that are in
+    INSTANCE_FIELD_PATHS.
+    :returns a list of records, with the id and the fields as attributes.
+    :raises EC2ResponseError: If the describe fails, like boto does.
+    """
+
+    fields = ('id',) + tuple(field for field in fields if field != 'id')
+    record_type = _get_record_type('InstanceRecord', fields)
+
+    params = {}
+    if instance_ids:
+        ec2_client.build_list_params(params, list(instance_ids), 'InstanceId')
+    else:
+        params['MaxResults'] = constants.DESCRIBE_PAGE_SIZE
+
+    records = []
+
+    while True:
+        response = ec2_client.make_request(
+            'DescribeInstances', params, verb='POST')
+        if response.status != 200:
+            raise ec2_client.ResponseError(
+                response.status, response.reason, response.read())
+        next_token = _parse_instance_fields(
+            response, fields, record_type, records)
+        if not next_token:
+            return records
+        params['NextToken'] = next_token
+
+
+def _parse_instance_fields(response, fields, record_type, records):
+    """Parses a DescribeInstances response while it is read, and appends
+    a record for every instance. Elements are discarded as soon as they
+    were read.
+
+    :returns the token of the next page, if any.
+    """
+
+    paths = dict(
+        (tuple(constants.INSTANCE_FIELD_PATHS[field].split('/')), index)
+        for index, field in enumerate(fields))
+    integers = [index for index, field in enumerate(fields)
+                if field in constants.INSTANCE_INTEGER_FIELDS]
+    # DescribeInstancesResponse/reservationSet/item/instancesSet/item
+    instance_depth = 5
+    stack = []
+    values = None
+    next_token = None
+
+    for event, element in cElementTree.iterparse(
+            response, events=('start', 'end')):
+        if event == 'start':
+            stack.append(element.tag.rpartition('}')[2])
+            if len(stack) == instance_depth and \
+                    stack[-2:] == ['instancesSet', 'item']:
+                values = [None] * len(fields)
+            continue
+
+        if values is not None and len(stack) == instance_depth:
+            for index in integers:
+                if values[index] is not None:
+                    values[index] = int(values[index])
+            records.append(record_type(*values))
+            values = None
+            element.clear()
+        elif values is not None:
+            index = paths.get(tuple(stack[instance_depth:]))
+            if index is not None:
+                values[index] = element.text
+        elif stack[1:] == ['nextToken']:
+            next_token = element.text
+        elif len(stack) == 3 and stack[1] == 'reservationSet':
+            element.clear()
+        stack.pop()
+
+    return next_token
+
+
+def get_private_directory(path):
+    """Creates a directory that only the agent's user can access, or
+    checks that an existing one is, because the plugin loads and locks
+    the files in it.
+
+    :returns the path.
+    :raises NonRecoverableError: If others can access the directory.
+    """
+
+    try:
+        os.makedirs(path, 0o700)
+    except OSError as e:
+        if e.errno != errno.EEXIST:
+            raise
+
+    directory_stat = os.stat(path)
+    if directory_stat.st_uid != os.getuid() or \
+            directory_stat.st_mode & 0o077:
+        raise NonRecoverableError(
+            'Unable to use {0}, because users other than the agent\'s '
+            'user can access it.'.format(path))
+
+    return path
+
+
+def get_lock_directory():
+    """The directory of the plugin's locks, and of the records that they
+    protect, which only the agent's user can access.
+    """
+
+    return get_private_directory(os.path.join(
+        tempfile.gettempdir(), 'cloudify-aws-locks-{0}'.format(os.getuid())))
+
+
+def acquire_lock(name):
+    """Returns an open lock file that is exclusively locked until it is
+    closed. The lock is shared by the operations of all processes
+    on this host.
+
+    :param name: The name of the lock.
+    """
+
+    lock = open(os.path.join(
+        get_lock_directory(), '{0}.lock'.format(name)), 'a')
+    fcntl.flock(lock, fcntl.LOCK_EX)
+    return lock
+
+
 def get_external_resource_id_or_raise(operation, ctx_instance):
     """Checks if the EXTERNAL_RESOURCE_ID runtime_property is set and returns it.
 
@@ -138,20 +562,77 @@ def get_target_external_resource_ids(relationship_type, ctx_instance):
     :returns a list of security group ids.
     """
 
-    ids = []
-
     if not getattr(ctx_instance, 'relationships', []):
         ctx.logger.info('Skipping attaching relationships, '
                         'because none are attached to this node.')
-        return ids
+        return []
+
+    relationships = []
+    index = get_relationship_index(ctx_instance)
+    for type_name, typed_relationships in index['by_type'].items():
+        if relationship_type in type_name:
+            relationships.extend(typed_relationships)
+
+    return [r.target.instance.runtime_properties[
+            constants.EXTERNAL_RESOURCE_ID]
+            for _, r in sorted(relationships)]
+
+
+def get_relationship_index(ctx_instance):
+    """Groups the relationships of a node instance by relationship type.
+    The index is built once for each node instance context, and rebuilt
+    if any of its relationships is added, removed or replaced. Building it
+    does not read the runtime properties of the targets.
+
+    :param ctx_instance: The CTX Node-Instance Context.
+    :returns a dict with by_type, a dict of relationship type to a list of
+    (position, relationship), and by_aws_type, a dict of target AWS type
+    to a list of relationships, filled by get_relationships_by_aws_type.
+    """
+
+    relationships = getattr(ctx_instance, 'relationships', None) or []
+    # The index holds the relationships, so their ids are not reused.
+    relationship_ids = tuple(id(r) for r in relationships)
+    index = _relationship_indexes.get(ctx_instance)
+
+    if index is None or index['relationship_ids'] != relationship_ids:
+        index = dict(relationship_ids=relationship_ids,
+                     by_type={}, by_aws_type={})
+        for position, r in enumerate(relationships):
+            index['by_type'].setdefault(r.type, []).append((position, r))
+        _relationship_indexes[ctx_instance] = index
+
+    return index
+
+
+def get_relationships_by_aws_type(ctx_instance, aws_type):
+    """Gets the relationships of a node instance to resources of an AWS
+    type. Only the targets of relationships that can connect to that type
+    are read.
+
+    :param ctx_instance: The CTX Node-Instance Context.
+    :param aws_type: The AWS type of the targets.
+    :returns a list of relationships, in the order of the node instance.
+    """
+
+    index = get_relationship_index(ctx_instance)
 
-    for r in ctx_instance.relationships:
-        if relationship_type in r.type:
-            ids.append(
-                r.target.instance.runtime_properties[
-                    constants.EXTERNAL_RESOURCE_ID])
+    if aws_type not in index['by_aws_type']:
+        relationship_types = constants.AWS_TYPE_RELATIONSHIPS.get(aws_type)
+        candidates = []
+        for type_name, typed_relationships in index['by_type'].items():
+            if relationship_types is None or \
+                    not type_name.startswith(
+                        constants.AWS_RELATIONSHIP_PREFIX) or \
+                    any(relationship_type in type_name
+                        for relationship_type in relationship_types):
+                candidates.extend(typed_relationships)
+        index['by_aws_type'][aws_type] = [
+            r for _, r in sorted(candidates)
+            if r.target.instance.runtime_properties.get(
+                constants.AWS_TYPE_PROPERTY) == aws_type]
 
-    return ids
+    return index['by_aws_type'][aws_type]
 
 
 def get_resource_id():
@@ -221,11 +702,8 @@ def get_single_connected_node_by_type(
 
 
 def get_connected_nodes_by_type(ctx, type_name):
-    return [rel.target.node for rel in ctx.instance.relationships
-            if rel.target.instance.runtime_properties.get(
-                constants.AWS_TYPE_PROPERTY) and
-            rel.target.instance.runtime_properties.get(
-                constants.AWS_TYPE_PROPERTY) == type_name]
+    return [rel.target.node
+            for rel in get_relationships_by_aws_type(ctx.instance, type_name)]
 
 
 def add_tag(resource):
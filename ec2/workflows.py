@@ -0,0 +1,676 @@
+########
+# Copyright (c) 2015 GigaSpaces Technologies Ltd. All rights reserved
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+#    * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    * See the License for the specific language governing permissions and
+#    * limitations under the License.
+
+# Built-in Imports
+import os
+import re
+import time
+
+# Third-party Imports
+import boto.exception
+
+# Cloudify imports
+from ec2 import utils
+from ec2 import keypair
+from ec2 import constants
+from ec2 import connection
+from vpc import constants as vpc_constants
+from vpc import connection as vpc_connection
+from cloudify import manager
+from cloudify.workflows import ctx
+from cloudify.exceptions import NonRecoverableError
+from cloudify.decorators import workflow
+from cloudify_rest_client.exceptions import CloudifyClientError
+
+
+@workflow
+def batch_start(node_ids=None, node_instance_ids=None,
+                wait_interval=15, timeout=1800, **_):
+    """Starts the EC2 instances of a deployment together.
+    """
+
+    _run_batch('start_instances', constants.INSTANCE_STATE_STARTED,
+               constants.NODE_INSTANCE_STATE_STARTED,
+               _instance_started_assign_runtime_properties,
+               node_ids, node_instance_ids, wait_interval, timeout)
+
+
+@workflow
+def batch_stop(node_ids=None, node_instance_ids=None,
+               wait_interval=15, timeout=1800, **_):
+    """Stops the EC2 instances of a deployment together.
+    """
+
+    _run_batch('stop_instances', constants.INSTANCE_STATE_STOPPED,
+               constants.NODE_INSTANCE_STATE_STOPPED,
+               _instance_stopped_unassign_runtime_properties,
+               node_ids, node_instance_ids, wait_interval, timeout)
+
+
+@workflow
+def batch_terminate(node_ids=None, node_instance_ids=None,
+                    wait_interval=15, timeout=1800, **_):
+    """Terminates the EC2 instances of a deployment together.
+    """
+
+    _run_batch('terminate_instances', constants.INSTANCE_STATE_TERMINATED,
+               constants.NODE_INSTANCE_STATE_DELETED,
+               _instance_terminated_unassign_runtime_properties,
+               node_ids, node_instance_ids, wait_interval, timeout)
+
+
+@workflow
+def refill_warm_pools(node_ids=None, **_):
+    """Refills the warm pools of the deployment's instances, and waits
+    until the instances of each pool are stopped. Instances that share a
+    pool refill it one after the other.
+    """
+
+    _execute_warm_pool_operation('refill', node_ids, all_instances=True)
+
+
+@workflow
+def drain_warm_pools(node_ids=None, **_):
+    """Terminates the unclaimed warm pool instances that the deployment's
+    nodes started.
+    """
+
+    _execute_warm_pool_operation('drain', node_ids, all_instances=False)
+
+
+@workflow
+def batch_creation_validation(**_):
+    """Validates the nodes of a deployment with a single describe call per
+    resource type and aws_config. It checks the required properties,
+    whether the supplied resource_id exists as use_external_resource
+    expects, that the images of instances are available and the local key
+    files of key pairs. Unlike the creation_validation operations, it
+    reports the errors of all nodes, including supplied IDs that EC2
+    rejects, such as malformed ones.
+    """
+
+    errors = _get_validation_errors(ctx.nodes)
+
+    for error in errors:
+        ctx.logger.error(error)
+
+    if errors:
+        raise NonRecoverableError(
+            'Validation failed with {0} errors.'.format(len(errors)))
+
+    ctx.logger.info('All AWS resources are valid.')
+
+
+def _execute_warm_pool_operation(operation_name, node_ids, all_instances):
+    """Executes an operation of the warm pool interface on the instances of
+    the nodes that have it, one after the other.
+
+    :param all_instances: whether to execute the operation on all of the
+    instances of a node, or only on its first instance.
+    """
+
+    operation = '{0}.{1}'.format(constants.WARM_POOL_INTERFACE,
+                                 operation_name)
+
+    for node in ctx.nodes:
+        if node_ids and node.id not in node_ids or \
+                operation not in node.operations:
+            continue
+        instances = list(node.instances)
+        if not all_instances:
+            instances = instances[:1]
+        for instance in instances:
+            instance.execute_operation(operation).get()
+
+
+def _get_validation_errors(nodes):
+    """Gathers the resource IDs of nodes by type and aws_config, resolves
+    each group with one describe call, and returns the validation errors
+    of all nodes.
+    """
+
+    errors = []
+    lookups = {}
+    image_lookups = {}
+
+    for node in nodes:
+        resource_type = _get_validation_type(node)
+        if not resource_type:
+            continue
+
+        for property_key in resource_type['required_properties']:
+            if property_key not in node.properties:
+                errors.append('{0}: {1} is a required input.'
+                              .format(node.id, property_key))
+
+        aws_config = node.properties.get(constants.AWS_CONFIG_PROPERTY) or {}
+        config_key = tuple(sorted(aws_config.items()))
+
+        resource_id = node.properties.get('resource_id')
+        if resource_id:
+            lookup = lookups.setdefault(
+                (config_key, resource_type['node_type'],
+                 _get_validation_argument(resource_type, resource_id)),
+                dict(aws_config=aws_config, resource_type=resource_type,
+                     nodes={}))
+            lookup['nodes'][node.id] = (resource_id, node)
+        elif node.properties['use_external_resource']:
+            errors.append(
+                '{0}: External resource, but no resource_id was supplied.'
+                .format(node.id))
+        elif 'validate' in resource_type:
+            errors.extend(resource_type['validate'](node, None))
+
+        if resource_type['node_type'] == constants.INSTANCE_NODE_TYPE and \
+                node.properties.get('image_id'):
+            image_lookup = image_lookups.setdefault(
+                config_key, dict(aws_config=aws_config, nodes={}))
+            image_lookup['nodes'][node.id] = node.properties['image_id']
+
+    for lookup in lookups.values():
+        errors.extend(_validate_resources(lookup))
+
+    for image_lookup in image_lookups.values():
+        errors.extend(_validate_images(image_lookup))
+
+    return errors
+
+
+def _validation_types():
+    """The node types that batch_creation_validation validates.
+    """
+
+    ec2_client = connection.EC2ConnectionClient
+    vpc_client = vpc_connection.VPCConnectionClient
+
+    validation_types = [
+        dict(node_type=constants.INSTANCE_NODE_TYPE,
+             name='instance', client=ec2_client,
+             describe='get_only_instances', argument='instance_ids',
+             required_properties=constants.INSTANCE_REQUIRED_PROPERTIES),
+        dict(node_type='cloudify.aws.nodes.Volume',
+             name='EBS volume', client=ec2_client,
+             describe='get_all_volumes', argument='volume_ids',
+             required_properties=constants.VOLUME_REQUIRED_PROPERTIES),
+        dict(node_type='cloudify.aws.nodes.SecurityGroup',
+             name='security group', client=ec2_client,
+             describe='get_all_security_groups', argument='group_ids',
+             name_argument='groupnames', id_format=r'^sg\-[0-9a-z]{8}$',
+             required_properties=(
+                 constants.SECURITY_GROUP_REQUIRED_PROPERTIES)),
+        dict(node_type='cloudify.aws.nodes.KeyPair',
+             name='key pair', client=ec2_client,
+             describe='get_all_key_pairs', argument='keynames',
+             id_attribute='name', validate=_validate_key_files,
+             required_properties=constants.KEYPAIR_REQUIRED_PROPERTIES),
+        dict(node_type='cloudify.aws.nodes.ElasticIP',
+             name='elasticip', client=ec2_client,
+             describe='get_all_addresses', argument='addresses',
+             id_attribute='public_ip', required_properties=[]),
+        dict(node_type='cloudify.aws.nodes.ElasticLoadBalancer',
+             name='elb', client=connection.ELBConnectionClient,
+             describe='get_all_load_balancers',
+             argument='load_balancer_names', id_attribute='name',
+             not_found_token='LoadBalancerNotFound',
+             required_properties=constants.ELB_REQUIRED_PROPERTIES)
+    ]
+
+    for vpc_type in [vpc_constants.VPC, vpc_constants.SUBNET,
+                     vpc_constants.ROUTE_TABLE, vpc_constants.NETWORK_ACL,
+                     vpc_constants.INTERNET_GATEWAY,
+                     vpc_constants.VPN_GATEWAY,
+                     vpc_constants.CUSTOMER_GATEWAY,
+                     vpc_constants.DHCP_OPTIONS]:
+        aws_resource_type = vpc_type['AWS_RESOURCE_TYPE']
+        validation_types.append(dict(
+            node_type=vpc_type['CLOUDIFY_NODE_TYPE'],
+            name=aws_resource_type, client=vpc_client,
+            describe='get_all_{0}'.format(
+                aws_resource_type if aws_resource_type.endswith('s')
+                else aws_resource_type + 's'),
+            argument='{0}_ids'.format(aws_resource_type),
+            not_found_token=vpc_type['NOT_FOUND_ERROR'],
+            required_properties=vpc_type['REQUIRED_PROPERTIES']))
+
+    return validation_types
+
+
+def _get_validation_type(node):
+
+    for resource_type in _validation_types():
+        if resource_type['node_type'] in node.type_hierarchy:
+            return resource_type
+
+    return None
+
+
+def _get_validation_argument(resource_type, resource_id):
+    """Returns the describe argument and ID attribute that resolve
+    resource_id. Security groups are looked up either by ID or by name.
+    """
+
+    if 'name_argument' in resource_type and \
+            not re.match(resource_type['id_format'], resource_id):
+        return resource_type['name_argument'], 'name'
+
+    return resource_type['argument'], resource_type.get('id_attribute', 'id')
+
+
+def _validate_resources(lookup):
+    """Resolves the resource IDs of all nodes in lookup with one describe
+    call, and returns the validation errors of those nodes. The nodes of
+    IDs that cannot be described get the error.
+    """
+
+    resource_type = lookup['resource_type']
+    resource_ids = [resource_id for resource_id, _ in
+                    lookup['nodes'].values()]
+    argument, id_attribute = _get_validation_argument(
+        resource_type, resource_ids[0])
+
+    client = resource_type['client']().client(lookup['aws_config'])
+
+    def describe(ids):
+        return utils.describe_by_ids(
+            getattr(client, resource_type['describe']), argument, ids,
+            id_attribute=id_attribute,
+            not_found_token=resource_type.get('not_found_token', 'NotFound'),
+            fields=())
+
+    resources, failures = _describe_each_on_failure(describe, resource_ids)
+    errors = []
+
+    for node_id, (resource_id, node) in lookup['nodes'].items():
+        external = node.properties['use_external_resource']
+        if resource_id in failures:
+            errors.append(
+                '{0}: Unable to look up the supplied {1} {2}: {3}'
+                .format(node_id, resource_type['name'], resource_id,
+                        failures[resource_id]))
+            continue
+        if external and resource_id not in resources:
+            errors.append(
+                '{0}: External resource, but the supplied {1} {2} '
+                'does not exist in the account.'
+                .format(node_id, resource_type['name'], resource_id))
+        elif not external and resource_id in resources:
+            errors.append(
+                '{0}: Not external resource, but the supplied {1} {2} '
+                'exists in the account.'
+                .format(node_id, resource_type['name'], resource_id))
+        if 'validate' in resource_type:
+            errors.extend(resource_type['validate'](
+                node, resources.get(resource_id)))
+
+    return errors
+
+
+def _describe_each_on_failure(describe, resource_ids):
+    """Describes resource IDs with one call. If the call fails, for
+    example because one of the IDs is malformed, each ID is described on
+    its own.
+
+    :param describe: A function that takes a list of IDs and returns a
+    dict of ID to resource.
+    :param resource_ids: A list of resource IDs.
+    :returns a dict of ID to resource, and a dict of ID to the error of
+    the IDs that could not be described.
+    """
+
+    failures = {}
+    try:
+        resources = describe(resource_ids)
+    except NonRecoverableError:
+        resources = {}
+        for resource_id in set(resource_ids):
+            try:
+                resources.update(describe([resource_id]))
+            except NonRecoverableError as e:
+                failures[resource_id] = str(e)
+
+    return resources, failures
+
+
+def _validate_key_files(node, key_pair):
+    """Checks the local key files of a key pair node, as the key pair
+    creation_validation operation does.
+
+    :param node: The key pair node.
+    :param key_pair: The boto key pair in the account, or None.
+    :returns a list of validation errors.
+    """
+
+    if 'private_key_path' not in node.properties:
+        return []
+
+    key_file = os.path.expanduser(node.properties['private_key_path'])
+    public_key_file = node.properties.get('public_key_path')
+    if public_key_file:
+        public_key_file = os.path.expanduser(public_key_file)
+
+    errors = []
+
+    if public_key_file and not os.path.exists(public_key_file):
+        errors.append(
+            '{0}: The public key file {1} does not exist locally.'
+            .format(node.id, public_key_file))
+        public_key_file = None
+
+    if node.properties['use_external_resource']:
+        if not os.path.exists(key_file):
+            errors.append(
+                '{0}: External resource, but the key file does not exist '
+                'locally.'.format(node.id))
+        elif key_pair:
+            fingerprints = keypair._get_key_file_fingerprints(
+                public_key_file or key_file, logger=ctx.logger)
+            if fingerprints and \
+                    key_pair.fingerprint.lower() not in fingerprints:
+                errors.append(
+                    '{0}: External resource, but the key pair fingerprint '
+                    '{1} does not match the local key file.'
+                    .format(node.id, key_pair.fingerprint))
+    elif node.properties.get('public_key_path'):
+        if not os.path.exists(key_file):
+            errors.append(
+                '{0}: Importing a public key, but the key file does not '
+                'exist locally.'.format(node.id))
+    elif os.path.exists(key_file):
+        errors.append(
+            '{0}: Not external resource, but the key file exists locally.'
+            .format(node.id))
+
+    return errors
+
+
+def _validate_images(image_lookup):
+    """Resolves the images of all instance nodes in image_lookup with one
+    describe call, and returns the validation errors of those nodes. The
+    nodes of images that cannot be described get the error.
+    """
+
+    client = connection.EC2ConnectionClient().client(
+        image_lookup['aws_config'])
+
+    def describe(ids):
+        return utils.describe_by_ids(
+            client.get_all_images, 'image_ids', ids,
+            not_found_token='InvalidAMIID', fields=('state',))
+
+    images, failures = _describe_each_on_failure(
+        describe, image_lookup['nodes'].values())
+    errors = []
+
+    for node_id, image_id in image_lookup['nodes'].items():
+        if image_id in failures:
+            errors.append(
+                '{0}: Unable to look up the supplied image_id {1}: {2}'
+                .format(node_id, image_id, failures[image_id]))
+        elif image_id not in images or \
+                'available' not in images[image_id].state:
+            errors.append(
+                '{0}: image_id {1} not available to this account.'
+                .format(node_id, image_id))
+
+    return errors
+
+
+def _run_batch(action, state_code, node_instance_state,
+               update_runtime_properties,
+               node_ids, node_instance_ids, wait_interval, timeout):
+    """Calls action for the selected instances, with one request for every
+    BATCH_INSTANCE_IDS_LIMIT instances, waits for all of them to reach
+    state_code and updates the runtime properties and state of their
+    node instances.
+
+    :param action: The name of the EC2Connection method to call.
+    :param state_code: The instance state code that action leads to.
+    :param node_instance_state: The node instance state that action
+    leads to.
+    :param update_runtime_properties: Called with the runtime properties
+    of a node instance, and its boto instance object, once it is in state.
+    :raises NonRecoverableError: If some instances did not reach state
+    before the timeout.
+    """
+
+    node_instances = _get_batch_node_instances(node_ids, node_instance_ids)
+
+    if not node_instances:
+        ctx.logger.info('No EC2 instances selected.')
+        return
+
+    groups = _group_by_aws_config(node_instances)
+
+    for ec2_client, instance_ids in groups:
+        for chunk in _chunks(instance_ids):
+            ctx.logger.info(
+                'Calling {0} for {1} instances.'.format(action, len(chunk)))
+            try:
+                getattr(ec2_client, action)(chunk)
+            except (boto.exception.EC2ResponseError,
+                    boto.exception.BotoServerError) as e:
+                raise NonRecoverableError('{0}'.format(str(e)))
+
+    instances = _wait_for_state(groups, state_code, wait_interval, timeout)
+
+    not_in_state = []
+
+    for node_instance in node_instances:
+        instance_id = node_instance.runtime_properties[
+            constants.EXTERNAL_RESOURCE_ID]
+        if instance_id not in instances:
+            not_in_state.append(node_instance.id)
+            continue
+        _update_node_instance(
+            node_instance.id, node_instance_state,
+            update_runtime_properties, instances[instance_id])
+
+    if not_in_state:
+        raise NonRecoverableError(
+            'Timed out waiting for node instances {0} after {1}.'
+            .format(not_in_state, action))
+
+
+def _get_batch_node_instances(node_ids, node_instance_ids):
+    """Returns the node instances of the deployment that are EC2 instances
+    created by Cloudify, optionally limited to the given nodes or node
+    instances.
+    """
+
+    node_instances = []
+
+    for node_instance in _list_node_instances():
+        if node_ids and node_instance.node_id not in node_ids:
+            continue
+        if node_instance_ids and node_instance.id not in node_instance_ids:
+            continue
+        node = ctx.get_node(node_instance.node_id)
+        if constants.INSTANCE_NODE_TYPE not in node.type_hierarchy or \
+                node.properties['use_external_resource'] or \
+                constants.EXTERNAL_RESOURCE_ID not in \
+                node_instance.runtime_properties:
+            continue
+        node_instances.append(node_instance)
+
+    return node_instances
+
+
+def _list_node_instances():
+    """Returns the node instances of the deployment, from the local storage
+    of a local workflow, and otherwise from the manager.
+    """
+
+    if ctx.local:
+        return ctx.internal.handler.storage.get_node_instances()
+
+    return manager.get_rest_client().node_instances.list(
+        deployment_id=ctx.deployment.id)
+
+
+def _get_node_instance(node_instance_id):
+
+    if ctx.local:
+        return ctx.internal.handler.storage.get_node_instance(
+            node_instance_id)
+
+    return manager.get_rest_client().node_instances.get(node_instance_id)
+
+
+def _save_node_instance(node_instance_id, state, runtime_properties,
+                        version):
+    """Saves the state and runtime properties of a node instance, if it
+    was not changed since version was read.
+
+    :returns False if the node instance was changed since it was read.
+    """
+
+    if ctx.local:
+        # Not imported at the module level, because it imports the DSL
+        # parser, which only local workflows need.
+        from cloudify.workflows.local import StorageConflictError
+        storage = ctx.internal.handler.storage
+        try:
+            storage.update_node_instance(
+                node_instance_id, version=version,
+                runtime_properties=runtime_properties)
+        except StorageConflictError:
+            return False
+        # The local storage does not check the version of state updates.
+        storage.update_node_instance(
+            node_instance_id, version=None, state=state)
+        return True
+
+    try:
+        manager.get_rest_client().node_instances.update(
+            node_instance_id, state=state,
+            runtime_properties=runtime_properties, version=version)
+    except CloudifyClientError as e:
+        if e.status_code != 409:
+            raise
+        return False
+    return True
+
+
+def _update_node_instance(node_instance_id, state,
+                          update_runtime_properties, instance):
+    """Updates the runtime properties and state of a node instance. If the
+    node instance was changed by someone else in the meantime, it is read
+    again and the update is retried.
+
+    :raises NonRecoverableError: If the node instance kept changing for
+    BATCH_UPDATE_ATTEMPTS attempts.
+    """
+
+    for _ in xrange(constants.BATCH_UPDATE_ATTEMPTS):
+        node_instance = _get_node_instance(node_instance_id)
+        runtime_properties = dict(node_instance.runtime_properties)
+        update_runtime_properties(runtime_properties, instance)
+        if _save_node_instance(node_instance_id, state,
+                               runtime_properties, node_instance.version):
+            return
+
+    raise NonRecoverableError(
+        'Unable to update node instance {0}, because it kept changing.'
+        .format(node_instance_id))
+
+
+def _group_by_aws_config(node_instances):
+    """Groups the instance IDs of node instances by the aws_config of their
+    nodes.
+
+    :returns a list of (EC2 client, list of instance IDs).
+    """
+
+    groups = {}
+
+    for node_instance in node_instances:
+        aws_config = ctx.get_node(node_instance.node_id).properties.get(
+            constants.AWS_CONFIG_PROPERTY) or {}
+        key = tuple(sorted(aws_config.items()))
+        if key not in groups:
+            groups[key] = (
+                connection.EC2ConnectionClient().client(aws_config), [])
+        groups[key][1].append(
+            node_instance.runtime_properties[constants.EXTERNAL_RESOURCE_ID])
+
+    return groups.values()
+
+
+def _wait_for_state(groups, state_code, wait_interval, timeout):
+    """Polls all instances together until they are all in state_code.
+
+    :returns a dict of instance ID to a record of the instance's
+    state and runtime property attributes, for the instances that
+    reached the state before the timeout.
+    """
+
+    fields = ['state_code'] + [
+        constants.INSTANCE_RUNTIME_PROPERTY_ATTRIBUTES.get(name, name)
+        for name in constants.INSTANCE_INTERNAL_ATTRIBUTES]
+    instances = {}
+    deadline = time.time() + timeout
+
+    while True:
+        for ec2_client, instance_ids in groups:
+            pending = [i for i in instance_ids if i not in instances]
+            for chunk in _chunks(pending):
+                try:
+                    described = utils.describe_instance_fields(
+                        ec2_client, chunk, fields)
+                except (boto.exception.EC2ResponseError,
+                        boto.exception.BotoServerError) as e:
+                    raise NonRecoverableError('{0}'.format(str(e)))
+                instances.update(
+                    (instance.id, instance) for instance in described
+                    if instance.state_code == state_code)
+
+        pending_count = sum(
+            len([i for i in instance_ids if i not in instances])
+            for _, instance_ids in groups)
+        if not pending_count or time.time() + wait_interval > deadline:
+            return instances
+
+        ctx.logger.info(
+            'Waiting for {0} instances. Retrying in {1} seconds...'
+            .format(pending_count, wait_interval))
+        time.sleep(wait_interval)
+
+
+def _chunks(instance_ids):
+    limit = constants.BATCH_INSTANCE_IDS_LIMIT
+    for start in xrange(0, len(instance_ids), limit):
+        yield instance_ids[start:start + limit]
+
+
+def _instance_started_assign_runtime_properties(runtime_properties,
+                                                instance):
+
+    for property_name in constants.INSTANCE_INTERNAL_ATTRIBUTES:
+        attribute = constants.INSTANCE_RUNTIME_PROPERTY_ATTRIBUTES.get(
+            property_name, property_name)
+        runtime_properties[property_name] = getattr(instance, attribute)
+
+
+def _instance_stopped_unassign_runtime_properties(runtime_properties, _):
+
+    for property_name in constants.INSTANCE_INTERNAL_ATTRIBUTES:
+        runtime_properties.pop(property_name, None)
+
+
+def _instance_terminated_unassign_runtime_properties(runtime_properties, _):
+
+    for property_name in constants.INSTANCE_INTERNAL_ATTRIBUTES:
+        runtime_properties.pop(property_name, None)
+    runtime_properties.pop(constants.EXTERNAL_RESOURCE_ID, None)
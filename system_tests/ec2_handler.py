@@ -19,6 +19,7 @@ from contextlib import contextmanager
 
 from boto.ec2 import get_region
 from boto.ec2 import EC2Connection
+from boto.ec2.snapshot import Snapshot
 from boto.vpc import VPCConnection
 from boto.ec2.elb import connect_to_region as connect_to_elb_region
 from boto.exception import EC2ResponseError
@@ -418,9 +419,10 @@ class EC2Handler(BaseHandler):
                 if 'default' not in security_group.name]
 
     def _instances(self, ec2_client):
-        return [(instance[0].id, instance[0].id)
-                for instance in
-                [res.instances for res in ec2_client.get_all_reservations()]]
+        return [(instance.id, instance.id)
+                for res in self._pages(ec2_client.get_all_reservations,
+                                       max_results=1000)
+                for instance in res.instances]
 
     def _key_pairs(self, ec2_client):
         return [(kp.name, kp.name)
@@ -435,8 +437,25 @@ class EC2Handler(BaseHandler):
                 for vol in ec2_client.get_all_volumes()]
 
     def _snapshots(self, ec2_client):
-        return [(ss.id, ss.id)
-                for ss in ec2_client.get_all_snapshots(owner='self')]
+        # get_all_snapshots does not paginate, so page through
+        # DescribeSnapshots directly
+        def get_snapshots_page(next_token=None):
+            params = {'Owner.1': 'self', 'MaxResults': 1000}
+            if next_token:
+                params['NextToken'] = next_token
+            return ec2_client.get_list('DescribeSnapshots', params,
+                                       [('item', Snapshot)], verb='POST')
+
+        return [(ss.id, ss.id) for ss in self._pages(get_snapshots_page)]
+
+    def _pages(self, list_function, **kwargs):
+        while True:
+            page = list_function(**kwargs)
+            for resource in page:
+                yield resource
+            if not page.next_token:
+                return
+            kwargs['next_token'] = page.next_token
 
     def _elbs(self, elb_client):
         return [(elb.name, elb.name)
@@ -623,7 +623,7 @@ class EC2InstanceUnitTests(EC2LocalTestUtils):
 
         image_object = instance._get_image(
             self.env.ubuntu_trusty_image_id)
-        self.assertEqual(image_object.id,
+        self.assertEqual(image_object['id'],
                          self.env.ubuntu_trusty_image_id)
 
     def test_instance_external_invalid_instance(self):
@@ -14,35 +14,28 @@
 #    * limitations under the License.
 
 # Third-party Imports
-from boto.ec2 import get_region
 from boto.vpc import VPCConnection
 
 # Cloudify imports
 from ec2.connection import EC2ConnectionClient
-from ec2 import utils as ec2_utils
-from ec2 import constants
+from ec2.connection import _get_region
 
 
 class VPCConnectionClient(EC2ConnectionClient):
     """Provides functions for getting the VPC Client
     """
 
-    def client(self, aws_config=None):
-        """Represents the VPCConnection Client
+    def _connect(self, aws_config_property):
+        """Opens a new VPCConnection
         """
 
-        aws_config_property = (self._get_aws_config_property(aws_config) or
-                               self._get_aws_config_from_file())
         if not aws_config_property:
-            return VPCConnection()
+            return VPCConnection(**self.credentials_cleanup({}))
         elif aws_config_property.get('ec2_region_name'):
-            region_object = \
-                get_region(aws_config_property['ec2_region_name'])
             aws_config = aws_config_property.copy()
-            if region_object and 'ec2_region_endpoint' in aws_config_property:
-                region_object.endpoint = \
-                    aws_config_property['ec2_region_endpoint']
-            aws_config['region'] = region_object
+            aws_config['region'] = _get_region(
+                aws_config_property['ec2_region_name'],
+                aws_config_property.get('ec2_region_endpoint'))
         else:
             aws_config = aws_config_property.copy()
 
@@ -54,11 +47,4 @@ class VPCConnectionClient(EC2ConnectionClient):
         if 'ec2_region_endpoint' in aws_config:
             del(aws_config["ec2_region_endpoint"])
 
-        return VPCConnection(**aws_config)
-
-    def _get_aws_config_property(self, aws_config=None):
-        if aws_config:
-            return aws_config
-        node_properties = \
-            ec2_utils.get_instance_or_source_node_properties()
-        return node_properties[constants.AWS_CONFIG_PROPERTY]
+        return VPCConnection(**self.credentials_cleanup(aws_config))
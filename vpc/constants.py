@@ -31,7 +31,8 @@ SUBNET = dict(
     CLOUDIFY_NODE_TYPE='cloudify.aws.nodes.Subnet',
     ID_FORMAT='^subnet\-[0-9a-z]{8}$',
     NOT_FOUND_ERROR='InvalidSubnetID.NotFound',
-    REQUIRED_PROPERTIES=['cidr_block']
+    REQUIRED_PROPERTIES=['cidr_block'],
+    RUNTIME_PROPERTIES=['vpc_id', 'availability_zone']
 )
 
 ROUTE_TABLE = dict(
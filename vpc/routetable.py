@@ -167,6 +167,7 @@ class RouteTable(AwsBaseNode, RouteMixin):
         route_table = \
             self.execute(self.client.create_route_table,
                          create_args, raise_on_falsy=True)
+        self.resource = route_table
         self.resource_id = route_table.id
         for route in self.routes:
             self.create_route(route_table.id, route, ctx.instance)
@@ -193,8 +194,11 @@ class RouteTable(AwsBaseNode, RouteMixin):
         return vpc
 
     def post_create(self):
-        vpc = self.get_containing_vpc()
-        ctx.instance.runtime_properties['vpc_id'] = vpc.id
+        if self.resource is not None:
+            vpc_id = self.resource.vpc_id
+        else:
+            vpc_id = self.get_containing_vpc().id
+        ctx.instance.runtime_properties['vpc_id'] = vpc_id
         ctx.instance.runtime_properties['routes'] = self.routes
         ec2_utils.set_external_resource_id(self.resource_id, ctx.instance)
         ctx.logger.info(
@@ -53,12 +53,14 @@ class Subnet(AwsBaseNode):
             'function': self.client.get_all_subnets,
             'argument': '{0}_ids'.format(constants.SUBNET['AWS_RESOURCE_TYPE'])
         }
+        self.resource_runtime_properties = \
+            constants.SUBNET['RUNTIME_PROPERTIES']
 
     def create(self):
         create_args = self._generate_creation_args()
-        subnet = self.execute(self.client.create_subnet,
-                              create_args, raise_on_falsy=True)
-        self.resource_id = subnet.id
+        self.resource = self.execute(self.client.create_subnet,
+                                     create_args, raise_on_falsy=True)
+        self.resource_id = self.resource.id
         return True
 
     def _generate_creation_args(self):
@@ -153,6 +153,49 @@ class TestSubnetModule(VpcTestCase):
         self.assertEquals(subnet_object.tags.get('deployment_id'),
                           ctx.deployment.id)
 
+    @mock_ec2
+    def test_create_sets_runtime_properties(self, *_):
+        ctx = self.get_mock_subnet_node_instance_context(
+            'test_create_sets_runtime_properties')
+
+        vpc_client = self.create_client()
+        vpc = vpc_client.create_vpc(TEST_VPC_CIDR)
+        create_args = dict(vpc_id=vpc.id, cidr_block=TEST_SUBNET_CIDR)
+        with mock.patch('vpc.subnet.Subnet._generate_creation_args',
+                        return_value=create_args), \
+                mock.patch('core.base.AwsBaseNode.get_resource') \
+                as describe:
+            subnet.create_subnet(ctx=ctx)
+        self.assertFalse(describe.called)
+        self.assertEqual(vpc.id, ctx.instance.runtime_properties['vpc_id'])
+        self.assertIn('availability_zone', ctx.instance.runtime_properties)
+
+    @mock_ec2
+    def test_get_resources(self, *_):
+        ctx = self.get_mock_subnet_node_instance_context('test_get_resources')
+        current_ctx.set(ctx=ctx)
+
+        vpc_client = self.create_client()
+        vpc = vpc_client.create_vpc(TEST_VPC_CIDR)
+        subnet_ids = [
+            vpc_client.create_subnet(vpc.id, cidr_block).id
+            for cidr_block in ['10.10.10.0/24', '10.10.11.0/24']]
+
+        subnet_node = subnet.Subnet()
+        resources = subnet_node.get_resources(subnet_ids)
+        self.assertEqual(set(subnet_ids), set(resources.keys()))
+
+        resources = subnet_node.get_resources(
+            subnet_ids + ['subnet-0123abcd'])
+        self.assertEqual(set(subnet_ids), set(resources.keys()))
+
+        with mock.patch.object(vpc_client.__class__,
+                               'get_all_subnets') as mock_get_all_subnets:
+            self.assertEqual({}, subnet_node.get_resources(['']))
+            self.assertIsNone(subnet_node.filter_for_single_resource(
+                vpc_client.get_all_subnets, {'subnet_ids': ''}))
+        self.assertFalse(mock_get_all_subnets.called)
+
 
 class TestRouteTableModule(VpcTestCase):
 
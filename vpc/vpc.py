@@ -261,13 +261,13 @@ class Vpc(AwsBaseNode):
         if not self.is_external_resource:
             return False
 
-        resource = self.get_resource()
+        self.resource = self.get_resource()
 
-        if not resource:
+        if not self.resource:
             self.raise_forbidden_external_resource(self.resource_id)
 
         ctx.instance.runtime_properties['default_dhcp_options_id'] = \
-            resource.dhcp_options_id
+            self.resource.dhcp_options_id
 
         return True
 
@@ -280,6 +280,7 @@ class Vpc(AwsBaseNode):
 
         vpc = self.execute(self.client.create_vpc,
                            create_args, raise_on_falsy=True)
+        self.resource = vpc
         self.resource_id = vpc.id
         ctx.instance.runtime_properties['default_dhcp_options_id'] = \
             vpc.dhcp_options_id